@@ -0,0 +1,54 @@
+"""
+Throughput of the ASGI entry point (uvicorn + async engine) against the
+WSGI one (gunicorn sync workers) on the same database, at increasing
+concurrency.
+
+    python benchmarks/asgi_vs_wsgi.py --workers 4 --concurrency 16,64,256
+
+Both servers must be installed (pipenv install gunicorn uvicorn asgiref
+plus the async driver). Set DATABASE_URL to run against Postgres instead
+of the scratch SQLite file.
+"""
+import argparse
+import json
+import sys
+
+import common
+from app import app
+from models import db
+import loadgen
+
+PATHS = ['/characters', '/planets?limit=50', '/planet/1', '/characters/7', '/user/1/favorites', '/user/2/favorites']
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', default='16,64,256')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    common.reset_database(app, db)
+    common.seed(app, db, users=100, characters=2000, planets=500, favorites=5000)
+
+    results = []
+    for mode in ('wsgi', 'asgi'):
+        process = common.start_server(mode, args.port, args.workers)
+        try:
+            for concurrency in [int(value) for value in args.concurrency.split(',')]:
+                result = loadgen.run_load(f'http://127.0.0.1:{args.port}', PATHS, concurrency, args.duration)
+                result['mode'] = mode
+                results.append(result)
+                print(f"{mode}  c={concurrency:<4} {result['throughput_rps']:9.1f} req/s  p50 {result['p50_ms']:7.2f} ms"
+                      f"  p99 {result['p99_ms']:8.2f} ms  errors {result['errors']}")
+        finally:
+            process.terminate()
+            process.wait()
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
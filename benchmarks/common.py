@@ -0,0 +1,88 @@
+"""
+Shared setup for the benchmark scripts: point the app at a scratch database
+and seed it with Core executemany inserts.
+
+Import this module before anything from src/, it sets DATABASE_URL, turns
+rate limiting off and puts src/ on sys.path the same way
+`gunicorn --chdir ./src/` does.
+"""
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, os.path.abspath(SRC))
+os.environ.setdefault('DATABASE_URL', 'sqlite:////tmp/starwars_bench.db')
+# the benchmarks hammer the app from one address on purpose
+os.environ.setdefault('RATELIMIT_ENABLED', '0')
+
+def reset_database(app, db):
+    url = app.config['SQLALCHEMY_DATABASE_URI']
+    if url.startswith('sqlite:///') and os.path.exists(url[len('sqlite:///'):]):
+        os.remove(url[len('sqlite:///'):])
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+def insert_batches(db, model, rows, batch_size=10000):
+    rows = iter(rows)
+    while True:
+        batch = [row for _, row in zip(range(batch_size), rows)]
+        if not batch:
+            break
+        db.session.execute(db.insert(model), batch)
+    db.session.commit()
+
+def favorite_pairs(start, stop, characters):
+    """
+    Deterministic distinct (user_id, character_id) pairs, pair i belongs
+    to user i // characters + 1.
+    """
+    for i in range(start, stop):
+        yield {'user_id': i // characters + 1, 'character_id': i % characters + 1}
+
+def seed(app, db, users=100, characters=100, planets=100, favorites=0):
+    from models import User, Planets, Characters, FavoriteCharacters, FavoritePlanets
+    with app.app_context():
+        insert_batches(db, User, ({'email': f'user{i}@example.com', 'password': 'secret', 'is_active': True} for i in range(users)))
+        insert_batches(db, Characters, ({'name': f'character {i}', 'height': 100 + i % 120, 'mass': 40 + i % 90,
+                                         'gender': ('male', 'female', 'n/a')[i % 3]} for i in range(characters)))
+        insert_batches(db, Planets, ({'name': f'planet {i}', 'population': i * 1000} for i in range(planets)))
+        insert_batches(db, FavoriteCharacters, favorite_pairs(0, favorites, characters))
+        insert_batches(db, FavoritePlanets, ({'user_id': i // planets + 1, 'planet_id': i % planets + 1}
+                                             for i in range(min(favorites, users * planets))))
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def start_server(mode, port, workers, extra_args=(), env=None, ready_path='/planet/1'):
+    """
+    Start gunicorn (mode='wsgi') or uvicorn (mode='asgi') on the app and
+    wait until ready_path answers. gunicorn picks up ./gunicorn.conf.py
+    when run from the repository root.
+    """
+    src = os.path.abspath(SRC)
+    if mode == 'wsgi':
+        command = ['gunicorn', 'wsgi', '--chdir', src, '--workers', str(workers), '--bind', f'127.0.0.1:{port}']
+    else:
+        command = ['uvicorn', 'asgi:application', '--app-dir', src, '--workers', str(workers),
+                   '--port', str(port), '--log-level', 'warning', '--no-access-log']
+    process = subprocess.Popen(command + list(extra_args), env=dict(os.environ, **(env or {})),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}{ready_path}', timeout=1)
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'{mode} server did not start on port {port}')
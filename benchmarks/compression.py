@@ -0,0 +1,72 @@
+"""
+Bandwidth and CPU cost of response compression on the list endpoints.
+
+For every page size and encoding it reports the body size on the wire, the
+CPU time spent compressing one body, and the request latency through the
+app for the first request (view + compress + store) and for repeat
+requests served from the compressed response cache.
+
+    python benchmarks/compression.py --characters 20000 --limits 10,100,1000
+"""
+import argparse
+import json
+import sys
+import time
+
+import common
+from app import app
+from models import db
+import cache
+import compression
+
+def cpu_time(fn, body, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.process_time()
+        fn(body)
+        best = min(best, time.process_time() - start)
+    return best
+
+def request_times(client, path, encoding, repeat):
+    """
+    (first request, best repeat request, response) for path, the cache is
+    cleared first so the first request compresses
+    """
+    headers = {'Accept-Encoding': encoding} if encoding else {}
+    cache.cache.clear()
+    first, response = common.timed(client.get, path, headers=headers)
+    repeats = [common.timed(client.get, path, headers=headers)[0] for _ in range(repeat)]
+    return first, min(repeats), response
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--characters', type=int, default=20000)
+    parser.add_argument('--limits', default='10,100,1000')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    common.reset_database(app, db)
+    common.seed(app, db, users=1, characters=args.characters, planets=1)
+    client = app.test_client()
+    report = []
+    for limit in [int(limit) for limit in args.limits.split(',')]:
+        path = f'/characters?limit={limit}&fields=id,name,height,Mass,gender'
+        identity_first, identity_repeat, response = request_times(client, path, None, args.repeat)
+        raw = response.get_data()
+        print(f'limit={limit}: identity {len(raw)} bytes, first {identity_first * 1000:.2f} ms, repeat {identity_repeat * 1000:.2f} ms')
+        for encoding, compress in compression.codecs.items():
+            first, repeat, response = request_times(client, path, encoding, args.repeat)
+            size = len(response.get_data())
+            cpu = cpu_time(compress, raw, args.repeat)
+            row = {'limit': limit, 'encoding': encoding, 'raw_bytes': len(raw), 'wire_bytes': size,
+                   'ratio': len(raw) / size, 'compress_cpu_ms': cpu * 1000,
+                   'first_ms': first * 1000, 'repeat_ms': repeat * 1000,
+                   'identity_first_ms': identity_first * 1000, 'identity_repeat_ms': identity_repeat * 1000}
+            report.append(row)
+            print(f"  {encoding:<5} {size:>9} bytes  {row['ratio']:5.1f}x smaller  compress {row['compress_cpu_ms']:7.3f} ms CPU"
+                  f"  first {row['first_ms']:7.2f} ms  repeat {row['repeat_ms']:7.2f} ms")
+    print(json.dumps(report))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Regression benchmark for POST /user/<id>/favorite/add/character.
+
+Grows favorite_characters through the given sizes and times a fixed number
+of adds at every size. Adding a favorite must cost the same no matter how
+many favorites exist, the script exits with 1 when the median latency at
+the largest size is more than --max-ratio times the one at the smallest.
+
+    python benchmarks/favorite_add.py --sizes 1000,10000,100000,1000000
+"""
+import argparse
+import json
+import statistics
+import sys
+
+import common
+from app import app
+from models import db, FavoriteCharacters
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000')
+    parser.add_argument('--adds', type=int, default=200)
+    parser.add_argument('--max-ratio', type=float, default=3.0)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    # enough users x characters for every seeded pair plus the timed adds
+    characters = 1000
+    users = (max(sizes) + args.adds * len(sizes)) // characters + 1
+    common.reset_database(app, db)
+    common.seed(app, db, users=users, characters=characters, planets=10)
+    client = app.test_client()
+
+    report = []
+    next_pair = 0
+    for size in sizes:
+        with app.app_context():
+            common.insert_batches(db, FavoriteCharacters, common.favorite_pairs(next_pair, size, characters))
+        next_pair = size
+        samples = []
+        for pair in common.favorite_pairs(next_pair, next_pair + args.adds, characters):
+            elapsed, response = common.timed(client.post, f"/user/{pair['user_id']}/favorite/add/character",
+                                             json={'character_id': pair['character_id']})
+            assert response.status_code == 201, response.data
+            samples.append(elapsed * 1000)
+        next_pair += args.adds
+        report.append({'favorites': size, 'median_ms': statistics.median(samples),
+                       'p95_ms': common.percentile(samples, 95)})
+        print(f"{size:>10} favorites  median {report[-1]['median_ms']:.3f} ms  p95 {report[-1]['p95_ms']:.3f} ms")
+
+    ratio = report[-1]['median_ms'] / report[0]['median_ms']
+    print(json.dumps({'results': report, 'ratio': ratio}))
+    if ratio > args.max_ratio:
+        print(f'add-favorite latency grew {ratio:.1f}x between {sizes[0]} and {sizes[-1]} favorites', file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""
+Client retries of POST /create/planet with and without an Idempotency-Key.
+
+Every round fires --retries concurrent copies of one create (a client
+retrying on timeouts) and counts the SQL statements they cost. Without a
+key one copy creates the planet and the others fail on the unique name;
+with a key they collapse onto one run of the view and the rest get the
+stored response.
+
+    python benchmarks/idempotency.py --rounds 50 --retries 20
+"""
+import argparse
+import json
+import sys
+import threading
+from collections import Counter
+
+import common
+from app import app
+from models import db
+from sqlalchemy import event
+
+def storm(name, retries, key):
+    statuses = Counter()
+    lock = threading.Lock()
+    barrier = threading.Barrier(retries)
+    headers = {'Idempotency-Key': key} if key else {}
+
+    def post():
+        client = app.test_client()
+        barrier.wait()
+        response = client.post('/create/planet', json={'name': name, 'population': 1}, headers=headers)
+        with lock:
+            statuses[(response.status_code, response.headers.get('Idempotent-Replayed') == 'true')] += 1
+
+    threads = [threading.Thread(target=post) for _ in range(retries)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--retries', type=int, default=20)
+    args = parser.parse_args()
+
+    common.reset_database(app, db)
+    common.seed(app, db, users=1, characters=1, planets=1)
+    statements = [0]
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda *_: statements.__setitem__(0, statements[0] + 1))
+
+    report = []
+    for mode in ('no key', 'idempotency key'):
+        statements[0] = 0
+        statuses = Counter()
+        for round_number in range(args.rounds):
+            name = f'{mode} {round_number}'
+            statuses.update(storm(name, args.retries, name if mode == 'idempotency key' else None))
+        row = {'mode': mode, 'requests': args.rounds * args.retries,
+               'statements_per_round': statements[0] / args.rounds,
+               'statuses': {f'{status}{" replayed" if replayed else ""}': count for (status, replayed), count in statuses.items()}}
+        report.append(row)
+        print(f"{mode:<16} {row['statements_per_round']:.1f} SQL statements per {args.retries} retries  {row['statuses']}")
+    print(json.dumps(report))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Small HTTP/1.1 load generator, keeps `concurrency` connections busy with
+GET requests for `duration` seconds and reports latency percentiles and
+throughput. Connections are reused unless the server closes them (gunicorn
+sync workers do after every response).
+
+    python benchmarks/loadgen.py http://127.0.0.1:3000 /characters /planets -c 64 -d 10
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from urllib.parse import urlsplit
+
+import common
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed by the server')
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    size = 0
+    if 'content-length' in headers:
+        size = int(headers['content-length'])
+        await reader.readexactly(size)
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            chunk_size = int((await reader.readline()).strip(), 16)
+            await reader.readexactly(chunk_size + 2)
+            size += chunk_size
+            if chunk_size == 0:
+                break
+    else:
+        size = len(await reader.read())
+        headers['connection'] = 'close'
+    return status, size, headers.get('connection', '').lower() == 'close'
+
+async def worker(host, port, paths, offset, deadline, stats, extra_headers):
+    connection = None
+    index = offset
+    while time.perf_counter() < deadline:
+        path = paths[index % len(paths)]
+        index += 1
+        start = time.perf_counter()
+        try:
+            if connection is None:
+                connection = await asyncio.open_connection(host, port)
+            reader, writer = connection
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\n{extra_headers}\r\n'.encode())
+            await writer.drain()
+            status, size, close = await read_response(reader)
+        except (ConnectionError, asyncio.IncompleteReadError, OSError):
+            stats['errors'] += 1
+            connection = None
+            continue
+        stats['latencies'].append(time.perf_counter() - start)
+        stats['bytes'] += size
+        if status >= 500:
+            stats['errors'] += 1
+        if close:
+            connection[1].close()
+            connection = None
+    if connection is not None:
+        connection[1].close()
+
+async def run_async(base_url, paths, concurrency, duration, headers):
+    url = urlsplit(base_url)
+    extra_headers = ''.join(f'{name}: {value}\r\n' for name, value in (headers or {}).items())
+    stats = {'latencies': [], 'errors': 0, 'bytes': 0}
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(worker(url.hostname, url.port or 80, paths, i, deadline, stats, extra_headers)
+                           for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies = stats['latencies'] or [0.0]
+    return {
+        'concurrency': concurrency,
+        'requests': len(stats['latencies']),
+        'errors': stats['errors'],
+        'throughput_rps': len(stats['latencies']) / elapsed,
+        'bytes': stats['bytes'],
+        'p50_ms': common.percentile(latencies, 50) * 1000,
+        'p95_ms': common.percentile(latencies, 95) * 1000,
+        'p99_ms': common.percentile(latencies, 99) * 1000,
+    }
+
+def run_load(base_url, paths, concurrency=16, duration=10.0, headers=None):
+    return asyncio.run(run_async(base_url, paths, concurrency, duration, headers))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base_url')
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('-c', '--concurrency', type=int, default=16)
+    parser.add_argument('-d', '--duration', type=float, default=10.0)
+    args = parser.parse_args()
+    print(json.dumps(run_load(args.base_url, args.paths, args.concurrency, args.duration)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Preforked boot (gunicorn.conf.py with PRELOAD_APP=1 and WARM_CATALOG=1)
+against every worker importing the app on its own (PRELOAD_APP=0).
+
+For each boot it reports the time until the server answers, the latency
+of the first requests to the catalog routes (spread over the workers) and
+the memory of every worker: RSS, and PSS / private bytes from
+/proc/<pid>/smaps_rollup, which show how much of it is shared with the
+master copy-on-write.
+
+    python benchmarks/prefork.py --workers 4 --characters 10000
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+import common
+from app import app
+from models import db
+
+BOOTS = {
+    'per-worker import': {'PRELOAD_APP': '0'},
+    'preload': {'PRELOAD_APP': '1', 'WARM_CATALOG': '0'},
+    'preload + warm': {'PRELOAD_APP': '1', 'WARM_CATALOG': '1'},
+}
+
+def memory(pid):
+    """
+    {'rss', 'pss', 'private'} in bytes from smaps_rollup
+    """
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as smaps:
+        for line in smaps:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    return {'rss': fields.get('Rss', 0), 'pss': fields.get('Pss', 0),
+            'private': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)}
+
+def worker_pids(master_pid):
+    output = subprocess.run(['pgrep', '-P', str(master_pid)], capture_output=True, text=True).stdout
+    return [int(pid) for pid in output.split()]
+
+def get(url):
+    start = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=10) as response:
+        response.read()
+    return time.perf_counter() - start
+
+def measure_boot(env, args):
+    started = time.perf_counter()
+    process = common.start_server('wsgi', args.port, args.workers, env=env, ready_path='/metrics',
+                                  extra_args=['--config', os.path.join(os.path.dirname(common.SRC), 'gunicorn.conf.py')])
+    try:
+        ready = time.perf_counter() - started
+        base = f'http://127.0.0.1:{args.port}'
+        paths = [f'/characters/{i}' for i in range(1, args.workers * 4 + 1)] + ['/planets'] * args.workers + ['/stats'] * args.workers
+        first = [get(base + path) for path in paths]
+        again = [get(base + path) for path in paths]
+        workers = [memory(pid) for pid in worker_pids(process.pid)]
+    finally:
+        process.terminate()
+        process.wait()
+    return {
+        'ready_s': ready,
+        'first_requests_p50_ms': statistics.median(first) * 1000,
+        'first_requests_max_ms': max(first) * 1000,
+        'warm_requests_p50_ms': statistics.median(again) * 1000,
+        'workers': len(workers),
+        'worker_rss_mib': statistics.mean(worker['rss'] for worker in workers) / 2**20,
+        'worker_pss_mib': statistics.mean(worker['pss'] for worker in workers) / 2**20,
+        'worker_private_mib': statistics.mean(worker['private'] for worker in workers) / 2**20,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--characters', type=int, default=10000)
+    parser.add_argument('--planets', type=int, default=1000)
+    parser.add_argument('--port', type=int, default=8767)
+    args = parser.parse_args()
+
+    common.reset_database(app, db)
+    common.seed(app, db, users=100, characters=args.characters, planets=args.planets, favorites=1000)
+    report = {}
+    for name, env in BOOTS.items():
+        result = report[name] = measure_boot(env, args)
+        print(f"{name:<18} ready {result['ready_s']:5.2f} s  first requests p50 {result['first_requests_p50_ms']:6.2f} ms"
+              f" max {result['first_requests_max_ms']:6.2f} ms  (warm p50 {result['warm_requests_p50_ms']:5.2f} ms)"
+              f"  per worker RSS {result['worker_rss_mib']:5.1f} MiB  PSS {result['worker_pss_mib']:5.1f} MiB"
+              f"  private {result['worker_private_mib']:5.1f} MiB")
+    print(json.dumps(report))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Query plans of the list endpoint filters and sorts.
+
+Builds the statements exactly like the endpoints do (utils.page_statements,
+a sort by a nullable column has a second one for the NULL rows) and asks
+the database for their plan. A plan that scans the whole table or
+sorts in a temporary structure instead of walking an index is a failure.
+
+- SQLite: EXPLAIN QUERY PLAN, "SCAN <table>" without an index or
+  "USE TEMP B-TREE" fails.
+- Postgres: EXPLAIN with enable_seqscan off (the planner rightly prefers a
+  sequential scan on small tables), a "Seq Scan" or "Sort" node fails.
+- Other databases: the plan is recorded but not checked.
+
+    python benchmarks/query_plans.py --characters 10000
+"""
+import argparse
+import sys
+
+import common
+from werkzeug.datastructures import MultiDict
+from app import app
+from models import db, Planets, Characters
+from utils import page_statements, encode_cursor
+
+def cases():
+    """
+    (name, model, query string args, default fields), one per filter and
+    sort shape the list endpoints compile to
+    """
+    return [
+        ('planets population range, sorted desc', Planets,
+         [('population__gt', '1e3'), ('sort', '-population')], ('id', 'name', 'population')),
+        ('planets sorted by population after a cursor', Planets,
+         [('sort', 'population'), ('after', encode_cursor(5000, 5))], ('id', 'name', 'population')),
+        ('characters gender equality', Characters, [('gender', 'female')], ('id', 'name')),
+        ('characters gender equality after an id', Characters, [('gender', 'female'), ('after', '100')], ('id', 'name')),
+        ('characters height range, sorted', Characters,
+         [('height__gte', '150'), ('height__lt', '180'), ('sort', 'height')], ('id', 'name')),
+        ('characters mass sorted desc after a cursor', Characters,
+         [('sort', '-Mass'), ('after', encode_cursor(80, 50))], ('id', 'name')),
+        ('characters mass sorted after a NULL mass cursor', Characters,
+         [('sort', 'Mass'), ('after', encode_cursor(None, 50))], ('id', 'name')),
+        ('characters gender in, sorted by gender', Characters,
+         [('gender__in', 'female,n/a'), ('sort', 'gender')], ('id', 'name')),
+    ]
+
+def literal_sql(statement):
+    return str(statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+
+def explain(connection, dialect, sql):
+    if dialect == 'sqlite':
+        return [row[-1] for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql)]
+    if dialect == 'postgresql':
+        connection.exec_driver_sql('SET enable_seqscan = off')
+        return [row[0] for row in connection.exec_driver_sql('EXPLAIN ' + sql)]
+    return [' | '.join(str(value) for value in row) for row in connection.exec_driver_sql('EXPLAIN ' + sql)]
+
+def plan_problems(dialect, plan):
+    problems = []
+    for line in plan:
+        if dialect == 'sqlite':
+            if line.startswith('SCAN ') and 'USING' not in line:
+                problems.append('full table scan: ' + line)
+            if 'TEMP B-TREE' in line:
+                problems.append('sort without an index: ' + line)
+        elif dialect == 'postgresql':
+            if 'Seq Scan' in line:
+                problems.append('full table scan: ' + line.strip())
+            if line.strip().startswith(('-> Sort', 'Sort ')):
+                problems.append('sort without an index: ' + line.strip())
+    return problems
+
+def check_plans():
+    """
+    {case name: {'sql', 'plan', 'problems'}} for every case
+    """
+    results = {}
+    with app.app_context(), db.engine.connect() as connection:
+        dialect = connection.dialect.name
+        for name, model, args, default_fields in cases():
+            with app.test_request_context():
+                statements, _, limit, _ = page_statements(model, MultiDict(args), default_fields)
+            for number, statement in enumerate(statements):
+                sql = literal_sql(statement.limit(limit + 1))
+                plan = explain(connection, dialect, sql)
+                results[name + (' (NULL rows)' if number else '')] = {'sql': sql, 'plan': plan,
+                                                                      'problems': plan_problems(dialect, plan)}
+    return results
+
+def report(results):
+    for name, result in results.items():
+        print(f"{'FAIL' if result['problems'] else 'ok':<5} {name}")
+        for line in result['plan']:
+            print('        ' + line)
+    return sum(1 for result in results.values() if result['problems'])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--characters', type=int, default=10000)
+    parser.add_argument('--planets', type=int, default=1000)
+    args = parser.parse_args()
+
+    common.reset_database(app, db)
+    common.seed(app, db, users=1, characters=args.characters, planets=args.planets)
+    with app.app_context():
+        # give the planner real statistics, as a production database has
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+    return 1 if report(check_plans()) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Overhead of the rate limiter per request.
+
+Times the limiter hooks alone (take tokens, take and release a concurrency
+slot) inside a request context, and the same request through the test
+client with the limiter on and off. Exits 1 when the hooks cost more than
+--budget-us microseconds per request.
+
+    python benchmarks/ratelimit.py
+    python benchmarks/ratelimit.py --redis-url redis://localhost:6379/0
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import common
+# on, with a bucket no benchmark can empty
+os.environ['RATELIMIT_ENABLED'] = '1'
+os.environ['RATELIMIT_BURST'] = str(10**9)
+os.environ['RATELIMIT_CONCURRENCY'] = str(10**9)
+from app import app
+from models import db
+import ratelimit
+
+def hook_overhead(iterations, clients):
+    """
+    Seconds per request spent in the limiter hooks, for a user route
+    (two buckets) and a list route (one bucket)
+    """
+    results = {}
+    for path in ('/characters', '/user/1/favorites'):
+        best = float('inf')
+        for attempt in range(3):
+            elapsed = 0.0
+            for client in range(clients):
+                with app.test_request_context(path, environ_base={'REMOTE_ADDR': f'10.0.{client // 256}.{client % 256}'}):
+                    start = time.perf_counter()
+                    for _ in range(iterations // clients):
+                        ratelimit.limit_request()
+                        ratelimit.release_request()
+                    elapsed += time.perf_counter() - start
+            best = min(best, elapsed / (iterations // clients * clients))
+        results[path] = best
+    return results
+
+def request_latency(iterations, enabled):
+    client = app.test_client()
+    store = ratelimit.store
+    ratelimit.store = store if enabled else None
+    hooks = app.before_request_funcs[None]
+    if not enabled:
+        app.before_request_funcs[None] = [hook for hook in hooks if hook is not ratelimit.limit_request]
+    try:
+        samples = [common.timed(client.get, '/characters/1')[0] for _ in range(iterations)]
+    finally:
+        app.before_request_funcs[None] = hooks
+        ratelimit.store = store
+    return common.percentile(samples, 50)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--clients', type=int, default=1000, help='distinct client addresses')
+    parser.add_argument('--redis-url', help='measure the Redis store instead of the in-memory one')
+    parser.add_argument('--budget-us', type=float, default=50.0)
+    args = parser.parse_args()
+
+    if args.redis_url:
+        ratelimit.store = ratelimit.RedisStore(args.redis_url)
+    common.reset_database(app, db)
+    common.seed(app, db, users=10, characters=100, planets=10)
+
+    report = {'store': type(ratelimit.store).__name__, 'hooks_us': {}}
+    for path, seconds in hook_overhead(args.iterations, args.clients).items():
+        report['hooks_us'][path] = seconds * 1e6
+        print(f'{path:<20} limiter hooks {seconds * 1e6:7.2f} us/request ({report["store"]})')
+    on, off = request_latency(2000, True), request_latency(2000, False)
+    report['request_p50_us'] = {'limiter_on': on * 1e6, 'limiter_off': off * 1e6}
+    print(f'GET /characters/1 p50 {on * 1e6:.1f} us with the limiter, {off * 1e6:.1f} us without')
+    print(json.dumps(report))
+    over = [path for path, us in report['hooks_us'].items() if us > args.budget_us]
+    if over:
+        print(f'over the {args.budget_us} us budget: ' + ', '.join(over), file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""
+Benchmark suite for every route of src/app.py.
+
+1. Seeds the database (SQLite scratch file, or whatever DATABASE_URL points
+   to, e.g. Postgres) with --users/--characters/--planets/--favorites rows.
+2. Checks the query plans of the list filters and sorts (query_plans.py).
+3. Micro benchmarks every route in process with Flask's test client.
+4. With --load, starts gunicorn and drives the read routes with the
+   concurrent load generator.
+
+Reports p50/p95/p99 latency, throughput and peak RSS, and writes it all as
+JSON. Exits 1 when a query plan scans a whole table, and with --baseline
+(an older result file) when a route's p50 got slower by more than
+--max-regression.
+
+    python benchmarks/run.py --characters 10000 --load --output bench.json
+    python benchmarks/run.py --baseline bench.json
+"""
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import common
+from app import app
+from models import db
+import loadgen
+import query_plans
+
+def scenarios(scale):
+    """
+    (name, method, path, body) generators, one call per iteration. Create
+    routes run before the matching delete routes, which remove what the
+    create routes made.
+    """
+    created = {'characters': [], 'planets': [], 'favorite_characters': []}
+    users, characters, planets = scale['users'], scale['characters'], scale['planets']
+
+    def pick(i, size):
+        return i * 7919 % size + 1
+
+    return created, [
+        ('GET /user', lambda i: ('GET', '/user', None)),
+        ('GET /user/<id>', lambda i: ('GET', f'/user/{pick(i, users)}', None)),
+        ('GET /characters', lambda i: ('GET', '/characters', None)),
+        ('GET /characters?after&limit', lambda i: ('GET', f'/characters?after={pick(i, characters)}&limit=50', None)),
+        ('GET /characters/<id>', lambda i: ('GET', f'/characters/{pick(i, characters)}', None)),
+        ('GET /characters?filter&sort', lambda i: ('GET', f'/characters?gender=female&height__gte={100 + i % 100}&sort=-height', None)),
+        ('GET /planets', lambda i: ('GET', '/planets', None)),
+        ('GET /planets?range&sort', lambda i: ('GET', f'/planets?population__gt={pick(i, planets) * 1000}&sort=population', None)),
+        ('GET /planet/<id>', lambda i: ('GET', f'/planet/{pick(i, planets)}', None)),
+        ('GET /user/<id>/favorites', lambda i: ('GET', f'/user/{pick(i, users)}/favorites', None)),
+        ('GET /characters?ids', lambda i: ('GET', '/characters?ids=' + ','.join(str(pick(i + k, characters)) for k in range(20)), None)),
+        ('POST /batch', lambda i: ('POST', '/batch', {'requests': [{'path': f'/characters/{pick(i + k, characters)}'} for k in range(10)]
+                                                      + [{'path': f'/planet/{pick(i + k, planets)}'} for k in range(10)]})),
+        ('GET /stats', lambda i: ('GET', '/stats', None)),
+        ('GET /stats/favorites/characters', lambda i: ('GET', '/stats/favorites/characters?limit=10', None)),
+        ('POST /create/character', lambda i: ('POST', '/create/character',
+                                              {'name': f'bench {time.time_ns() % 10**12}', 'height': 170, 'mass': 70, 'gender': 'n/a'})),
+        ('POST /create/planet', lambda i: ('POST', '/create/planet', {'name': f'bench planet {time.time_ns()}', 'population': i})),
+        ('POST /user/<id>/favorite/add/character', lambda i: ('POST', f'/user/{pick(i, users)}/favorite/add/character',
+                                                             {'character_id': created['characters'][i % len(created['characters'])]})),
+        ('DELETE /user/<id>/favorite/delete/character', lambda i: ('DELETE', f'/user/{pick(i, users)}/favorite/delete/character',
+                                                                  {'favorite_id': created['favorite_characters'][i % len(created['favorite_characters'])]})),
+        ('DELETE /delete/character/<id>', lambda i: ('DELETE', f"/delete/character/{created['characters'].pop()}", None)),
+        ('DELETE /delete/planet/<id>', lambda i: ('DELETE', f"/delete/planet/{created['planets'].pop()}", None)),
+    ]
+
+def remember(created, name, response):
+    payload = response.get_json(silent=True) or {}
+    if name == 'POST /create/character' and response.status_code == 200:
+        created['characters'].append(payload['data']['id'])
+    elif name == 'POST /create/planet' and response.status_code == 200:
+        created['planets'].append(payload['data']['id'])
+    elif name == 'POST /user/<id>/favorite/add/character' and response.status_code == 201:
+        created['favorite_characters'].append(payload['success']['id'])
+
+def summarize(samples, elapsed, errors):
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'throughput_rps': len(samples) / elapsed if elapsed else 0.0,
+        'p50_ms': common.percentile(samples, 50) * 1000,
+        'p95_ms': common.percentile(samples, 95) * 1000,
+        'p99_ms': common.percentile(samples, 99) * 1000,
+    }
+
+def run_micro(scale, iterations):
+    client = app.test_client()
+    created, routes = scenarios(scale)
+    results = {}
+    for name, make_request in routes:
+        samples = []
+        errors = 0
+        started = time.perf_counter()
+        for i in range(iterations):
+            method, path, body = make_request(i)
+            elapsed, response = common.timed(client.open, path, method=method, json=body)
+            samples.append(elapsed)
+            if response.status_code >= 500:
+                errors += 1
+            remember(created, name, response)
+        results[name] = summarize(samples, time.perf_counter() - started, errors)
+        print(f"{name:<48} p50 {results[name]['p50_ms']:8.3f} ms  p99 {results[name]['p99_ms']:8.3f} ms"
+              f"  {results[name]['throughput_rps']:9.1f} req/s")
+    return results
+
+def run_load(args):
+    paths = ['/user', '/characters', '/characters/1', '/planets', '/planet/1', '/user/1/favorites']
+    process = common.start_server('wsgi', args.port, args.workers)
+    try:
+        result = loadgen.run_load(f'http://127.0.0.1:{args.port}', paths, args.concurrency, args.duration)
+    finally:
+        process.terminate()
+        process.wait()
+    # largest RSS among the reaped gunicorn processes
+    result['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    print(f"load c={args.concurrency}: {result['throughput_rps']:.1f} req/s  p50 {result['p50_ms']:.2f} ms"
+          f"  p99 {result['p99_ms']:.2f} ms  errors {result['errors']}")
+    return result
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def regressions(results, baseline, max_regression):
+    found = []
+    for name, current in results['micro'].items():
+        previous = baseline.get('micro', {}).get(name)
+        if previous and current['p50_ms'] > previous['p50_ms'] * (1 + max_regression):
+            found.append(f"{name}: p50 {previous['p50_ms']:.3f} -> {current['p50_ms']:.3f} ms")
+    previous_load = baseline.get('load')
+    if previous_load and results.get('load'):
+        if results['load']['throughput_rps'] < previous_load['throughput_rps'] * (1 - max_regression):
+            found.append(f"load: {previous_load['throughput_rps']:.1f} -> {results['load']['throughput_rps']:.1f} req/s")
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--characters', type=int, default=10000)
+    parser.add_argument('--planets', type=int, default=1000)
+    parser.add_argument('--favorites', type=int, default=20000)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--load', action='store_true', help='also run the gunicorn load test')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='results JSON of a previous run to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    args = parser.parse_args()
+
+    scale = {'users': args.users, 'characters': args.characters, 'planets': args.planets, 'favorites': args.favorites}
+    common.reset_database(app, db)
+    seed_seconds, _ = common.timed(common.seed, app, db, **scale)
+    print(f'seeded {scale} in {seed_seconds:.1f} s')
+
+    plans = query_plans.check_plans()
+    full_scans = query_plans.report(plans)
+    results = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'database': app.config['SQLALCHEMY_DATABASE_URI'].split('://')[0],
+        'scale': scale,
+        'iterations': args.iterations,
+        'query_plans': plans,
+        'micro': run_micro(scale, args.iterations),
+    }
+    results['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(f"peak RSS {results['peak_rss_bytes'] / 2**20:.1f} MiB")
+    if args.load:
+        results['load'] = run_load(args)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    status = 0
+    if full_scans:
+        print(f'{full_scans} query plan(s) scan a whole table', file=sys.stderr)
+        status = 1
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            found = regressions(results, json.load(baseline_file), args.max_regression)
+        for line in found:
+            print('regression:', line, file=sys.stderr)
+        if found:
+            status = 1
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Old vs new serialization path for a list of characters.
+
+old: Characters.query.all(), serialize() per ORM object, stdlib json
+new: column tuples from db.select, rows_to_dicts, the configured encoder
+
+    python benchmarks/serialization.py --rows 100000
+"""
+import argparse
+import json
+import sys
+
+import common
+from app import app
+from models import db, Characters
+import serialization
+
+FIELDS = ('id', 'name', 'height', 'Mass', 'gender')
+
+def old_path():
+    characters = Characters.query.all()
+    return json.dumps({'data': [character.serialize() for character in characters]}).encode()
+
+def new_path():
+    rows = db.session.execute(db.select(*serialization.columns_for(Characters, FIELDS))).all()
+    return serialization.dumps_bytes({'data': serialization.rows_to_dicts(FIELDS, rows)})
+
+def best_of(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        with app.app_context():
+            elapsed, body = common.timed(fn)
+        samples.append(elapsed)
+    return min(samples), len(body)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    common.reset_database(app, db)
+    common.seed(app, db, users=1, characters=args.rows, planets=1)
+
+    report = {'rows': args.rows}
+    report['old'], size = best_of(old_path, args.repeat)
+    print(f"old path (ORM + serialize() + json)   {report['old'] * 1000:8.1f} ms  {size} bytes")
+    for encoder in ('stdlib', 'ujson', 'orjson'):
+        try:
+            serialization.set_encoder(encoder)
+        except RuntimeError:
+            continue
+        report[encoder], size = best_of(new_path, args.repeat)
+        print(f"new path (column tuples + {encoder:<7})   {report[encoder] * 1000:8.1f} ms  {size} bytes"
+              f"  {report['old'] / report[encoder]:.1f}x")
+    print(json.dumps(report))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
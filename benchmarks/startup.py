@@ -0,0 +1,75 @@
+"""
+Cold start of the app: import time and time to the first request, for
+each boot mode, measured in fresh interpreters the way a gunicorn worker
+(re)starts.
+
+- eager: ADMIN_MODE=eager, Flask-Admin set up at import
+- lazy: the default, the admin is built on the first /admin request
+- api-only: API_ONLY=1, no admin, no /spec and no Flask-Migrate
+
+    python benchmarks/startup.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import common
+from app import app
+from models import db
+
+MODES = {
+    'eager': {'ADMIN_MODE': 'eager'},
+    'lazy': {'ADMIN_MODE': 'lazy'},
+    'api-only': {'API_ONLY': '1'},
+}
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {src!r})
+from app import app
+imported = time.perf_counter()
+client = app.test_client()
+client.get('/planets')
+first = time.perf_counter()
+result = {{'import_s': imported - start, 'first_request_s': first - imported, 'modules': len(sys.modules)}}
+if app.config['ADMIN_MODE'] != 'off':
+    client.get('/admin/')
+    result['first_admin_request_s'] = time.perf_counter() - first
+print(json.dumps(result))
+"""
+
+def run_child(env):
+    start = time.perf_counter()
+    output = subprocess.check_output([sys.executable, '-c', CHILD.format(src=os.path.abspath(common.SRC))],
+                                     env=dict(os.environ, **env), stderr=subprocess.DEVNULL, text=True)
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process_s'] = time.perf_counter() - start
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    common.reset_database(app, db)
+    common.seed(app, db, users=10, characters=100, planets=100)
+    report = {}
+    for mode, env in MODES.items():
+        runs = [run_child(env) for _ in range(args.runs)]
+        report[mode] = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+        summary = report[mode]
+        line = (f"{mode:<9} import {summary['import_s'] * 1000:7.1f} ms  first request {summary['first_request_s'] * 1000:6.1f} ms"
+                f"  whole process {summary['process_s'] * 1000:7.1f} ms  {summary['modules']:.0f} modules")
+        if 'first_admin_request_s' in summary:
+            line += f"  first /admin/ {summary['first_admin_request_s'] * 1000:6.1f} ms"
+        print(line)
+    print(json.dumps(report))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Thundering herd on hot cache keys: --clients concurrent requests for the
+same /planet/<id> and /characters page right after their entries expired.
+
+Every round clears (or expires) the cache and releases all the clients at
+once, then counts the SQL statements the round ran. Modes:
+
+- no coalescing: every miss runs its own query, the behavior before
+  cache.cached() went through a singleflight.Group
+- single-flight: concurrent misses share one query
+- stale-while-revalidate: expired entries are served while one
+  background reload runs (CACHE_STALE_TTL)
+
+    python benchmarks/thundering_herd.py --clients 64 --rounds 20
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+
+import common
+from app import app
+from models import db
+from sqlalchemy import event
+import cache
+
+PATHS = ('/planet/1', '/characters?limit=100')
+
+class NoCoalescing:
+    def do(self, key, fn):
+        return fn(), False
+
+def herd(path, clients):
+    samples = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients)
+
+    def get():
+        client = app.test_client()
+        barrier.wait()
+        elapsed, response = common.timed(client.get, path)
+        assert response.status_code == 200, response.data
+        with lock:
+            samples.append(elapsed * 1000)
+
+    threads = [threading.Thread(target=get) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--characters', type=int, default=10000)
+    args = parser.parse_args()
+
+    common.reset_database(app, db)
+    common.seed(app, db, users=1, characters=args.characters, planets=10)
+    statements = [0]
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda *_: statements.__setitem__(0, statements[0] + 1))
+    single_flight = cache.loads
+
+    report = []
+    for mode in ('no coalescing', 'single-flight', 'stale-while-revalidate'):
+        cache.loads = NoCoalescing() if mode == 'no coalescing' else single_flight
+        cache.cache.stale_ttl = 60 if mode == 'stale-while-revalidate' else 0
+        for path in PATHS:
+            herd_statements = 0
+            samples = []
+            for _ in range(args.rounds):
+                cache.cache.clear()
+                if mode == 'stale-while-revalidate':
+                    # one request fills the cache with entries that expire right away
+                    cache.cache.ttl = 0.05
+                    app.test_client().get(path)
+                    time.sleep(0.1)
+                    cache.cache.ttl = 60
+                before = statements[0]
+                samples.extend(herd(path, args.clients))
+                herd_statements += statements[0] - before
+            row = {'mode': mode, 'path': path, 'clients': args.clients,
+                   'statements_per_herd': herd_statements / args.rounds,
+                   'p50_ms': common.percentile(samples, 50), 'p99_ms': common.percentile(samples, 99)}
+            report.append(row)
+            print(f"{mode:<23} {path:<22} {row['statements_per_herd']:7.1f} SQL per {args.clients} requests"
+                  f"  p50 {row['p50_ms']:.2f} ms  p99 {row['p99_ms']:.2f} ms")
+    cache.loads = single_flight
+    print(json.dumps({'results': report, 'cache': cache.cache_stats()}, default=str))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+POST /create/character latency under a burst of writes, synchronous vs
+?async=1.
+
+--threads clients each post --writes/--threads new characters as fast as
+they can. Synchronously every POST inserts and commits on its own; with
+?async=1 it only stores a job and the job workers insert the rows in
+batched transactions. Reported: POST latency, the time until every
+character exists, and SQL statements and commits per write.
+
+    python benchmarks/write_burst.py --writes 2000 --threads 8
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+
+import common
+from app import app
+from models import db, Characters, Job
+from sqlalchemy import event
+import jobs
+
+def burst(client, mode, writes, threads):
+    samples = []
+    lock = threading.Lock()
+    query = '?async=1' if mode == 'async' else ''
+
+    def post(start):
+        local = []
+        for i in range(start, writes, threads):
+            elapsed, response = common.timed(client.post, f'/create/character{query}',
+                                             json={'name': f'{mode} {i}', 'height': 150, 'mass': 70, 'gender': 'male'})
+            assert response.status_code in (200, 202), response.data
+            local.append(elapsed * 1000)
+        with lock:
+            samples.extend(local)
+
+    workers = [threading.Thread(target=post, args=(start,)) for start in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return samples
+
+def count_characters(mode):
+    with app.app_context():
+        return db.session.scalar(db.select(db.func.count()).where(Characters.name.like(f'{mode} %')))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writes', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=2, help='job worker threads')
+    args = parser.parse_args()
+
+    common.reset_database(app, db)
+    common.seed(app, db, users=1, characters=1, planets=1)
+    client = app.test_client()
+    counts = {'statements': 0, 'commits': 0}
+    def count(name):
+        return lambda *_: counts.__setitem__(name, counts[name] + 1)
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count('statements'))
+        event.listen(db.engine, 'commit', count('commits'))
+    app.config['JOBS_WORKERS'] = args.workers
+    jobs.start_workers(app)
+
+    report = []
+    for mode in ('sync', 'async'):
+        counts.update(statements=0, commits=0)
+        start = time.perf_counter()
+        samples = burst(client, mode, args.writes, args.threads)
+        posted = time.perf_counter() - start
+        while count_characters(mode) < args.writes:
+            time.sleep(0.01)
+        done = time.perf_counter() - start
+        row = {'mode': mode, 'writes': args.writes, 'p50_ms': common.percentile(samples, 50),
+               'p95_ms': common.percentile(samples, 95), 'p99_ms': common.percentile(samples, 99),
+               'posted_s': posted, 'all_written_s': done, 'statements_per_write': counts['statements'] / args.writes,
+               'commits_per_write': counts['commits'] / args.writes}
+        report.append(row)
+        print(f"{mode:<5} POST p50 {row['p50_ms']:.2f} ms  p95 {row['p95_ms']:.2f} ms  p99 {row['p99_ms']:.2f} ms"
+              f"  burst {posted:.2f} s  all written {done:.2f} s  {row['statements_per_write']:.1f} SQL"
+              f" and {row['commits_per_write']:.2f} commits/write")
+    with app.app_context():
+        failed = db.session.scalar(db.select(db.func.count()).where(Job.status == 'failed'))
+    print(json.dumps({'results': report, 'failed_jobs': failed}))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,37 @@
+"""
+Gunicorn settings, the Procfile runs:
+
+    gunicorn wsgi --chdir ./src/ --config gunicorn.conf.py
+
+PRELOAD_APP=1 (default) imports the app once in the master before forking
+the workers (WEB_CONCURRENCY of them, read by gunicorn itself), so they
+share its memory copy-on-write. With WARM_CATALOG=1 (default) the master
+also fills the catalog cache and search index first (WARM_ROWS rows per
+table, by default as many as fit in CACHE_MAXSIZE), see src/warmup.py. Set PRELOAD_APP=0 to go back to every worker importing the
+app on its own, e.g. for --reload during development.
+"""
+import gc
+import os
+
+preload_app = os.getenv('PRELOAD_APP', '1').lower() in ('1', 'true', 'yes')
+warm_catalog = os.getenv('WARM_CATALOG', '1').lower() in ('1', 'true', 'yes')
+
+def when_ready(server):
+    if not preload_app:
+        return
+    from app import app
+    import warmup
+    if warm_catalog:
+        warmup.warm_catalog(app, int(os.getenv('WARM_ROWS', app.config.get('CACHE_MAXSIZE', 1024) // 4)))
+    else:
+        warmup.dispose_engines(app)
+    # move everything loaded so far out of the collector's reach, the
+    # workers' GC passes then don't touch (and copy) the shared pages
+    gc.collect()
+    gc.freeze()
+
+def post_fork(server, worker):
+    if preload_app:
+        from app import app
+        import warmup
+        warmup.dispose_engines(app, close=False)
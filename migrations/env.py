@@ -6,6 +6,7 @@ from logging.config import fileConfig
 from flask import current_app
 
 from alembic import context
+from engine_config import statement_timeout_statements
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -80,6 +81,10 @@ def run_migrations_online():
     connectable = current_app.extensions['migrate'].db.get_engine()
 
     with connectable.connect() as connection:
+        # DB_STATEMENT_TIMEOUT is meant for requests, schema changes and data
+        # fixes on big tables may run longer
+        for statement in statement_timeout_statements(connection.dialect.name, 0):
+            connection.exec_driver_sql(statement)
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
@@ -0,0 +1,54 @@
+"""favorite tables with (user_id, planet_id) / (user_id, character_id) unique indexes
+
+Revision ID: 3f1b7c2d9e40
+Revises: 96138eacb25d
+Create Date: 2026-10-18 10:12:41.503118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1b7c2d9e40'
+down_revision = '96138eacb25d'
+branch_labels = None
+depends_on = None
+
+
+FAVORITE_TABLES = (
+    ('favorite_planets', 'planet_id', 'planets', 'uq_favorite_planets_user_id_planet_id'),
+    ('favorite_characters', 'character_id', 'characters', 'uq_favorite_characters_user_id_character_id'),
+)
+
+
+def upgrade():
+    # the favorite tables were never part of a migration, databases created
+    # with db.create_all() already have them and only need the constraint
+    existing_tables = sa.inspect(op.get_bind()).get_table_names()
+    for table, column, target, constraint in FAVORITE_TABLES:
+        if table not in existing_tables:
+            op.create_table(table,
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column(column, sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+            sa.ForeignKeyConstraint([column], [target + '.id'], ),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('user_id', column, name=constraint)
+            )
+            continue
+        # keep the oldest row of every duplicated favorite before adding the constraint
+        op.execute(
+            f'DELETE FROM {table} WHERE id NOT IN '
+            f'(SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM {table} GROUP BY user_id, {column}) AS keep)'
+        )
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_unique_constraint(constraint, ['user_id', column])
+
+
+def downgrade():
+    # the schema of 96138eacb25d has no favorite tables, whether upgrade()
+    # created them or adopted the ones db.create_all() made
+    for table, column, target, constraint in reversed(FAVORITE_TABLES):
+        op.drop_table(table)
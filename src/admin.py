@@ -1,14 +1,19 @@
 import os
-from flask_admin import Admin
+import threading
+from flask import Flask
 from models import db, User, Planets, Characters, FavoritePlanets,FavoriteCharacters
-from flask_admin.contrib.sqla import ModelView
+from engine_config import init_engine
 
 def setup_admin(app):
+    # flask_admin is imported here so the API can boot without it, see LazyAdmin
+    from flask_admin import Admin
+    from flask_admin.contrib.sqla import ModelView
+
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
 
-    
+
     # Add your models here, for example this is how we add a the User model to the admin
     admin.add_view(ModelView(User, db.session))
     admin.add_view(ModelView(Planets, db.session))
@@ -16,4 +21,43 @@ def setup_admin(app):
     admin.add_view(ModelView(FavoritePlanets, db.session))
     admin.add_view(ModelView(FavoriteCharacters, db.session))
     # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    # admin.add_view(ModelView(YourModelName, db.session))
+
+class LazyAdmin:
+    """
+    WSGI middleware for ADMIN_MODE=lazy: /admin requests go to a separate
+    Flask app holding the admin, built (and flask_admin imported) on the
+    first of them, everything else goes to the API. Workers that never
+    serve the admin never pay for it.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        self._admin_app = None
+        self._lock = threading.Lock()
+
+    def admin_app(self):
+        with self._lock:
+            if self._admin_app is None:
+                admin_app = Flask(self.app.import_name)
+                admin_app.config.update(self.app.config)
+                db.init_app(admin_app)
+                # its own engine, with the connection setup of the API's
+                init_engine(admin_app, db)
+                setup_admin(admin_app)
+                self._admin_app = admin_app
+            return self._admin_app
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO', '').startswith('/admin'):
+            return self.admin_app()(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+def init_admin(app):
+    mode = app.config.get('ADMIN_MODE', 'lazy')
+    if mode == 'eager':
+        setup_admin(app)
+    elif mode == 'lazy':
+        app.wsgi_app = LazyAdmin(app)
+    elif mode != 'off':
+        raise RuntimeError(f'Unknown ADMIN_MODE {mode}, use lazy, eager or off')
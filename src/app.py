@@ -2,29 +2,125 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
+import logging
+import functools
 from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from admin import setup_admin
-from models import db, User, Planets, Characters, FavoritePlanets, FavoriteCharacters
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy.exc import IntegrityError
+from utils import APIException, generate_sitemap, paginate, serialize_or_none, log_sampled, wants_stream, stream_rows, IdConverter
+from admin import init_admin
+from models import db, User, Planets, Characters, FavoritePlanets, FavoriteCharacters, Job
+from bulk import read_items, batch_size_from, bulk_create, bulk_create_favorites, validate_character, validate_planet
+from cache import init_cache, cache_stats, cached, cached_page, cached_by_ids
+from conditional import conditional_get, table_validator, row_validator
+from serialization import init_serialization
+from engine_config import database_uri, engine_options, init_engine, pool_metrics
+import replicas
+from replicas import init_replicas
+from metrics import init_metrics, render_metrics
+from search import init_search, name_index, prefix_page, KINDS as SEARCH_KINDS
+from stats import init_stats, stats
+from batch import read_sub_requests, run_batch
+from compression import init_compression
+from ratelimit import init_ratelimit
+from idempotency import init_idempotency, idempotent
+from jobs import init_jobs, wants_async, enqueue, accepted
+from queries import user_favorites_statement, serialize_user_favorites, favorite_exists
 #from models import Person
 
+# WARNING by default, at INFO every `flask` command prints the chatter of its libraries (alembic...)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'WARNING'))
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 app.url_map.strict_slashes = False
+# path ids beyond the Integer column range are a 404, not a driver error
+app.url_map.converters['int'] = IdConverter
 
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
+app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-MIGRATE = Migrate(app, db)
+app.config['DEFAULT_PAGE_SIZE'] = int(os.getenv('DEFAULT_PAGE_SIZE', 100))
+app.config['MAX_PAGE_SIZE'] = int(os.getenv('MAX_PAGE_SIZE', 1000))
+app.config['STREAM_BATCH_SIZE'] = int(os.getenv('STREAM_BATCH_SIZE', 1000))
+# tables up to this many rows may be sorted by a column without an index
+app.config['SORT_SCAN_LIMIT'] = int(os.getenv('SORT_SCAN_LIMIT', 10000))
+app.config['BULK_BATCH_SIZE'] = int(os.getenv('BULK_BATCH_SIZE', 1000))
+app.config['BULK_MAX_ITEMS'] = int(os.getenv('BULK_MAX_ITEMS', 50000))
+app.config['CACHE_MAXSIZE'] = int(os.getenv('CACHE_MAXSIZE', 1024))
+app.config['CACHE_TTL'] = int(os.getenv('CACHE_TTL', 60))
+# seconds an expired entry is still served while it's reloaded, 0 disables it
+app.config['CACHE_STALE_TTL'] = int(os.getenv('CACHE_STALE_TTL', 0))
+app.config['CACHE_BACKEND'] = os.getenv('CACHE_BACKEND', 'memory')
+app.config['CACHE_URL'] = os.getenv('CACHE_URL', 'redis://localhost:6379/0')
+app.config['CATALOG_MAX_AGE'] = int(os.getenv('CATALOG_MAX_AGE', 30))
+app.config['JSON_ENCODER'] = os.getenv('JSON_ENCODER', 'auto')
+app.config['DATABASE_REPLICA_URLS'] = os.getenv('DATABASE_REPLICA_URLS', '')
+app.config['REPLICA_CHECK_INTERVAL'] = int(os.getenv('REPLICA_CHECK_INTERVAL', 30))
+app.config['REPLICA_STICKY_SECONDS'] = int(os.getenv('REPLICA_STICKY_SECONDS', 5))
+app.config['QUERY_BUDGET'] = int(os.getenv('QUERY_BUDGET', 10))
+app.config['LOG_SAMPLE_RATE'] = float(os.getenv('LOG_SAMPLE_RATE', 0.01))
+# token buckets per client IP, see ratelimit.py. Off by default:
+# behind a proxy every client shares the proxy's address unless
+# TRUSTED_PROXIES is set
+app.config['RATELIMIT_ENABLED'] = os.getenv('RATELIMIT_ENABLED', '0').lower() in ('1', 'true', 'yes')
+# proxies in front of the app (1 on Render/Heroku), their X-Forwarded-For/-Proto
+# entries are trusted for request.remote_addr and the scheme
+app.config['TRUSTED_PROXIES'] = int(os.getenv('TRUSTED_PROXIES', 0))
+app.config['RATELIMIT_STORE'] = os.getenv('RATELIMIT_STORE', 'memory')
+app.config['RATELIMIT_URL'] = os.getenv('RATELIMIT_URL', os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+app.config['RATELIMIT_RATE'] = float(os.getenv('RATELIMIT_RATE', 20))
+app.config['RATELIMIT_BURST'] = int(os.getenv('RATELIMIT_BURST', 100))
+app.config['RATELIMIT_CONCURRENCY'] = int(os.getenv('RATELIMIT_CONCURRENCY', 8))
+# preferred first, brotli and zstd are skipped when their packages aren't installed
+app.config['COMPRESSION_ENCODINGS'] = os.getenv('COMPRESSION_ENCODINGS', 'br,zstd,gzip')
+app.config['COMPRESSION_MIN_SIZE'] = int(os.getenv('COMPRESSION_MIN_SIZE', 500))
+app.config['BATCH_MAX_REQUESTS'] = int(os.getenv('BATCH_MAX_REQUESTS', 50))
+# ?async=1 writes, see jobs.py. Worked by `flask jobs work`, JOBS_WORKERS > 0
+# also runs that many threads in a web process once it enqueues a job
+app.config['JOBS_WORKERS'] = int(os.getenv('JOBS_WORKERS', 0))
+app.config['JOBS_BATCH_SIZE'] = int(os.getenv('JOBS_BATCH_SIZE', 500))
+app.config['JOBS_POLL_INTERVAL'] = float(os.getenv('JOBS_POLL_INTERVAL', 1))
+# seconds an idle worker waits after a wake up so a burst lands in one batch
+app.config['JOBS_COALESCE_DELAY'] = float(os.getenv('JOBS_COALESCE_DELAY', 0.05))
+app.config['JOBS_TIMEOUT'] = int(os.getenv('JOBS_TIMEOUT', 300))
+app.config['JOBS_MAX_ATTEMPTS'] = int(os.getenv('JOBS_MAX_ATTEMPTS', 3))
+# responses of requests with an Idempotency-Key, see idempotency.py
+app.config['IDEMPOTENCY_STORE'] = os.getenv('IDEMPOTENCY_STORE', 'memory')
+app.config['IDEMPOTENCY_URL'] = os.getenv('IDEMPOTENCY_URL', os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+app.config['IDEMPOTENCY_TTL'] = int(os.getenv('IDEMPOTENCY_TTL', 86400))
+app.config['IDEMPOTENCY_MAXSIZE'] = int(os.getenv('IDEMPOTENCY_MAXSIZE', 10000))
+app.config['SEARCH_INDEX_TTL'] = int(os.getenv('SEARCH_INDEX_TTL', 300))
+# how often each worker checks the /stats aggregates against the database
+app.config['STATS_RECONCILE_INTERVAL'] = int(os.getenv('STATS_RECONCILE_INTERVAL', 300))
+# API_ONLY=1 boots just the API: no admin, no /spec and no Flask-Migrate
+# (run the `flask db` commands without it)
+app.config['API_ONLY'] = os.getenv('API_ONLY', '0').lower() in ('1', 'true', 'yes')
+# lazy builds the admin on the first /admin request, eager at boot, off disables it
+app.config['ADMIN_MODE'] = 'off' if app.config['API_ONLY'] else os.getenv('ADMIN_MODE', 'lazy')
+
+if not app.config['API_ONLY']:
+    # alembic is a big import and only the `flask db` commands need it
+    from flask_migrate import Migrate
+    MIGRATE = Migrate(app, db)
 db.init_app(app)
+init_engine(app, db)
+init_replicas(app)
 CORS(app)
-setup_admin(app)
+init_cache(app)
+init_serialization(app)
+init_metrics(app)
+init_compression(app)
+init_ratelimit(app)
+init_search(app)
+init_stats(app)
+init_jobs(app)
+init_idempotency(app)
+init_admin(app)
+if app.config['TRUSTED_PROXIES']:
+    # outermost, so the rate limiter and replica stickiness see the client address
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'], x_proto=app.config['TRUSTED_PROXIES'])
 
 # Handle/serialize errors like a JSON object
 @app.errorhandler(APIException)
@@ -36,22 +132,52 @@ def handle_invalid_usage(error):
 def sitemap():
     return generate_sitemap(app)
 
+# swagger spec of the API, flask_swagger is only imported when asked for
+@functools.cache
+def build_spec():
+    from flask_swagger import swagger
+    spec = swagger(app)
+    spec['info'] = {'title': 'StarWars REST API', 'version': '1.0'}
+    return spec
+
+if not app.config['API_ONLY']:
+    @app.route('/spec', methods=['GET'])
+    def get_spec():
+        return jsonify(build_spec())
+
+# hit/miss/eviction counters of the catalog cache
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(cache_stats())
+
+# checkout wait time and saturation of the connection pool
+@app.route('/pool/stats', methods=['GET'])
+def get_pool_stats():
+    stats = pool_metrics.stats()
+    stats['replicas'] = replicas.replica_set.stats() if replicas.replica_set is not None else []
+    return jsonify(stats)
+
+# Prometheus scrape endpoint
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    body = render_metrics(cache_stats(), pool_metrics.stats())
+    return app.response_class(body, mimetype='text/plain; version=0.0.4')
+
 #User Endpoints
 @app.route('/user', methods=['GET'])
 def handle_hello():
-    all_users = User.query.all()
-    users_serialized = []
-    for user in all_users:
-        users_serialized.append(user.serialize())
-    print(users_serialized)
-    return {'msg' : 'ok', 'data':users_serialized}, 200
+    if wants_stream(request):
+        return stream_rows(User, request, ('id', 'email', 'is_active'))
+    users_serialized, next_cursor = paginate(User, request.args, ('id', 'email', 'is_active'))
+    log_sampled(logger, logging.DEBUG, 'GET /user returned %d users', len(users_serialized))
+    return {'msg' : 'ok', 'data':users_serialized, 'next': next_cursor}, 200
 
 #Generate single user using ID
 @app.route('/user/<int:id>', methods=['GET'])
 def get_single_user(id):
     #user1 = Person.query.get(person_id)
     single_user = User.query.get(id)
-    print(single_user)
+    log_sampled(logger, logging.DEBUG, 'GET /user/%s: %s', id, single_user)
     if single_user is None:
         return {"Error" : "User ID doesn't exist"}, 404
 
@@ -60,28 +186,36 @@ def get_single_user(id):
 #--- Character Endpoints ---#
 #Generate all characters
 @app.route('/characters')
+@conditional_get(lambda: table_validator(Characters), vary=('Accept',))
 def get_all_characters(): 
-    all_characters = Characters.query.all()
-    all_characters_serialized = []
-
-    for character in all_characters:
-        all_characters_serialized.append(character.serialize_id_name())
-
-    print(all_characters_serialized)
-    return {"data" : all_characters_serialized}
+    if 'ids' in request.args:
+        characters_serialized, missing = cached_by_ids(Characters, request.args)
+        return {"data" : characters_serialized, "missing": missing}
+    if request.args.get('name_prefix'):
+        characters_serialized, next_cursor = prefix_page(Characters, request.args, ('id', 'name'))
+        return {"data" : characters_serialized, "next": next_cursor}
+    if wants_stream(request):
+        return stream_rows(Characters, request, ('id', 'name'))
+    all_characters_serialized, next_cursor = cached_page(Characters, request.args, ('id', 'name'))
+
+    log_sampled(logger, logging.DEBUG, 'GET /characters returned %d characters', len(all_characters_serialized))
+    return {"data" : all_characters_serialized, "next": next_cursor}
 
 #Generate single character
 @app.route('/characters/<int:id>', methods=['GET'])
+@conditional_get(lambda id: row_validator(Characters, id))
 def get_single_characters(id):
-    single_character = Characters.query.get(id)
+    single_character = cached(('characters', id), lambda: serialize_or_none(Characters.query.get(id)))
     
     if single_character is None:
         return jsonify({'Error': 'Character ID doesnt exist'}),404
 
-    return jsonify({'data': single_character.serialize()})
+    return jsonify({'data': single_character})
 
-#Create new character 
+#Create new character, ?async=1 queues the write and answers 202 (see jobs.py)
+#and an Idempotency-Key header makes retries safe (see idempotency.py)
 @app.route('/create/character', methods=['POST'])
+@idempotent
 def create_character():
     body = request.get_json(silent=True)
     new_character = Characters()
@@ -91,6 +225,8 @@ def create_character():
         return jsonify({'Msg': 'Body field is required'}), 400
     if 'height' not in body:
         return jsonify({'msg': 'height field is required'}), 400
+    if wants_async(request):
+        return accepted(enqueue('create_character', body))
     if body['gender'] == 'male' or 'female':
         new_character.gender = body['gender']
     if body['mass'] > 0: 
@@ -98,7 +234,12 @@ def create_character():
     new_character.name = body['name']
     new_character.height = body['height']
     db.session.add(new_character)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # names are unique, a retry or a concurrent request created it first
+        db.session.rollback()
+        return jsonify({'Msg': f"Character {body['name']} already exists"}), 409
 
     return jsonify({'Msg': 'New character created', 
                     'data': new_character.serialize()})
@@ -118,27 +259,37 @@ def delete_character(id):
 #--- Planets endpoints ---#
 #Generate all planets
 @app.route('/planets', methods=['GET'])
+@conditional_get(lambda: table_validator(Planets), vary=('Accept',))
 def get_all_planets():
-    all_planets = Planets.query.all()
-    all_planets_serialized = list(map(lambda planet: planet.serialize(), all_planets))
-
-    return jsonify({'Msg': 'Ok', 'data' : all_planets_serialized}), 200
+    if 'ids' in request.args:
+        planets_serialized, missing = cached_by_ids(Planets, request.args)
+        return jsonify({'Msg': 'Ok', 'data' : planets_serialized, 'missing': missing}), 200
+    if request.args.get('name_prefix'):
+        planets_serialized, next_cursor = prefix_page(Planets, request.args, ('id', 'name', 'population'))
+        return jsonify({'Msg': 'Ok', 'data' : planets_serialized, 'next': next_cursor}), 200
+    if wants_stream(request):
+        return stream_rows(Planets, request, ('id', 'name', 'population'))
+    all_planets_serialized, next_cursor = cached_page(Planets, request.args, ('id', 'name', 'population'))
+
+    return jsonify({'Msg': 'Ok', 'data' : all_planets_serialized, 'next': next_cursor}), 200
 
 #Generate single planet
 @app.route('/planet/<int:id>', methods=['GET'])
+@conditional_get(lambda id: row_validator(Planets, id))
 def get_single_planet(id):
-    single_planet = Planets.query.get(id)
-    print(single_planet)
+    single_planet = cached(('planets', id), lambda: serialize_or_none(Planets.query.get(id)))
+    log_sampled(logger, logging.DEBUG, 'GET /planet/%s: %s', id, single_planet)
     if single_planet is None: 
         return jsonify ({'Error' : "ID planet doesn't exist, please try with diferent id"}), 404
 
-    return jsonify({'Msg': 'Ok', 'Data' : single_planet.serialize()}), 200
+    return jsonify({'Msg': 'Ok', 'Data' : single_planet}), 200
 
-#Create new planet
+#Create new planet, ?async=1 queues it
 @app.route('/create/planet', methods=['POST'])
+@idempotent
 def create_new_planet():
     body = request.get_json(silent=True)
-    print(body)
+    logger.debug('POST /create/planet body: %s', body)
     new_planet = Planets()
     if body is None:
         return jsonify({'Msg' : 'Body must not be empty, please fill will all the info'}), 400
@@ -146,10 +297,16 @@ def create_new_planet():
         return jsonify({'Msg' : 'Please add planet name'}), 400
     if 'population' not in body:
         return jsonify({'Msg' : 'Please add planet population'}), 400
+    if wants_async(request):
+        return accepted(enqueue('create_planet', body))
     new_planet.name = body['name']
     new_planet.population = body['population']
     db.session.add(new_planet)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'Msg' : f"Planet {body['name']} already exists"}), 409
 
     return jsonify({'Msg' : 'Planet created',
                     'data' : new_planet.serialize()})
@@ -158,7 +315,7 @@ def create_new_planet():
 @app.route('/delete/planet/<int:id>', methods=['DELETE'])
 def delete_planet(id):
     planet_to_delete = Planets.query.get(id)
-    print(planet_to_delete)
+    logger.debug('DELETE /delete/planet/%s: %s', id, planet_to_delete)
     if planet_to_delete is None: 
         return jsonify({'Error': 'Planet ID doesnt found'}), 404
     db.session.delete(planet_to_delete)
@@ -172,57 +329,50 @@ def delete_planet(id):
 #Get user favorites
 @app.route('/user/<int:user_id>/favorites', methods=['GET'])
 def get_user_favorites(user_id):
-    user = User.query.get(user_id)
-    if user is None: 
+    favorites = cached(('favorites', user_id),
+                       lambda: serialize_user_favorites(db.session.execute(user_favorites_statement(user_id)).all()))
+    if favorites is None: 
         return jsonify({'Msg' : f'User with ID {user_id} doesnt exist'}), 404
-    favorite_user_planets = FavoritePlanets.query.filter_by(user_id = user_id).all()
-    if len(favorite_user_planets) <= 0:
+    user_favorite_planets_serialized, user_favorite_characters_serialized = favorites
+    if not user_favorite_planets_serialized and not user_favorite_characters_serialized:
         return jsonify({'Msg': f'User with ID {user_id} doesnt have favorites'})
-    
-#Query to get planets favorites
-    favorite_planets = db.session.query(FavoritePlanets, Planets).join(Planets).filter(FavoritePlanets.user_id == user_id).all()
-    user_favorite_planets_serialized = []
-    for favorite_planet, planet in favorite_planets:
-        user_favorite_planets_serialized.append({
-            'favorite_planet_id': favorite_planet.id,
-            'planet_detail': planet.serialize(),
-        })
-
-#Query to get character favorites
-    favorite_characters = db.session.query(FavoriteCharacters, Characters).join(Characters).filter(FavoriteCharacters.user_id == user_id).all()
-    user_favorite_characters_serialized = []
-    for favorite_character, character in favorite_characters:
-        user_favorite_characters_serialized.append({
-            'favorite_character_id': favorite_character.id,
-            'character_detail': character.serialize_id_name()
-        })
-    print(user_favorite_characters_serialized)
+    log_sampled(logger, logging.DEBUG, 'GET /user/%s/favorites returned %d planets and %d characters', user_id,
+                len(user_favorite_planets_serialized), len(user_favorite_characters_serialized))
     
     return jsonify({'msg' : 'Ok', 
                     'favorite_planets': user_favorite_planets_serialized, 
                     'favorite_characters': user_favorite_characters_serialized}), 200
 
-#Add new character to favorites
+#Add new character to favorites, ?async=1 queues it
 @app.route('/user/<int:user_id>/favorite/add/character', methods=['POST'])
+@idempotent
 def user_new_character_favorite(user_id):
     body = request.get_json(silent=True)
-    user = User.query.get(user_id)
-    character = Characters.query.get(body['character_id'])
-    user_favorites = FavoriteCharacters.query.all()
-    user_favorites_serialized = list(map(lambda userfav: userfav.serialize(), user_favorites))
     if body is None: 
         return jsonify({'error' : 'Body must contain info'}), 400
     if 'character_id' not in body:
         return jsonify({'error' : 'Body must contain character_id'}), 400
+    if wants_async(request):
+        return accepted(enqueue('add_favorite', {'user_id': user_id, 'character_id': body['character_id']}))
+    user = User.query.get(user_id)
     if user is None: 
         return jsonify({'msg' : 'user ID doesnt exist'}),400
+    character = Characters.query.get(body['character_id'])
     if character is None: 
         return jsonify({'msg' : 'Character ID doesnt exist'}), 400
+    # EXISTS on the (user_id, character_id) unique index, cost doesn't grow with the table
+    if favorite_exists(FavoriteCharacters, user_id, character_id=body['character_id']):
+        return jsonify({'msg' : 'Character is already a favorite'}), 409
     new_favorite = FavoriteCharacters()
     new_favorite.user_id = user_id
     new_favorite.character_id = body['character_id']
     db.session.add(new_favorite)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # a concurrent request added the same favorite after our check
+        db.session.rollback()
+        return jsonify({'msg' : 'Character is already a favorite'}), 409
     
     return jsonify({'msg' : 'New character added to favorite', 'success' : new_favorite.serialize()}),201
 
@@ -244,29 +394,169 @@ def delete_character_favorite(user_id):
 
     return jsonify({'Msg' : 'Character from favorites deleted', 'success' : favorite.serialize()})
 
-#Add new planet to favorites
+#Add new planet to favorites, ?async=1 queues it
 @app.route('/user/<int:user_id>/favorites/add/planet', methods=['POST'])
+@idempotent
 def add_new_favorite_planet(user_id):
     body = request.get_json(silent=True)
-    user = User.query.get(user_id)
-    planet = Planets.query.get(body['planet_id'])
     if body is None: 
         return jsonify({'msg' : 'Body must contain info'}), 400
+    if wants_async(request) and 'planet_id' in body:
+        return accepted(enqueue('add_favorite', {'user_id': user_id, 'planet_id': body['planet_id']}))
+    user = User.query.get(user_id)
     if user is None: 
         return jsonify({'msg' : 'User doesnt exist'}), 400
     if 'planet_id' not in body:
         return jsonify({'msg' : 'body must containt planet_id key'}), 400
+    planet = Planets.query.get(body['planet_id'])
     if planet is None: 
         return jsonify({'msg' : 'planet doesnt exist'}), 400
+    if favorite_exists(FavoritePlanets, user_id, planet_id=body['planet_id']):
+        return jsonify({'msg' : 'Planet is already a favorite'}), 409
     new_favorite = FavoritePlanets()
     new_favorite.user_id = user_id
     new_favorite.planet_id = body['planet_id']
     db.session.add(new_favorite)
-    db.session.commit()
-    print(planet)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'msg' : 'Planet is already a favorite'}), 409
+    logger.debug('User %s added planet %s to favorites', user_id, planet)
 
     return jsonify({'msg' : 'Success, planet added to favorite', 'data' : new_favorite.serialize()}), 200
 
+#--- Search ---#
+#Ranked name search over characters and planets, ?q= is required,
+#?type=characters|planets narrows it and ?offset=&limit= paginate
+@app.route('/search', methods=['GET'])
+def search_names():
+    query = request.args.get('q', '').strip()
+    if not query:
+        raise APIException('q parameter is required', status_code=400)
+    kind = request.args.get('type')
+    if kind is not None and kind not in SEARCH_KINDS:
+        raise APIException('type must be characters or planets', status_code=400)
+    try:
+        offset = int(request.args.get('offset', 0))
+        limit = min(int(request.args.get('limit', 20)), app.config['MAX_PAGE_SIZE'])
+    except ValueError:
+        raise APIException('offset and limit must be integers', status_code=400)
+    matches = name_index.search(query, kind)
+    results = [{'type': match_kind, 'id': id, 'name': name, 'score': score}
+               for score, match_kind, id, name in matches[offset:offset + limit]]
+    next_offset = offset + limit if offset + limit < len(matches) else None
+
+    return jsonify({'msg': 'ok', 'total': len(matches), 'data': results, 'next': next_offset}), 200
+#--------------------------------------------------#
+
+#--- Batch ---#
+#Run several GET sub-requests in one call, body: {"requests": [{"path": "/characters/1"}, ...]}
+#Rows of /characters/<id>, /planet/<id> and ?ids= sub-requests are loaded
+#up front with one IN query per model
+@app.route('/batch', methods=['POST'])
+def batch_requests():
+    sub_requests = read_sub_requests(request.get_json(silent=True))
+    return jsonify({'msg': 'ok', 'responses': run_batch(app, sub_requests)}), 200
+#--------------------------------------------------#
+
+#--- Jobs ---#
+#Progress of a write accepted with ?async=1: queued, running, done (result
+#holds the new id) or failed (error says why)
+@app.route('/jobs/<int:id>', methods=['GET'])
+def get_job(id):
+    job = db.session.get(Job, id)
+    if job is None:
+        return jsonify({'msg': 'Job doesnt exist'}), 404
+
+    return jsonify({'msg': 'ok', 'data': job.serialize()}), 200
+#--------------------------------------------------#
+
+#--- Stats ---#
+#Counts, population total, gender breakdown and favorite totals, served
+#from the in-memory aggregates of stats.py
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    return jsonify({'msg': 'ok', 'data': stats.summary()}), 200
+
+#Gender breakdown of the characters
+@app.route('/stats/characters/genders', methods=['GET'])
+def get_gender_stats():
+    return jsonify({'msg': 'ok', 'data': stats.gender_breakdown()}), 200
+
+#Most favorited planets or characters, ?limit= of them (10 by default)
+@app.route('/stats/favorites/<kind>', methods=['GET'])
+def get_top_favorites(kind):
+    if kind not in SEARCH_KINDS:
+        raise APIException('kind must be characters or planets', status_code=404)
+    try:
+        limit = min(int(request.args.get('limit', 10)), app.config['MAX_PAGE_SIZE'])
+    except ValueError:
+        raise APIException('limit must be an integer', status_code=400)
+    top = stats.top_favorites(kind, max(limit, 0))
+    model = SEARCH_KINDS[kind]
+    names = dict(db.session.execute(db.select(model.id, model.name).where(model.id.in_([id for id, _ in top]))).all())
+    results = [{'id': id, 'name': names.get(id), 'favorites': count} for id, count in top]
+
+    return jsonify({'msg': 'ok', 'data': results}), 200
+#--------------------------------------------------#
+
+#--- Bulk endpoints ---#
+# Body is a JSON array (or NDJSON with Content-Type: application/x-ndjson),
+# every item is validated before anything is written and all the rows go in
+# one transaction, inserted with executemany in batches of ?batch_size=
+
+#Create many characters
+@app.route('/bulk/characters', methods=['POST'])
+def bulk_create_characters():
+    items = read_items(request)
+    try:
+        results, errors = bulk_create(Characters, items, validate_character, batch_size_from(request.args))
+        if errors:
+            return jsonify({'Msg': 'Nothing was created, fix the items with errors', 'results': errors}), 400
+        db.session.commit()
+    except IntegrityError:
+        # a concurrent request created one of the names after they were checked
+        db.session.rollback()
+        return jsonify({'Msg': 'Nothing was created, an item conflicts with a row created meanwhile'}), 409
+
+    return jsonify({'Msg': f'{len(results)} characters created', 'results': results}), 201
+
+#Create many planets
+@app.route('/bulk/planets', methods=['POST'])
+def bulk_create_planets():
+    items = read_items(request)
+    try:
+        results, errors = bulk_create(Planets, items, validate_planet, batch_size_from(request.args))
+        if errors:
+            return jsonify({'Msg': 'Nothing was created, fix the items with errors', 'results': errors}), 400
+        db.session.commit()
+    except IntegrityError:
+        # a concurrent request created one of the names after they were checked
+        db.session.rollback()
+        return jsonify({'Msg': 'Nothing was created, an item conflicts with a row created meanwhile'}), 409
+
+    return jsonify({'Msg': f'{len(results)} planets created', 'results': results}), 201
+
+#Add many planets and characters to favorites
+@app.route('/user/<int:user_id>/favorites/bulk', methods=['POST'])
+def bulk_add_favorites(user_id):
+    items = read_items(request)
+    if User.query.get(user_id) is None:
+        return jsonify({'msg' : 'User doesnt exist'}), 404
+    try:
+        results, errors = bulk_create_favorites(user_id, items, batch_size_from(request.args))
+        if errors:
+            return jsonify({'msg': 'Nothing was added, fix the items with errors', 'results': errors}), 400
+        db.session.commit()
+    except IntegrityError:
+        # a concurrent request added one of the favorites, or deleted its target, after the checks
+        db.session.rollback()
+        return jsonify({'msg': 'Nothing was added, an item conflicts with a change made meanwhile'}), 409
+
+    return jsonify({'msg': f'{len(results)} favorites added', 'results': results}), 201
+#--------------------------------------------------#
+
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
@@ -0,0 +1,346 @@
+"""
+ASGI entry point, an alternative to wsgi.py:
+
+    uvicorn asgi:application --app-dir ./src/ --workers 4
+
+The read endpoints that dominate traffic (/characters, /characters/<id>,
+/planets, /planet/<id> and /user/<id>/favorites) read the database here
+through an async SQLAlchemy engine, so a slow query only parks a
+coroutine instead of a thread. The favorites endpoint runs its user,
+planet and character queries concurrently, each on its own connection.
+
+Only the reads are async. Each request still runs inside a Flask request
+context with the before/after request hooks of the app, so the rate
+limiter, validators and 304s (conditional.py), the response cache,
+compression and CORS answer exactly as on the Flask views, and the async
+views share the cache entries of the Flask ones. Async loads of one key
+are coalesced per worker like cache.cached() does with threads. The async
+engine always reads the primary: read replicas serve the Flask views only.
+
+Everything else (writes, admin, streaming exports, ?ids=, ?name_prefix=,
+sorting by a column without an index) is handed to the Flask app through
+asgiref's WsgiToAsgi, on a thread pool instead of the single thread
+asgiref uses by default. With an in-memory SQLite database every request
+goes to the Flask app, a second engine would open a second, empty database.
+
+Needs `pipenv install uvicorn asgiref` plus the async driver of the
+database: aiosqlite for SQLite, asyncpg for Postgres, aiomysql for MySQL.
+"""
+import asyncio
+import io
+import logging
+from functools import wraps
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from flask import request, jsonify, make_response
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
+from app import app
+from models import Planets, Characters
+import cache
+from cache import page_key
+from conditional import (table_state_statement, row_state_statement, table_validation, row_validation,
+                         stored_response, add_validators)
+from engine_config import engine_options, configure_engine
+from queries import user_marker_statement, favorite_planets_statement, favorite_characters_statement, serialize_user_favorites
+from utils import page_statements, page_from_rows, query_fields, is_indexed, wants_stream
+
+logger = logging.getLogger(__name__)
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'mysql': 'mysql+aiomysql',
+}
+
+def async_database_uri(uri):
+    scheme, rest = uri.split('://', 1)
+    dialect = scheme.split('+')[0]
+    if dialect not in ASYNC_DRIVERS:
+        raise RuntimeError(f'No async driver configured for {dialect} databases')
+    return f'{ASYNC_DRIVERS[dialect]}://{rest}'
+
+def create_engine(uri):
+    if uri in ('sqlite://', 'sqlite:///:memory:'):
+        return None
+    engine = create_async_engine(async_database_uri(uri), **engine_options(uri, instrumented=False))
+    configure_engine(engine.sync_engine)
+    return engine
+
+engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+
+class ThreadedWsgiToAsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs every request of the worker on one shared thread by
+    # default, the Flask app is thread safe and gets the loop's pool instead
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False)
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiToAsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+flask_application = ThreadedWsgiToAsgi(app)
+
+#--- Async reads through the cache ---#
+
+async def fetch_all(statement):
+    async with engine.connect() as connection:
+        return (await connection.execute(statement)).all()
+
+# (generation, key) -> task of the load running in this worker
+_loads = {}
+
+def _start_load(key, loader):
+    """
+    (task, shared) of the load of key, a new one unless a load of key for
+    the current generation is already running
+    """
+    generation = cache.cache.generation(key[0])
+    task = _loads.get((generation, key))
+    if task is not None:
+        return task, True
+
+    async def load():
+        try:
+            value = await loader()
+            if value is not None:
+                # not stored when an invalidation committed while the loader ran
+                cache.cache.set(key, value, generation)
+            return value
+        finally:
+            del _loads[(generation, key)]
+
+    task = _loads[(generation, key)] = asyncio.ensure_future(load())
+    return task, False
+
+def _log_failed_refresh(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error('Background refresh failed', exc_info=task.exception())
+
+async def cached(key, loader):
+    """
+    cache.cached() for an async loader
+    """
+    value = cache.cache.get(key)
+    if value is not cache.MISSING:
+        return value
+    if cache.cache.stale_ttl:
+        value = cache.cache.get_stale(key)
+        if value is not cache.MISSING:
+            cache.counters['stale_hits'] += 1
+            task, shared = _start_load(key, loader)
+            if not shared:
+                cache.counters['refreshes'] += 1
+                task.add_done_callback(_log_failed_refresh)
+            return value
+    task, shared = _start_load(key, loader)
+    if shared:
+        cache.counters['coalesced'] += 1
+    # a request that goes away doesn't cancel the load the others wait for
+    return await asyncio.shield(task)
+
+async def cached_page(model, default_fields):
+    args = request.args
+
+    async def load():
+        statements, keys, limit, sort = page_statements(model, args, default_fields)
+        # utils.page_rows()
+        rows = []
+        for statement in statements:
+            rows.extend(await fetch_all(statement.limit(limit + 1 - len(rows))))
+            if len(rows) > limit:
+                break
+        return page_from_rows(rows, keys, limit, sort)
+    return await cached(page_key(model, args, default_fields), load)
+
+async def fetch_serialized(model, id):
+    rows = await fetch_all(model.__table__.select().where(model.id == id))
+    if not rows:
+        return None
+    row = rows[0]._mapping
+    return {key: row[attribute] for key, attribute in model.serialize_fields.items()}
+
+async def fetch_favorites(user_id):
+    # the branches of queries.user_favorites_statement, each on its own connection
+    user_rows, planet_rows, character_rows = await asyncio.gather(
+        fetch_all(user_marker_statement(user_id)),
+        fetch_all(favorite_planets_statement(user_id)),
+        fetch_all(favorite_characters_statement(user_id)),
+    )
+    return serialize_user_favorites(user_rows + planet_rows + character_rows)
+
+#--- Conditional GET, see conditional.py ---#
+
+async def table_validator(model):
+    async def load():
+        return tuple((await fetch_all(table_state_statement(model)))[0])
+    return table_validation(model, await cached((model.__tablename__, 'validator'), load))
+
+async def row_validator(model, id):
+    async def load():
+        rows = await fetch_all(row_state_statement(model, id))
+        return rows[0][0] if rows else None
+    return row_validation(model, id, await cached((model.__tablename__, 'validator', id), load))
+
+def conditional_get(validator, vary=()):
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(**kwargs):
+            validated = await validator(**kwargs)
+            if validated is None:
+                return await view(**kwargs)
+            etag, last_modified = validated
+            response = stored_response(etag, last_modified)
+            if response is None:
+                response = make_response(await view(**kwargs))
+                if response.status_code != 200:
+                    return response
+            return add_validators(response, etag, last_modified, vary)
+        return wrapper
+    return decorator
+
+#--- Views, the async twins of the Flask views of the same name ---#
+
+@conditional_get(lambda: table_validator(Characters), vary=('Accept',))
+async def get_all_characters():
+    all_characters_serialized, next_cursor = await cached_page(Characters, ('id', 'name'))
+    return {"data" : all_characters_serialized, "next": next_cursor}
+
+@conditional_get(lambda id: row_validator(Characters, id))
+async def get_single_characters(id):
+    single_character = await cached(('characters', id), lambda: fetch_serialized(Characters, id))
+    if single_character is None:
+        return jsonify({'Error': 'Character ID doesnt exist'}),404
+    return jsonify({'data': single_character})
+
+@conditional_get(lambda: table_validator(Planets), vary=('Accept',))
+async def get_all_planets():
+    all_planets_serialized, next_cursor = await cached_page(Planets, ('id', 'name', 'population'))
+    return jsonify({'Msg': 'Ok', 'data' : all_planets_serialized, 'next': next_cursor}), 200
+
+@conditional_get(lambda id: row_validator(Planets, id))
+async def get_single_planet(id):
+    single_planet = await cached(('planets', id), lambda: fetch_serialized(Planets, id))
+    if single_planet is None:
+        return jsonify ({'Error' : "ID planet doesn't exist, please try with diferent id"}), 404
+    return jsonify({'Msg': 'Ok', 'Data' : single_planet}), 200
+
+async def get_user_favorites(user_id):
+    favorites = await cached(('favorites', user_id), lambda: fetch_favorites(user_id))
+    if favorites is None:
+        return jsonify({'Msg' : f'User with ID {user_id} doesnt exist'}), 404
+    user_favorite_planets_serialized, user_favorite_characters_serialized = favorites
+    if not user_favorite_planets_serialized and not user_favorite_characters_serialized:
+        return jsonify({'Msg': f'User with ID {user_id} doesnt have favorites'})
+    return jsonify({'msg' : 'Ok',
+                    'favorite_planets': user_favorite_planets_serialized,
+                    'favorite_characters': user_favorite_characters_serialized}), 200
+
+# endpoint -> (async view, model of the list endpoints)
+ASYNC_VIEWS = {
+    'get_all_characters': (get_all_characters, Characters),
+    'get_single_characters': (get_single_characters, None),
+    'get_all_planets': (get_all_planets, Planets),
+    'get_single_planet': (get_single_planet, None),
+    'get_user_favorites': (get_user_favorites, None),
+}
+
+#--- Dispatch ---#
+
+def sorts_without_index(model, args):
+    # utils.parse_sort() counts the rows of the table for those, synchronously
+    field = args.get('sort', '').lstrip('-')
+    fields = query_fields(model)
+    return field in fields and not is_indexed(getattr(model, fields[field]))
+
+def match_async_view(environ):
+    """
+    The async view for the request in environ, None for the requests the
+    Flask app has to answer
+    """
+    if engine is None or environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+        return None
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        return None
+    if endpoint not in ASYNC_VIEWS:
+        return None
+    view, model = ASYNC_VIEWS[endpoint]
+    if model is not None:
+        args = app.request_class(environ)
+        if 'ids' in args.args or args.args.get('name_prefix') or wants_stream(args):
+            return None
+        if sorts_without_index(model, args.args):
+            return None
+    return view
+
+def build_environ(scope):
+    """
+    The environ WsgiToAsgi builds for scope, None when it rejects it. GET
+    requests have no body to wait for.
+    """
+    instance = WsgiToAsgiInstance(app)
+    instance.scope = scope
+    try:
+        return proxy_fixed(instance.build_environ(scope, io.BytesIO()))
+    except ValueError:
+        return None
+
+# ProxyFix of app.wsgi_app (TRUSTED_PROXIES) applied to an environ, the
+# async views see the client address the Flask views and the rate limiter see
+def proxy_fixed(environ):
+    proxy_fix = app.wsgi_app
+    if not isinstance(proxy_fix, ProxyFix):
+        return environ
+    return ProxyFix(lambda environ, start_response: environ, x_for=proxy_fix.x_for, x_proto=proxy_fix.x_proto,
+                    x_host=proxy_fix.x_host, x_port=proxy_fix.x_port, x_prefix=proxy_fix.x_prefix)(environ, None)
+
+async def dispatch(view, environ):
+    """
+    Flask.wsgi_app() / full_dispatch_request() around an async view
+    """
+    with app.request_context(environ):
+        try:
+            try:
+                response = app.preprocess_request()
+                if response is None:
+                    response = await view(**request.view_args)
+            except Exception as error:
+                response = app.handle_user_exception(error)
+            return app.finalize_request(response)
+        except Exception as error:
+            return app.handle_exception(error)
+
+async def send_response(response, environ, send):
+    # the werkzeug response as a WSGI server would send it (no body for HEAD or 304)
+    headers = response.get_wsgi_headers(environ)
+    body = b''.join(response.get_app_iter(environ))
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers.to_wsgi_list()],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+    response.close()
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if engine is not None:
+                await engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'http':
+        environ = build_environ(scope)
+        view = match_async_view(environ) if environ is not None else None
+        if view is not None:
+            return await send_response(await dispatch(view, environ), environ, send)
+    return await flask_application(scope, receive, send)
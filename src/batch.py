@@ -0,0 +1,78 @@
+"""
+POST /batch: several GET sub-requests in one HTTP call.
+
+Before anything is dispatched, the character and planet ids every
+sub-request will need (/characters/<id>, /planet/<id> and ?ids= lists)
+are collected and loaded with one IN query per model into the cache. The
+sub-requests then run through the normal views, with their own app
+context, and find their rows already cached.
+"""
+from urllib.parse import urlsplit, parse_qsl
+from flask import current_app, request
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
+from utils import APIException, parse_ids
+from models import Planets, Characters
+from cache import cached_many
+
+# endpoint -> model of the views whose rows are prefetched
+SINGLE_ROW_ENDPOINTS = {'get_single_characters': Characters, 'get_single_planet': Planets}
+IDS_ENDPOINTS = {'get_all_characters': Characters, 'get_all_planets': Planets}
+
+def read_sub_requests(body):
+    if not isinstance(body, dict) or not isinstance(body.get('requests'), list) or not body['requests']:
+        raise APIException('Body must be an object with a non empty requests list', status_code=400)
+    max_requests = current_app.config.get('BATCH_MAX_REQUESTS', 50)
+    if len(body['requests']) > max_requests:
+        raise APIException(f'Batches are limited to {max_requests} requests', status_code=413)
+    sub_requests = []
+    for index, item in enumerate(body['requests']):
+        if not isinstance(item, dict) or not isinstance(item.get('path'), str) or not item['path'].startswith('/'):
+            raise APIException(f'Request {index} must be an object with a path starting with /', status_code=400)
+        if item.get('method', 'GET').upper() != 'GET':
+            raise APIException(f'Request {index}: only GET requests can be batched', status_code=400)
+        headers = item.get('headers', {})
+        if not isinstance(headers, dict):
+            raise APIException(f'Request {index}: headers must be an object', status_code=400)
+        # the batch response as a whole is what gets compressed
+        headers = {name: value for name, value in headers.items() if name.lower() != 'accept-encoding'}
+        sub_requests.append((item['path'], headers))
+    return sub_requests
+
+def wanted_ids(app, paths):
+    """
+    {model: [ids]} the single row and ?ids= sub-requests will look up,
+    paths that don't route or carry bad ids are left to their view
+    """
+    adapter = app.url_map.bind('localhost')
+    wanted = {}
+    for path in paths:
+        parts = urlsplit(path)
+        try:
+            endpoint, values = adapter.match(parts.path, method='GET')
+        except HTTPException:
+            continue
+        if endpoint in SINGLE_ROW_ENDPOINTS:
+            wanted.setdefault(SINGLE_ROW_ENDPOINTS[endpoint], []).append(values['id'])
+        elif endpoint in IDS_ENDPOINTS:
+            args = MultiDict(parse_qsl(parts.query, keep_blank_values=True))
+            if 'ids' in args:
+                try:
+                    wanted.setdefault(IDS_ENDPOINTS[endpoint], []).extend(parse_ids(args))
+                except APIException:
+                    continue
+    return wanted
+
+def run_batch(app, sub_requests):
+    for model, ids in wanted_ids(app, [path for path, _ in sub_requests]).items():
+        cached_many(model, list(dict.fromkeys(ids)))
+    # sub-requests are rate limited as the client of the batch
+    environ = {'starwars.batch': True, 'REMOTE_ADDR': request.environ.get('REMOTE_ADDR', '')}
+    responses = []
+    for path, headers in sub_requests:
+        # a fresh app context gives every sub-request its own g and session
+        with app.app_context(), app.test_request_context(path, method='GET', headers=headers, environ_base=environ):
+            response = app.full_dispatch_request()
+            body = response.get_json(silent=True) if response.is_json else response.get_data(as_text=True)
+        responses.append({'path': path, 'status': response.status_code, 'body': body})
+    return responses
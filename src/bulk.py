@@ -0,0 +1,199 @@
+"""
+Bulk loading helpers: read a JSON array or NDJSON body, validate every item
+up front and insert the valid rows with executemany in one transaction
+"""
+import json
+from flask import current_app
+from utils import APIException, is_int
+from models import db, Planets, Characters, FavoritePlanets, FavoriteCharacters
+
+def read_items(request):
+    if request.mimetype == 'application/x-ndjson':
+        try:
+            items = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        except ValueError:
+            raise APIException('Every NDJSON line must be a JSON object', status_code=400)
+    else:
+        items = request.get_json(silent=True)
+    if not isinstance(items, list) or len(items) == 0:
+        raise APIException('Body must be a non empty JSON array or NDJSON stream', status_code=400)
+    max_items = current_app.config.get('BULK_MAX_ITEMS', 50000)
+    if len(items) > max_items:
+        raise APIException(f'Bulk requests are limited to {max_items} items', status_code=413)
+    return items
+
+def batch_size_from(args):
+    try:
+        size = int(args.get('batch_size', current_app.config.get('BULK_BATCH_SIZE', 1000)))
+    except ValueError:
+        raise APIException('batch_size must be an integer', status_code=400)
+    if size < 1:
+        raise APIException('batch_size must be >= 1', status_code=400)
+    return size
+
+def validate_character(item):
+    if not isinstance(item, dict):
+        return None, 'Item must be an object'
+    if not isinstance(item.get('name'), str) or not item['name'].strip():
+        return None, 'name field is required'
+    if len(item['name']) > 30:
+        return None, 'name must be at most 30 characters'
+    if not is_int(item.get('height')):
+        return None, 'height field is required and must be an integer'
+    mass = item.get('mass')
+    if mass is not None and (not is_int(mass) or mass <= 0):
+        return None, 'mass must be a positive integer'
+    gender = item.get('gender')
+    if gender is not None and (not isinstance(gender, str) or len(gender) > 10):
+        return None, 'gender must be a string of at most 10 characters'
+    return {'name': item['name'], 'height': item['height'], 'mass': mass, 'gender': gender}, None
+
+def validate_planet(item):
+    if not isinstance(item, dict):
+        return None, 'Item must be an object'
+    if not isinstance(item.get('name'), str) or not item['name'].strip():
+        return None, 'Please add planet name'
+    if len(item['name']) > 50:
+        return None, 'name must be at most 50 characters'
+    if not is_int(item.get('population')):
+        return None, 'Please add planet population as an integer'
+    return {'name': item['name'], 'population': item['population']}, None
+
+def validate_items(items, validator):
+    """
+    Run the validator over every item. Returns the valid rows as
+    (index, values) pairs and the per-item error results.
+    """
+    rows = []
+    errors = []
+    for index, item in enumerate(items):
+        values, error = validator(item)
+        if error is None:
+            rows.append((index, values))
+        else:
+            errors.append({'index': index, 'status': 'invalid', 'error': error})
+    return rows, errors
+
+def validate_favorite(item):
+    if not isinstance(item, dict):
+        return None, 'Item must be an object'
+    keys = [key for key in ('planet_id', 'character_id') if key in item]
+    if len(keys) != 1:
+        return None, 'Item must contain either planet_id or character_id'
+    if not is_int(item[keys[0]]):
+        return None, f'{keys[0]} must be an integer'
+    return {keys[0]: item[keys[0]]}, None
+
+def chunked_in(column, values, select_column=None, where=None):
+    """
+    Yield the values of select_column for rows where column IN values,
+    split in chunks to stay under the bind parameter limits.
+    """
+    values = list(values)
+    select_column = select_column if select_column is not None else column
+    for start in range(0, len(values), 500):
+        statement = db.select(select_column).where(column.in_(values[start:start + 500]))
+        if where is not None:
+            statement = statement.where(where)
+        yield from db.session.scalars(statement)
+
+def reject_duplicate_names(model, rows, errors):
+    """
+    Names are unique, check them against the payload itself and against the
+    table with one IN query instead of letting the insert fail.
+    """
+    seen = set()
+    unique_rows = []
+    for index, values in rows:
+        if values['name'] in seen:
+            errors.append({'index': index, 'status': 'duplicate', 'error': 'name repeated in the request'})
+        else:
+            seen.add(values['name'])
+            unique_rows.append((index, values))
+    existing = set(chunked_in(model.name, seen))
+    rows = []
+    for index, values in unique_rows:
+        if values['name'] in existing:
+            errors.append({'index': index, 'status': 'duplicate', 'error': 'name already exists'})
+        else:
+            rows.append((index, values))
+    return rows
+
+def insert_rows(model, rows, batch_size):
+    """
+    Insert the validated rows with one executemany per batch inside the
+    current transaction. Returns the per-item results, with the new ids
+    when the dialect can return them from an executemany.
+    """
+    dialect = db.session.get_bind().dialect
+    returning = getattr(dialect, 'insert_executemany_returning_sort_by_parameter_order', False)
+    results = []
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        params = [values for _, values in batch]
+        if returning:
+            statement = db.insert(model).returning(model.id, sort_by_parameter_order=True)
+            ids = db.session.scalars(statement, params).all()
+        else:
+            db.session.execute(db.insert(model), params)
+            ids = [None] * len(batch)
+        for (index, _), new_id in zip(batch, ids):
+            results.append({'index': index, 'status': 'created', 'id': new_id})
+    return results
+
+def bulk_create(model, items, validator, batch_size):
+    """
+    Validate everything first, nothing is written unless every item is valid.
+    Returns (results, errors), only one of them is non empty.
+    """
+    rows, errors = validate_items(items, validator)
+    rows = reject_duplicate_names(model, rows, errors)
+    if errors:
+        return [], sorted(errors, key=lambda result: result['index'])
+    return insert_rows(model, rows, batch_size), []
+
+FAVORITE_TARGETS = {
+    'planet_id': (FavoritePlanets, Planets),
+    'character_id': (FavoriteCharacters, Characters),
+}
+
+def favorite_rows(user_id, rows, errors):
+    """
+    Check the validated favorite rows of user_id against the targets and the
+    favorites the user already has, appending to errors. Returns
+    [(key, favorite model, [(index, values)])] of the rows to insert.
+    """
+    to_insert = []
+    for key, (favorite_model, target_model) in FAVORITE_TARGETS.items():
+        key_rows = [(index, values) for index, values in rows if key in values]
+        if not key_rows:
+            continue
+        wanted = {values[key] for _, values in key_rows}
+        found = set(chunked_in(target_model.id, wanted))
+        already = set(chunked_in(getattr(favorite_model, key), wanted, where=favorite_model.user_id == user_id))
+        seen = set()
+        valid_rows = []
+        for index, values in key_rows:
+            target_id = values[key]
+            if target_id not in found:
+                errors.append({'index': index, 'status': 'invalid', 'error': f'{key} {target_id} doesnt exist'})
+            elif target_id in already or target_id in seen:
+                errors.append({'index': index, 'status': 'duplicate', 'error': f'{key} {target_id} is already a favorite'})
+            else:
+                seen.add(target_id)
+                valid_rows.append((index, {'user_id': user_id, key: target_id}))
+        to_insert.append((key, favorite_model, valid_rows))
+    return to_insert
+
+def bulk_create_favorites(user_id, items, batch_size):
+    rows, errors = validate_items(items, validate_favorite)
+    to_insert = favorite_rows(user_id, rows, errors)
+    if errors:
+        return [], sorted(errors, key=lambda result: result['index'])
+    results = []
+    for key, favorite_model, valid_rows in to_insert:
+        targets = {index: values[key] for index, values in valid_rows}
+        for result in insert_rows(favorite_model, valid_rows, batch_size):
+            result[key] = targets[result['index']]
+            results.append(result)
+    return sorted(results, key=lambda result: result['index']), []
@@ -0,0 +1,525 @@
+"""
+Read-through cache for the catalog (characters, planets and favorites).
+
+Keys are tuples whose first item is a namespace, a commit that touched a
+model invalidates every namespace listed for it in INVALIDATES. Commits
+are seen through changes.subscribe(), so writes coming from the admin
+invalidate the cache as well as the API handlers.
+
+Two backends are available, picked with CACHE_BACKEND:
+
+- memory (default): a bounded LRU with a TTL inside each process.
+- redis: one store shared by every gunicorn worker on CACHE_URL, any
+  server speaking the Redis protocol works. Invalidating a namespace
+  deletes it for all the workers at once. Needs `pipenv install redis`.
+
+Every backend counts the invalidations of each namespace (its
+generation). A loader reads the generation before it runs and its value
+is only stored if the generation is still the same, so a value read
+before a commit is never written back after the commit invalidated it.
+The redis backend keeps the generations in Redis and checks them in the
+same script that stores the value, which holds across workers.
+
+With read replicas, a load that runs less than REPLICA_STICKY_SECONDS
+after its namespace was last invalidated reads from the primary: a
+replica may not have the commit yet and the old row would be cached for
+every client.
+
+Concurrent misses of one key in a process share a single run of the
+loader (singleflight.Group), so a hot entry that expires costs one query
+instead of one per waiting request. With CACHE_STALE_TTL > 0 an entry
+that expired less than that many seconds ago is still served while one
+background thread reloads it (stale-while-revalidate). Invalidated
+entries are deleted, never served stale.
+"""
+import logging
+import pickle
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import nullcontext
+from flask import current_app
+from models import db, User, Planets, Characters, FavoritePlanets, FavoriteCharacters
+from utils import APIException, parse_limit, parse_fields, parse_filters, parse_ids, paginate
+from singleflight import Group
+from changes import subscribe
+import replicas
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+# model -> namespaces whose entries must go when a row of the model changes
+INVALIDATES = {
+    User: ('favorites',),
+    Characters: ('characters', 'favorites'),
+    Planets: ('planets', 'favorites'),
+    FavoritePlanets: ('favorites',),
+    FavoriteCharacters: ('favorites',),
+}
+INVALIDATED_NAMESPACES = {namespace for namespaces in INVALIDATES.values() for namespace in namespaces}
+
+class CacheBackend:
+    """
+    Interface of the cache backends, get() returns MISSING when the key
+    is not cached
+    """
+    stale_ttl = 0
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def generation(self, namespace):
+        """
+        The invalidations of namespace so far
+        """
+        raise NotImplementedError
+
+    def invalidated_at(self, namespace):
+        """
+        time.time() of the last invalidation of namespace, 0 if none
+        """
+        raise NotImplementedError
+
+    def bump_generation(self, namespace):
+        """
+        Increment the generation of namespace without touching entries,
+        returns the new generation. For state kept outside the cache
+        (stats.py).
+        """
+        raise NotImplementedError
+
+    def get_stale(self, key):
+        """
+        The value of key if it expired less than stale_ttl seconds ago
+        """
+        return MISSING
+
+    def set(self, key, value, generation=None):
+        self.set_many([(key, value)], generation)
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set_many(self, items, generation=None):
+        """
+        Store the items, keys of one namespace when generation is given:
+        nothing is stored if the namespace was invalidated since
+        generation was read
+        """
+        raise NotImplementedError
+
+    def invalidate_namespace(self, namespace):
+        """
+        Delete the entries of namespace and bump its generation
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+class MemoryBackend(CacheBackend):
+    def __init__(self, maxsize=1024, ttl=60, stale_ttl=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._data = OrderedDict()
+        self._generations = Counter()
+        self._invalidated_at = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            expires_at, value = entry
+            now = time.monotonic()
+            if expires_at < now:
+                # kept for get_stale() until the stale window is over too
+                if expires_at + self.stale_ttl < now:
+                    del self._data[key]
+                    self.expirations += 1
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def get_stale(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] + self.stale_ttl < time.monotonic():
+                return MISSING
+            return entry[1]
+
+    def generation(self, namespace):
+        with self._lock:
+            return self._generations[namespace]
+
+    def invalidated_at(self, namespace):
+        with self._lock:
+            return self._invalidated_at.get(namespace, 0)
+
+    def bump_generation(self, namespace):
+        with self._lock:
+            self._generations[namespace] += 1
+            return self._generations[namespace]
+
+    def set_many(self, items, generation=None):
+        with self._lock:
+            expires_at = time.monotonic() + self.ttl
+            for key, value in items:
+                if generation is not None and self._generations[key[0]] != generation:
+                    continue
+                self._data[key] = (expires_at, value)
+                self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_namespace(self, namespace):
+        with self._lock:
+            self._generations[namespace] += 1
+            self._invalidated_at[namespace] = time.time()
+            for key in [key for key in self._data if key[0] == namespace]:
+                del self._data[key]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'stale_ttl': self.stale_ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+# KEYS[1] generations hash, KEYS[2] namespace hash, ARGV: namespace,
+# generation, expiry in seconds, then field, payload pairs. Stores the
+# pairs unless the generation of the namespace moved on.
+STORE_SCRIPT = """
+if tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0') ~= tonumber(ARGV[2]) then
+    return 0
+end
+for i = 4, #ARGV, 2 do
+    redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return 1
+"""
+
+class RedisBackend(CacheBackend):
+    """
+    Every namespace in INVALIDATES is one Redis hash, so a lookup is a
+    single HGET and invalidating a namespace is a single DEL seen by every
+    worker. Other namespaces (compressed bodies, keyed on their ETag) are
+    never invalidated, each of their keys is a string with its own expiry
+    so entries of old ETags age out one by one. Values are pickled
+    together with their expiry time, the store must only be reachable by
+    the app.
+
+    The generations are the fields of one more hash, the invalidation times
+    of another. Invalidating a namespace increments its generation, sets
+    its time and deletes its hash in one transaction, a write with a generation goes through a Lua script that
+    compares it first, so no worker can store a value loaded before
+    another worker's invalidation.
+    """
+    def __init__(self, url, ttl=60, prefix='starwars:cache:', stale_ttl=0):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('CACHE_BACKEND=redis needs the redis package, run: pipenv install redis')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.prefix = prefix
+        self.generations_key = prefix + 'generations'
+        self.invalidated_at_key = prefix + 'invalidated_at'
+        self._store = self.client.register_script(STORE_SCRIPT)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _split(self, key):
+        """
+        (hash name, field), or (key name, None) outside INVALIDATED_NAMESPACES
+        """
+        if key[0] in INVALIDATED_NAMESPACES:
+            return self.prefix + key[0], repr(key[1:])
+        return f'{self.prefix}{key[0]}:{key[1:]!r}', None
+
+    def _read(self, client, key):
+        name, field = self._split(key)
+        return client.get(name) if field is None else client.hget(name, field)
+
+    def _write(self, pipe, key, value):
+        """
+        Queue the write of key on pipe, the hash name when one needs its
+        expiry pushed back
+        """
+        name, field = self._split(key)
+        payload = pickle.dumps((time.time() + self.ttl, value))
+        if field is None:
+            pipe.set(name, payload, ex=self.ttl + self.stale_ttl)
+            return None
+        pipe.hset(name, field, payload)
+        return name
+
+    def get(self, key):
+        payload = self._read(self.client, key)
+        if payload is not None:
+            expires_at, value = pickle.loads(payload)
+            if expires_at >= time.time():
+                self.hits += 1
+                return value
+        self.misses += 1
+        return MISSING
+
+    def get_stale(self, key):
+        payload = self._read(self.client, key)
+        if payload is not None:
+            expires_at, value = pickle.loads(payload)
+            if expires_at + self.stale_ttl >= time.time():
+                return value
+        return MISSING
+
+    def generation(self, namespace):
+        return int(self.client.hget(self.generations_key, namespace) or 0)
+
+    def invalidated_at(self, namespace):
+        return float(self.client.hget(self.invalidated_at_key, namespace) or 0)
+
+    def bump_generation(self, namespace):
+        return self.client.hincrby(self.generations_key, namespace, 1)
+
+    def get_many(self, keys):
+        # one round trip for the whole batch
+        pipe = self.client.pipeline()
+        for key in keys:
+            self._read(pipe, key)
+        values = []
+        for payload in pipe.execute():
+            if payload is not None:
+                expires_at, value = pickle.loads(payload)
+                if expires_at >= time.time():
+                    self.hits += 1
+                    values.append(value)
+                    continue
+            self.misses += 1
+            values.append(MISSING)
+        return values
+
+    def set_many(self, items, generation=None):
+        items = list(items)
+        if generation is not None and items and items[0][0][0] in INVALIDATED_NAMESPACES:
+            namespace = items[0][0][0]
+            args = [namespace, generation, self.ttl + self.stale_ttl]
+            for key, value in items:
+                args += [self._split(key)[1], pickle.dumps((time.time() + self.ttl, value))]
+            self._store(keys=[self.generations_key, self.prefix + namespace], args=args)
+            return
+        pipe = self.client.pipeline()
+        names = {self._write(pipe, key, value) for key, value in items}
+        names.discard(None)
+        # a hash as a whole goes away once its newest entry is past serving, even stale
+        for name in names:
+            pipe.expire(name, self.ttl + self.stale_ttl)
+        pipe.execute()
+
+    def invalidate_namespace(self, namespace):
+        pipe = self.client.pipeline()
+        pipe.hincrby(self.generations_key, namespace, 1)
+        pipe.hset(self.invalidated_at_key, namespace, time.time())
+        pipe.delete(self.prefix + namespace)
+        pipe.execute()
+        self.invalidations += 1
+
+    def clear(self):
+        names = list(self.client.scan_iter(match=self.prefix + '*'))
+        if names:
+            self.client.delete(*names)
+
+    def stats(self):
+        return {
+            'backend': 'redis',
+            'ttl': self.ttl,
+            'stale_ttl': self.stale_ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+        }
+
+cache = MemoryBackend()
+loads = Group()
+# coalesced: misses that waited for another request's load, stale_hits and
+# refreshes: stale entries served and the background reloads they started
+counters = Counter()
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+def init_cache(app):
+    global cache
+    backend = app.config.get('CACHE_BACKEND', 'memory')
+    stale_ttl = app.config.get('CACHE_STALE_TTL', 0)
+    if backend == 'redis':
+        cache = RedisBackend(app.config['CACHE_URL'], ttl=app.config.get('CACHE_TTL', 60), stale_ttl=stale_ttl)
+    elif backend == 'memory':
+        cache = MemoryBackend(maxsize=app.config.get('CACHE_MAXSIZE', 1024), ttl=app.config.get('CACHE_TTL', 60),
+                              stale_ttl=stale_ttl)
+    else:
+        raise RuntimeError(f'Unknown CACHE_BACKEND {backend}, use memory or redis')
+
+def cache_stats():
+    return dict(cache.stats(), **counters)
+
+def load(key, loader, generation=None):
+    if generation is None:
+        generation = cache.generation(key[0])
+    with _fill_reads(key[0]):
+        value = loader()
+    if value is not None:
+        # not stored when an invalidation committed while the loader ran
+        cache.set(key, value, generation)
+    return value
+
+def _fill_reads(namespace):
+    """
+    Context for the reads of a load that fills the shared cache, on the
+    primary while a replica may still lag behind the last invalidation
+    of namespace
+    """
+    replica_set = replicas.replica_set
+    if replica_set is not None and time.time() - cache.invalidated_at(namespace) < replica_set.sticky_seconds:
+        return replicas.reads_from_primary(db.session)
+    return nullcontext()
+
+def cached(key, loader):
+    """
+    Return the cached value for key or call loader and cache what it
+    returns. None is not cached, so a missing row is looked up again.
+    Concurrent misses share one loader call.
+    """
+    value = cache.get(key)
+    if value is not MISSING:
+        return value
+    if cache.stale_ttl:
+        value = cache.get_stale(key)
+        if value is not MISSING:
+            counters['stale_hits'] += 1
+            refresh_in_background(key, loader)
+            return value
+    # requests arriving after an invalidation start their own load
+    generation = cache.generation(key[0])
+    value, shared = loads.do((generation, key), lambda: load(key, loader, generation))
+    if shared:
+        counters['coalesced'] += 1
+    return value
+
+def refresh_in_background(key, loader):
+    """
+    Reload key in a thread with its own app context, unless a reload of
+    it is already running
+    """
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    counters['refreshes'] += 1
+    app = current_app._get_current_object()
+
+    def refresh():
+        try:
+            with app.app_context():
+                try:
+                    load(key, loader)
+                finally:
+                    db.session.remove()
+        except Exception:
+            logger.exception('Background refresh of %s failed', key)
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+def cached_many(model, ids):
+    """
+    {id: serialized row} for the ids that exist. Cached rows are read in
+    one batch, the rest come from one IN query (the objects go through the
+    session identity map) and are cached under the keys of the single row
+    endpoints, together with their conditional GET validators.
+    """
+    namespace = model.__tablename__
+    found = {}
+    missing = []
+    for id, value in zip(ids, cache.get_many([(namespace, id) for id in ids])):
+        if value is MISSING:
+            missing.append(id)
+        else:
+            found[id] = value
+    if missing:
+        generation = cache.generation(namespace)
+        loaded = []
+        with _fill_reads(namespace):
+            instances = db.session.scalars(db.select(model).where(model.id.in_(missing))).all()
+        for instance in instances:
+            found[instance.id] = instance.serialize()
+            loaded.append(((namespace, instance.id), found[instance.id]))
+            loaded.append(((namespace, 'validator', instance.id), instance.updated_at))
+        cache.set_many(loaded, generation)
+    return found
+
+def cached_by_ids(model, args):
+    """
+    ?ids= lookup through cached_many(): the rows in the order asked for,
+    projected on ?fields=, and the ids that don't exist
+    """
+    if args.get('sort') or args.get('after') or parse_filters(model, args):
+        raise APIException('ids can not be combined with filters, sort or after', status_code=400)
+    ids = parse_ids(args)
+    keys = parse_fields(args, model, model.serialize_fields)
+    found = cached_many(model, ids)
+    data = [{key: found[id][key] for key in keys} for id in ids if id in found]
+    return data, [id for id in ids if id not in found]
+
+def cached_page(model, args, default_fields):
+    """
+    paginate() through the cache, keyed on the normalized page arguments
+    plus the cursor, filters and sort as given
+    """
+    return cached(page_key(model, args, default_fields), lambda: paginate(model, args, default_fields))
+
+def page_key(model, args, default_fields):
+    limit = parse_limit(args)
+    keys = tuple(parse_fields(args, model, default_fields))
+    query = tuple(sorted((name, value) for name, value in args.items(multi=True) if name not in ('limit', 'fields')))
+    return (model.__tablename__, 'page', limit, keys, query)
+
+def _invalidate_committed(changes):
+    namespaces = set()
+    for change in changes:
+        namespaces.update(INVALIDATES[change.model])
+    for namespace in namespaces:
+        cache.invalidate_namespace(namespace)
+
+subscribe({model: () for model in INVALIDATES}, _invalidate_committed)
@@ -0,0 +1,119 @@
+"""
+Committed row changes for the state kept in memory next to the database:
+the cache, the search index and the stats aggregates subscribe here
+instead of each listening to the session events.
+
+Changes are collected while a transaction runs, from the flushed ORM
+objects (after_flush) and from the insert()/update()/delete() statements
+that skip the flush (do_orm_execute). A bulk insert gives its parameters,
+with the new ids when it returns them, and a bulk delete the rows it
+matches, read just before it runs. When the transaction commits every
+subscriber gets the changes of the models it subscribed to, in order. A
+rollback drops them.
+"""
+from collections import namedtuple
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from models import db
+
+# operation is 'insert', 'update', 'delete', or 'statement' for a bulk
+# statement whose rows are not known (update(), insert() without
+# parameters). values holds the subscribed attributes after the change
+# (insert and update, a bulk insert only has the keys of its parameters),
+# before the ones before it (update and delete) and changed the subscribed
+# attributes an update modified.
+Change = namedtuple('Change', 'operation model values before changed')
+
+_subscribers = []   # (models, callback)
+_attributes = {}    # model -> attributes read by any subscriber
+
+def subscribe(attributes, callback):
+    """
+    Call callback(changes) after every commit that changed rows of the
+    models in attributes, a dict model -> attributes the subscriber reads
+    from the changes
+    """
+    _subscribers.append((frozenset(attributes), callback))
+    for model, names in attributes.items():
+        known = _attributes.setdefault(model, [])
+        known.extend(name for name in names if name not in known)
+
+def _pending(session):
+    return session.info.setdefault('changes', [])
+
+def _values(state, attributes, before=False):
+    values = {}
+    for attribute in attributes:
+        if before:
+            history = state.attrs[attribute].history
+            values[attribute] = history.deleted[0] if history.deleted else (history.unchanged or [None])[0]
+        else:
+            values[attribute] = getattr(state.obj(), attribute)
+    return values
+
+@event.listens_for(Session, 'after_flush')
+def _collect_flushed(session, flush_context):
+    changes = _pending(session)
+    for instance in session.new:
+        attributes = _attributes.get(type(instance))
+        if attributes is not None:
+            changes.append(Change('insert', type(instance), _values(inspect(instance), attributes), None, None))
+    for instance in session.dirty:
+        attributes = _attributes.get(type(instance))
+        if attributes is not None:
+            state = inspect(instance)
+            changed = {attribute for attribute in attributes if state.attrs[attribute].history.has_changes()}
+            changes.append(Change('update', type(instance), _values(state, attributes),
+                                  _values(state, attributes, before=True), changed))
+    for instance in session.deleted:
+        attributes = _attributes.get(type(instance))
+        if attributes is not None:
+            changes.append(Change('delete', type(instance), None, _values(inspect(instance), attributes, before=True), None))
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_statements(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ not in _attributes:
+        return
+    model = mapper.class_
+    statement = orm_execute_state.statement
+    changes = _pending(orm_execute_state.session)
+    params = orm_execute_state.parameters
+    rows = params if isinstance(params, list) else [params] if params else []
+    if orm_execute_state.is_insert and rows:
+        # the executemany parameters of the bulk endpoints are the new rows,
+        # the ids come from the RETURNING of the statement when it has one
+        if any(column['name'] == 'id' for column in statement.returning_column_descriptions):
+            result = orm_execute_state.invoke_statement().freeze()
+            ids = [row['id'] for row in result().mappings()]
+            if len(ids) == len(rows):
+                rows = [dict(row, id=id) for row, id in zip(rows, ids)]
+            changes.extend(Change('insert', model, row, None, None) for row in rows)
+            return result()
+        changes.extend(Change('insert', model, row, None, None) for row in rows)
+    elif orm_execute_state.is_delete and _attributes[model] and not isinstance(params, list):
+        # the rows a delete is about to remove, read in its transaction
+        columns = [getattr(model, attribute) for attribute in _attributes[model]]
+        select = db.select(*columns)
+        if statement.whereclause is not None:
+            select = select.where(statement.whereclause)
+        for row in orm_execute_state.session.execute(select, params or {}).mappings():
+            changes.append(Change('delete', model, None, dict(row), None))
+    else:
+        changes.append(Change('statement', model, None, None, None))
+
+@event.listens_for(Session, 'after_commit')
+def _dispatch_committed(session):
+    changes = session.info.pop('changes', None)
+    if not changes:
+        return
+    for models, callback in _subscribers:
+        relevant = [change for change in changes if change.model in models]
+        if relevant:
+            callback(relevant)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back(session):
+    session.info.pop('changes', None)
@@ -0,0 +1,112 @@
+"""
+Response compression.
+
+Responses of a compressible type (JSON, text) of at least
+COMPRESSION_MIN_SIZE bytes are compressed with the best encoding the
+client accepts. Server preference follows COMPRESSION_ENCODINGS
+(br,zstd,gzip by default). brotli and zstd are used only when their
+packages are installed (the optional compression category of the Pipfile,
+`pipenv install --categories compression`); gzip is always available.
+Streamed responses are sent as they are.
+
+GET responses that carry a validator (the conditional_get views) are
+stored compressed in the response cache under (path, negotiated mimetype,
+ETag, encoding). The next request for the same representation is
+answered from there by conditional_get, without running the view,
+serializing or compressing. Streamed exports are never stored or served
+from there.
+A changed row or table changes the ETag, so stale bodies are never
+served; they just age out of the cache, with the Redis backend each one
+on its own expiry.
+"""
+import gzip
+from flask import request, current_app
+import cache as response_cache
+from utils import wants_stream, negotiated_mimetype
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'application/javascript', 'image/svg+xml')
+
+def _load_codecs(names):
+    codecs = {}
+    for name in names:
+        if name == 'gzip':
+            codecs['gzip'] = lambda body: gzip.compress(body, compresslevel=6, mtime=0)
+        elif name == 'br':
+            try:
+                import brotli
+            except ImportError:
+                continue
+            codecs['br'] = lambda body: brotli.compress(body, quality=5)
+        elif name == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                continue
+            codecs['zstd'] = lambda body: zstandard.compress(body, 3)
+        else:
+            raise RuntimeError(f'Unknown compression encoding {name}, use br, zstd or gzip')
+    return codecs
+
+# encoding -> compress function, in server preference order
+codecs = _load_codecs(['br', 'zstd', 'gzip'])
+
+def init_compression(app):
+    global codecs
+    names = [name.strip() for name in app.config.get('COMPRESSION_ENCODINGS', 'br,zstd,gzip').split(',') if name.strip()]
+    codecs = _load_codecs(names)
+    if codecs:
+        app.after_request(compress_response)
+
+def negotiate():
+    """
+    The encoding to use for the current request, None for identity
+    """
+    best, best_quality = None, 0
+    for name in codecs:
+        quality = request.accept_encodings[name]
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+def is_compressible(response):
+    return response.mimetype in COMPRESSIBLE_MIMETYPES or response.mimetype.startswith('text/')
+
+def _cache_key(etag, encoding):
+    # Accept picks between JSON pages and NDJSON exports on the same URL
+    return ('compressed', request.full_path, negotiated_mimetype(request), etag, encoding)
+
+def compressed_response(etag):
+    """
+    The stored compressed 200 response for etag in the encoding the client
+    accepts, or None
+    """
+    encoding = negotiate()
+    if encoding is None or wants_stream(request):
+        return None
+    stored = response_cache.cache.get(_cache_key(etag, encoding))
+    if stored is response_cache.MISSING:
+        return None
+    body, content_type = stored
+    response = current_app.response_class(body, content_type=content_type)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+def compress_response(response):
+    if response.status_code != 200 or response.is_streamed or response.direct_passthrough:
+        return response
+    if 'Content-Encoding' in response.headers or not is_compressible(response):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < current_app.config.get('COMPRESSION_MIN_SIZE', 500):
+        return response
+    encoding = negotiate()
+    if encoding is None:
+        return response
+    response.set_data(codecs[encoding](body))
+    response.headers['Content-Encoding'] = encoding
+    etag, _ = response.get_etag()
+    if etag and request.method == 'GET' and not wants_stream(request):
+        response_cache.cache.set(_cache_key(etag, encoding), (response.get_data(), response.content_type))
+    return response
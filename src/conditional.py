@@ -0,0 +1,121 @@
+"""
+HTTP conditional GET for the catalog endpoints.
+
+Validators come from cheap aggregate queries (row count, max id and
+max(updated_at)) instead of hashing the response body, and they go through
+the cache so they are invalidated together with the data they describe.
+When the client already has the current representation the view isn't
+called at all and a 304 goes back without serializing anything. Neither
+is it when compression.py has the representation stored compressed.
+
+List endpoints answer JSON pages or NDJSON exports depending on Accept, so
+their ETag includes the negotiated mimetype and they send Vary: Accept.
+They carry no Last-Modified: max(updated_at) doesn't move when a row is
+deleted, only the ETag (row count and max id) does.
+"""
+import hashlib
+from datetime import timezone
+from functools import wraps
+from flask import request, make_response, current_app
+from models import db
+from cache import cached
+import compression
+from compression import compressed_response
+from utils import negotiated_mimetype
+
+def make_etag(*parts):
+    return hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+
+def table_state_statement(model):
+    return db.select(db.func.count(model.id), db.func.max(model.id), db.func.max(model.updated_at))
+
+def row_state_statement(model, id):
+    return db.select(model.updated_at).where(model.id == id)
+
+def table_validator(model):
+    """
+    (etag, None) for a list endpoint, the query string and Accept are part
+    of the etag because every page/projection/format is its own
+    representation
+    """
+    state = cached((model.__tablename__, 'validator'),
+                   lambda: tuple(db.session.execute(table_state_statement(model)).one()))
+    return table_validation(model, state)
+
+def table_validation(model, state):
+    count, max_id, last_modified = state
+    args = sorted(request.args.items(multi=True))
+    return make_etag(model.__tablename__, count, max_id, last_modified, args, negotiated_mimetype(request)), None
+
+def row_validator(model, id):
+    last_modified = cached((model.__tablename__, 'validator', id),
+                           lambda: db.session.scalar(row_state_statement(model, id)))
+    return row_validation(model, id, last_modified)
+
+def row_validation(model, id, last_modified):
+    if last_modified is None:
+        return None
+    return make_etag(model.__tablename__, id, last_modified), last_modified
+
+def as_utc(moment):
+    if moment is None:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    # HTTP dates have second resolution
+    return moment.replace(microsecond=0)
+
+def is_not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        return as_utc(last_modified) <= request.if_modified_since
+    return False
+
+def conditional_get(validator, vary=()):
+    """
+    Decorator for GET views. validator gets the view arguments and returns
+    (etag, last_modified), or None to skip validation (the view then runs
+    as usual, e.g. to answer a 404). vary lists the request headers the
+    representation depends on.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            validated = validator(*args, **kwargs)
+            if validated is None:
+                return view(*args, **kwargs)
+            etag, last_modified = validated
+            response = stored_response(etag, last_modified)
+            if response is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            return add_validators(response, etag, last_modified, vary)
+        return wrapper
+    return decorator
+
+def stored_response(etag, last_modified):
+    """
+    The 304, or the 200 compressed earlier for etag, that answers the
+    current request without running the view. None when the view has to
+    run.
+    """
+    if is_not_modified(etag, last_modified):
+        response = current_app.response_class(status=304)
+        # a 304 carries the Vary the 200 would have
+        if compression.codecs:
+            response.vary.add('Accept-Encoding')
+        return response
+    # a body compressed earlier for this ETag skips the view entirely
+    return compressed_response(etag)
+
+def add_validators(response, etag, last_modified, vary=()):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        # werkzeug stamps the current time when given None
+        response.last_modified = as_utc(last_modified)
+    for header in vary:
+        response.vary.add(header)
+    response.headers['Cache-Control'] = f"public, max-age={current_app.config.get('CATALOG_MAX_AGE', 30)}"
+    return response
@@ -0,0 +1,161 @@
+"""
+Database engine configuration, everything comes from the environment:
+
+DATABASE_URL          database to connect to, SQLite in /tmp when missing
+DB_MAX_CONNECTIONS    connections the database allows this app in total (20),
+                      split between the gunicorn workers (WEB_CONCURRENCY)
+DB_POOL_SIZE          per process pool size, overrides the computed one
+DB_MAX_OVERFLOW       per process overflow, overrides the computed one
+DB_POOL_TIMEOUT       seconds to wait for a free connection (10)
+DB_POOL_RECYCLE       seconds before a connection is replaced (1800)
+DB_POOL_PRE_PING      test connections on checkout (1)
+DB_STATEMENT_TIMEOUT  server side statement timeout in ms, Postgres/MySQL (0,
+                      off). It applies to every connection of the app
+                      engine, the job workers and stats reconciliation
+                      included; migrations lift it on their connection
+
+SQLite files run with WAL and synchronous=NORMAL so readers don't block
+the writer. Pool checkout wait time and saturation are recorded in
+pool_metrics.
+"""
+import os
+import threading
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+def database_uri():
+    db_url = os.getenv('DATABASE_URL')
+    if db_url is not None:
+        return db_url.replace('postgres://', 'postgresql://')
+    return 'sqlite:////tmp/test.db'
+
+def dialect_of(uri):
+    return uri.split('://', 1)[0].split('+')[0]
+
+def worker_count():
+    # WEB_CONCURRENCY is what gunicorn reads for its default --workers
+    return max(1, int(os.getenv('WEB_CONCURRENCY', os.getenv('GUNICORN_WORKERS', 1))))
+
+class PoolMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.pools = []
+
+    def observe(self, waited, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def stats(self):
+        with self._lock:
+            checked_out = sum(pool.checkedout() for pool in self.pools)
+            capacity = sum(pool.size() + max(pool._max_overflow, 0) for pool in self.pools)
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': self.wait_seconds_total,
+                'wait_seconds_max': self.wait_seconds_max,
+                'wait_seconds_avg': self.wait_seconds_total / self.checkouts if self.checkouts else 0.0,
+                'checked_out': checked_out,
+                'capacity': capacity,
+                'saturation': checked_out / capacity if capacity else 0.0,
+            }
+
+pool_metrics = PoolMetrics()
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool that records how long every checkout waited for a connection
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        pool_metrics.pools.append(self)
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.observe(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_metrics.observe(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        # keep the metrics pointing at the live pool after a dispose()
+        pool = super().recreate()
+        if self in pool_metrics.pools:
+            pool_metrics.pools.remove(self)
+        return pool
+
+def pool_sizes():
+    per_worker = max(1, int(os.getenv('DB_MAX_CONNECTIONS', 20)) // worker_count())
+    pool_size = int(os.getenv('DB_POOL_SIZE', max(1, per_worker * 2 // 3)))
+    max_overflow = int(os.getenv('DB_MAX_OVERFLOW', max(0, per_worker - pool_size)))
+    return pool_size, max_overflow
+
+def engine_options(uri, instrumented=True):
+    """
+    Options for create_engine / SQLALCHEMY_ENGINE_OPTIONS. In-memory SQLite
+    keeps SQLAlchemy's default single connection pool.
+    """
+    if uri in ('sqlite://', 'sqlite:///:memory:'):
+        return {}
+    pool_size, max_overflow = pool_sizes()
+    options = {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', '1') == '1',
+    }
+    if instrumented:
+        options['poolclass'] = InstrumentedQueuePool
+    return options
+
+def statement_timeout_statements(dialect, timeout):
+    # 0 means no limit for both
+    if dialect == 'postgresql':
+        return [f'SET statement_timeout = {timeout}']
+    if dialect == 'mysql':
+        return [f'SET SESSION max_execution_time = {timeout}']
+    return []
+
+def connection_setup_statements(dialect):
+    if dialect == 'sqlite':
+        return ['PRAGMA journal_mode=WAL', 'PRAGMA synchronous=NORMAL', 'PRAGMA busy_timeout=5000']
+    timeout = int(os.getenv('DB_STATEMENT_TIMEOUT', 0))
+    if timeout > 0:
+        return statement_timeout_statements(dialect, timeout)
+    return []
+
+def configure_engine(engine):
+    """
+    Run the per dialect setup statements on every new DBAPI connection of
+    a sync engine (pass async_engine.sync_engine for async ones)
+    """
+    statements = connection_setup_statements(engine.dialect.name)
+    if not statements:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _setup_connection(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+        if engine.dialect.name != 'sqlite':
+            dbapi_connection.commit()
+
+def init_engine(app, db):
+    with app.app_context():
+        configure_engine(db.engine)
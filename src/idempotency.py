@@ -0,0 +1,191 @@
+"""
+Idempotency-Key support for the write routes.
+
+A POST carrying an `Idempotency-Key` header runs once, its response is
+stored for IDEMPOTENCY_TTL seconds under (method, path, key) and a retry
+with the same key gets that response back, marked with
+`Idempotent-Replayed: true`, without touching the database. A key reused
+with a different body or query string answers 422. 5xx responses and
+exceptions are not stored, the client may retry them.
+
+Concurrent requests with the same key in one process collapse onto one
+run of the view through a singleflight.Group. Across processes the first
+one marks the key as in progress in the store, the others answer 409
+with Retry-After until it is done.
+
+IDEMPOTENCY_STORE=memory keeps the keys in the process (a bounded LRU of
+IDEMPOTENCY_MAXSIZE keys), right for a single worker. With several
+gunicorn workers use IDEMPOTENCY_STORE=redis and IDEMPOTENCY_URL.
+"""
+import functools
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from flask import request, current_app, jsonify
+from utils import APIException
+from singleflight import Group
+
+MISSING = object()
+# headers of the stored response that are not replayed
+SKIPPED_HEADERS = {'set-cookie', 'content-length'}
+
+class MemoryStore:
+    def __init__(self, maxsize=10000, ttl=86400):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return MISSING
+            return entry[1]
+
+    def add(self, key, value, ttl):
+        """
+        Store value unless key holds a live entry, True when stored
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] >= time.monotonic():
+                return False
+            self._store(key, value, ttl)
+            return True
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value, self.ttl)
+
+    def _store(self, key, value, ttl):
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+class RedisStore:
+    """
+    One string per key with its own expiry, shared by every worker
+    """
+    def __init__(self, url, ttl=86400, prefix='starwars:idempotency:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('IDEMPOTENCY_STORE=redis needs the redis package, run: pipenv install redis')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _name(self, key):
+        return self.prefix + repr(key)
+
+    def get(self, key):
+        payload = self.client.get(self._name(key))
+        return MISSING if payload is None else pickle.loads(payload)
+
+    def add(self, key, value, ttl):
+        return bool(self.client.set(self._name(key), pickle.dumps(value), nx=True, ex=max(1, int(ttl))))
+
+    def set(self, key, value):
+        self.client.set(self._name(key), pickle.dumps(value), ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self._name(key))
+
+store = MemoryStore()
+flights = Group()
+# seconds a key stays marked in progress if its worker dies mid-request
+in_progress_ttl = 30
+
+def init_idempotency(app):
+    global store, in_progress_ttl
+    backend = app.config.get('IDEMPOTENCY_STORE', 'memory')
+    ttl = app.config.get('IDEMPOTENCY_TTL', 86400)
+    if backend == 'redis':
+        store = RedisStore(app.config['IDEMPOTENCY_URL'], ttl=ttl)
+    elif backend == 'memory':
+        store = MemoryStore(maxsize=app.config.get('IDEMPOTENCY_MAXSIZE', 10000), ttl=ttl)
+    else:
+        raise RuntimeError(f'Unknown IDEMPOTENCY_STORE {backend}, use memory or redis')
+    in_progress_ttl = app.config.get('IDEMPOTENCY_IN_PROGRESS_TTL', in_progress_ttl)
+
+def fingerprint():
+    digest = hashlib.sha256(request.query_string)
+    digest.update(b'\0')
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+def snapshot(response):
+    headers = [(name, value) for name, value in response.headers.items() if name.lower() not in SKIPPED_HEADERS]
+    return response.status_code, response.get_data(), headers
+
+def replay(stored, replayed):
+    status, body, headers = stored
+    response = current_app.response_class(body, status=status, headers=headers)
+    if replayed:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def conflict(message, status_code, retry_after=None):
+    response = jsonify({'msg': message})
+    response.status_code = status_code
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def run_once(key, request_fingerprint, view, args, kwargs):
+    """
+    (fingerprint, stored response or None, error response or None) for the
+    first request with key in this process
+    """
+    entry = store.get(key)
+    if entry is MISSING and store.add(key, (request_fingerprint, None), in_progress_ttl):
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except BaseException:
+            store.delete(key)
+            raise
+        stored = snapshot(response)
+        if response.status_code >= 500:
+            store.delete(key)
+        else:
+            store.set(key, (request_fingerprint, stored))
+        return request_fingerprint, stored, False
+    if entry is MISSING:
+        entry = store.get(key)
+    if entry is MISSING or entry[1] is None:
+        return None, None, True
+    return entry[0], entry[1], True
+
+def idempotent(view):
+    """
+    Honor the Idempotency-Key header on a write route
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return view(*args, **kwargs)
+        if not key or len(key) > 255:
+            raise APIException('Idempotency-Key must be 1 to 255 characters', status_code=400)
+        request_fingerprint = fingerprint()
+        store_key = (request.method, request.path, key)
+        # concurrent duplicates wait for the first one and share its response
+        ran = []
+        def first():
+            ran.append(True)
+            return run_once(store_key, request_fingerprint, view, args, kwargs)
+        (stored_fingerprint, stored, replayed), _ = flights.do(store_key, first)
+        if stored is None:
+            return conflict('A request with this Idempotency-Key is still in progress', 409, retry_after=1)
+        if stored_fingerprint != request_fingerprint:
+            return conflict('Idempotency-Key was already used with a different request', 422)
+        return replay(stored, replayed or not ran)
+    return wrapper
@@ -0,0 +1,299 @@
+"""
+Asynchronous writes.
+
+POST /create/character, /create/planet and the favorite add routes take
+?async=1 or a `Prefer: respond-async` header. The body is then only checked
+for the mandatory keys, stored as a row of the jobs table and answered
+with 202 and the job, Location points at /jobs/<id> for its progress. The
+queue is the database itself, so an accepted write survives restarts.
+
+Workers claim up to JOBS_BATCH_SIZE queued jobs at a time and run them in
+one transaction: the jobs of a kind are validated together (with the bulk
+validators, one IN query per check) and their rows go in with executemany,
+so a burst of single creates costs a few statements instead of a commit
+each. Job rows are updated in the same transaction, a job is done exactly
+when its row was written. When the batch transaction fails the jobs are
+retried one by one so a conflicting or unwritable job can't fail the
+others.
+
+The queue is worked by dedicated processes (the worker entry of the
+Procfile):
+
+    flask --app src/app.py jobs work --workers 4
+
+Web processes run no workers by default (JOBS_WORKERS=0). With
+JOBS_WORKERS set, a web process starts that many worker threads when it
+enqueues its first job, so processes that never take an async write don't
+poll the queue. Those threads only pick up jobs left over from a restart
+once the process enqueues again, a dedicated worker is still needed for
+that.
+
+A job left running longer than JOBS_TIMEOUT seconds (its worker died) is
+queued again, up to JOBS_MAX_ATTEMPTS times.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from datetime import timedelta
+import click
+from flask import current_app, jsonify, request, url_for
+from flask.cli import AppGroup
+from sqlalchemy.exc import IntegrityError, OperationalError
+from models import db, utcnow, Job, User, Planets, Characters
+from bulk import (validate_items, validate_character, validate_planet, validate_favorite, reject_duplicate_names,
+                  insert_rows, favorite_rows, chunked_in)
+from serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+def wants_async(request):
+    return (request.args.get('async', '').lower() in ('1', 'true', 'yes')
+            or 'respond-async' in request.headers.get('Prefer', ''))
+
+def enqueue(kind, payload):
+    """
+    Store a job, returns it serialized
+    """
+    job = Job(kind=kind, payload=dumps(payload), status='queued', attempts=0)
+    db.session.add(job)
+    db.session.flush()
+    # serialized before the commit expires it, saves reloading the row
+    data = job.serialize()
+    db.session.commit()
+    if pool is not None:
+        pool.wake()
+    elif current_app.config.get('JOBS_WORKERS', 0) > 0:
+        start_workers()
+    return data
+
+def accepted(job):
+    """
+    The 202 response of an enqueued job
+    """
+    headers = {'Location': url_for('get_job', id=job['id'])}
+    if 'respond-async' in request.headers.get('Prefer', ''):
+        headers['Preference-Applied'] = 'respond-async'
+    return jsonify({'msg': 'Accepted', 'data': job}), 202, headers
+
+def create_rows(model, validator):
+    def handler(items, batch_size):
+        rows, errors = validate_items(items, validator)
+        rows = reject_duplicate_names(model, rows, errors)
+        return insert_rows(model, rows, batch_size), errors
+    return handler
+
+def add_favorites(items, batch_size):
+    rows, errors = validate_items(items, validate_favorite)
+    users = set(chunked_in(User.id, {items[index]['user_id'] for index, _ in rows}))
+    by_user = {}
+    for index, values in rows:
+        user_id = items[index]['user_id']
+        if user_id in users:
+            by_user.setdefault(user_id, []).append((index, values))
+        else:
+            errors.append({'index': index, 'status': 'invalid', 'error': f'User {user_id} doesnt exist'})
+    # the favorites of every user in the batch go in with one executemany per table
+    to_insert = {}
+    for user_id, user_rows in by_user.items():
+        for _, favorite_model, valid_rows in favorite_rows(user_id, user_rows, errors):
+            to_insert.setdefault(favorite_model, []).extend(valid_rows)
+    results = []
+    for favorite_model, valid_rows in to_insert.items():
+        results.extend(insert_rows(favorite_model, valid_rows, batch_size))
+    return results, errors
+
+# job kind -> handler(payloads, batch_size) returning bulk style (results, errors)
+HANDLERS = {
+    'create_character': create_rows(Characters, validate_character),
+    'create_planet': create_rows(Planets, validate_planet),
+    'add_favorite': add_favorites,
+}
+
+def run_jobs(jobs, batch_size):
+    """
+    Run the claimed jobs and record their outcome, in the current transaction
+    """
+    by_kind = {}
+    for job in jobs:
+        by_kind.setdefault(job.kind, []).append(job)
+    now = utcnow()
+    for kind, kind_jobs in by_kind.items():
+        if kind not in HANDLERS:
+            results, errors = [], [{'index': index, 'error': f'Unknown job kind {kind}'} for index in range(len(kind_jobs))]
+        else:
+            results, errors = HANDLERS[kind]([json.loads(job.payload) for job in kind_jobs], batch_size)
+        for result in results:
+            job = kind_jobs[result['index']]
+            job.status, job.result, job.finished_at = 'done', dumps({'id': result['id']}), now
+        for error in errors:
+            job = kind_jobs[error['index']]
+            job.status, job.error, job.finished_at = 'failed', error['error'], now
+
+def claim(batch_size):
+    """
+    Mark up to batch_size of the oldest queued jobs as running for this
+    worker. The UPDATE only takes rows still queued, so concurrent workers
+    never claim the same job.
+    """
+    token = uuid.uuid4().hex
+    ids = db.session.scalars(db.select(Job.id).where(Job.status == 'queued').order_by(Job.id).limit(batch_size)).all()
+    if not ids:
+        return []
+    db.session.execute(db.update(Job).where(Job.id.in_(ids), Job.status == 'queued')
+                       .values(status='running', claim=token, started_at=utcnow(), attempts=Job.attempts + 1))
+    db.session.commit()
+    return db.session.scalars(db.select(Job).where(Job.id.in_(ids), Job.claim == token).order_by(Job.id)).all()
+
+def requeue_stale(timeout, max_attempts):
+    stale = (Job.status == 'running') & (Job.started_at < utcnow() - timedelta(seconds=timeout))
+    db.session.execute(db.update(Job).where(stale, Job.attempts >= max_attempts)
+                       .values(status='failed', error=f'Gave up after {max_attempts} attempts', finished_at=utcnow()))
+    db.session.execute(db.update(Job).where(stale).values(status='queued', claim=None))
+    db.session.commit()
+
+def process(jobs, batch_size):
+    try:
+        run_jobs(jobs, batch_size)
+        db.session.commit()
+        return
+    except OperationalError:
+        # the database is unreachable or locked, the jobs stay claimed and
+        # are requeued after JOBS_TIMEOUT
+        db.session.rollback()
+        raise
+    except Exception as error:
+        # a sync write raced the batch or one payload can't be stored (e.g.
+        # an integer out of the column's range), find the job that fails
+        db.session.rollback()
+        failure = error
+    if len(jobs) > 1:
+        for job in jobs:
+            process([job], batch_size)
+        return
+    job = jobs[0]
+    if isinstance(failure, IntegrityError):
+        message = 'Conflicts with an existing row'
+    else:
+        logger.warning('Job %s failed: %r', job.id, failure)
+        message = f'Could not be written: {type(failure).__name__}'
+    job.status, job.error, job.finished_at = 'failed', message, utcnow()
+    db.session.commit()
+
+def drain_once(app):
+    """
+    Claim and run one batch, returns the number of jobs it held
+    """
+    config = app.config
+    with app.app_context():
+        try:
+            jobs = claim(config['JOBS_BATCH_SIZE'])
+            if jobs:
+                process(jobs, config['BULK_BATCH_SIZE'])
+            return len(jobs)
+        finally:
+            db.session.remove()
+
+class WorkerPool:
+    def __init__(self, app, size):
+        self.app = app
+        self.size = size
+        self.threads = []
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._requeued_at = float('-inf')
+        self._lock = threading.Lock()
+
+    def start(self):
+        for number in range(self.size):
+            thread = threading.Thread(target=self._run, name=f'jobs-worker-{number}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+        for thread in self.threads:
+            thread.join()
+
+    def _maybe_requeue(self):
+        timeout = self.app.config['JOBS_TIMEOUT']
+        with self._lock:
+            if time.monotonic() - self._requeued_at < timeout / 2:
+                return
+            self._requeued_at = time.monotonic()
+        with self.app.app_context():
+            try:
+                requeue_stale(timeout, self.app.config['JOBS_MAX_ATTEMPTS'])
+            finally:
+                db.session.remove()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self._maybe_requeue()
+                processed = drain_once(self.app)
+            except Exception:
+                logger.exception('Job batch failed, its jobs are retried after JOBS_TIMEOUT')
+                processed = 0
+            if not processed:
+                self._wake.wait(self.app.config['JOBS_POLL_INTERVAL'])
+                self._wake.clear()
+                # let the rest of a burst queue up behind the first job, one batch takes them all
+                time.sleep(self.app.config['JOBS_COALESCE_DELAY'])
+
+pool = None
+_pool_lock = threading.Lock()
+
+def start_workers(app=None):
+    global pool
+    app = app or current_app._get_current_object()
+    with _pool_lock:
+        if pool is None:
+            pool = WorkerPool(app, app.config['JOBS_WORKERS'])
+            pool.start()
+    return pool
+
+jobs_cli = AppGroup('jobs', help='Work on the queue of asynchronous writes.')
+
+@jobs_cli.command('work')
+@click.option('--workers', type=int, default=None, help='Worker threads, JOBS_WORKERS (at least 1) by default.')
+def work(workers):
+    """Run workers until interrupted."""
+    app = current_app._get_current_object()
+    worker_pool = WorkerPool(app, workers or max(app.config['JOBS_WORKERS'], 1))
+    worker_pool.start()
+    click.echo(f'{worker_pool.size} job workers running, Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        worker_pool.stop()
+
+@jobs_cli.command('drain')
+def drain():
+    """Run the queued jobs until none is left."""
+    app = current_app._get_current_object()
+    total = 0
+    while True:
+        processed = drain_once(app)
+        if not processed:
+            break
+        total += processed
+    click.echo(f'{total} jobs processed')
+
+@jobs_cli.command('prune')
+@click.option('--days', type=int, default=7, help='Keep the jobs finished in the last days.')
+def prune(days):
+    """Delete the done and failed jobs finished more than --days ago."""
+    deleted = db.session.execute(db.delete(Job).where(Job.status.in_(('done', 'failed')),
+                                                     Job.finished_at < utcnow() - timedelta(days=days))).rowcount
+    db.session.commit()
+    click.echo(f'{deleted} jobs deleted')
+
+def init_jobs(app):
+    app.cli.add_command(jobs_cli)
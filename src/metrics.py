@@ -0,0 +1,147 @@
+"""
+Request instrumentation and the Prometheus /metrics endpoint.
+
+Every request records its latency, response size and the number and time
+of the SQL statements it ran (SQLAlchemy cursor events on every engine).
+A request running more than QUERY_BUDGET statements is logged as a
+probable N+1. The cache and connection pool counters are exported too.
+
+Metrics live in the process that served the request, with several
+gunicorn workers every worker exposes its own numbers.
+"""
+import logging
+import threading
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{format_labels(self.labels, labels)} {value}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (bucket_counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    bucket_labels = format_labels(self.labels, labels, 'le="%s"' % bound)
+                    lines.append(f'{self.name}_bucket{bucket_labels} {bucket_count}')
+                bucket_labels = format_labels(self.labels, labels, 'le="+Inf"')
+                lines.append(f'{self.name}_bucket{bucket_labels} {count}')
+                lines.append(f'{self.name}_sum{format_labels(self.labels, labels)} {total}')
+                lines.append(f'{self.name}_count{format_labels(self.labels, labels)} {count}')
+        return lines
+
+REQUEST_LABELS = ('endpoint', 'method', 'status')
+request_latency = Histogram('http_request_duration_seconds', 'Time spent serving the request', REQUEST_LABELS)
+response_size = Histogram('http_response_size_bytes', 'Size of the response body', ('endpoint', 'method'), SIZE_BUCKETS)
+request_queries = Histogram('http_request_sql_queries', 'SQL statements run by one request', ('endpoint',), QUERY_BUCKETS)
+request_sql_time = Histogram('http_request_sql_duration_seconds', 'Time spent in SQL by one request', ('endpoint',))
+sql_queries = Counter('sql_queries_total', 'SQL statements executed')
+n_plus_one = Counter('http_requests_over_query_budget_total', 'Requests that ran more SQL statements than QUERY_BUDGET', ('endpoint',))
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    sql_queries.inc()
+    if has_request_context() and 'sql_queries' in g:
+        g.sql_queries += 1
+        g.sql_seconds += time.perf_counter() - started
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.sql_queries = 0
+    g.sql_seconds = 0.0
+
+def _finish_request(response, query_budget):
+    if 'request_started' not in g:
+        return response
+    endpoint = request.endpoint or 'unmatched'
+    request_latency.observe((endpoint, request.method, response.status_code), time.perf_counter() - g.request_started)
+    size = response.calculate_content_length()
+    if size is not None:
+        response_size.observe((endpoint, request.method), size)
+    request_queries.observe((endpoint,), g.sql_queries)
+    request_sql_time.observe((endpoint,), g.sql_seconds)
+    if g.sql_queries > query_budget:
+        n_plus_one.inc((endpoint,))
+        logger.warning('%s %s ran %d SQL statements (budget %d), probable N+1',
+                       request.method, request.path, g.sql_queries, query_budget)
+    return response
+
+def gauge_lines(name, documentation, value, kind='gauge'):
+    return [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}', f'{name} {value}']
+
+def render_metrics(cache_stats, pool_stats):
+    lines = []
+    for metric in (request_latency, response_size, request_queries, request_sql_time, sql_queries, n_plus_one):
+        lines.extend(metric.render())
+    for key in ('hits', 'misses', 'evictions', 'expirations', 'invalidations', 'coalesced', 'stale_hits', 'refreshes'):
+        if key in cache_stats:
+            lines.extend(gauge_lines(f'cache_{key}_total', f'Catalog cache {key}', cache_stats[key], 'counter'))
+    if 'size' in cache_stats:
+        lines.extend(gauge_lines('cache_entries', 'Entries in the catalog cache', cache_stats['size']))
+    lines.extend(gauge_lines('db_pool_checkouts_total', 'Connection checkouts', pool_stats['checkouts'], 'counter'))
+    lines.extend(gauge_lines('db_pool_timeouts_total', 'Checkouts that timed out', pool_stats['timeouts'], 'counter'))
+    lines.extend(gauge_lines('db_pool_wait_seconds_total', 'Time spent waiting for a connection', pool_stats['wait_seconds_total'], 'counter'))
+    lines.extend(gauge_lines('db_pool_wait_seconds_max', 'Longest wait for a connection', pool_stats['wait_seconds_max']))
+    lines.extend(gauge_lines('db_pool_checked_out', 'Connections in use', pool_stats['checked_out']))
+    lines.extend(gauge_lines('db_pool_saturation', 'Connections in use over pool capacity', pool_stats['saturation']))
+    return '\n'.join(lines) + '\n'
+
+def init_metrics(app):
+    query_budget = app.config.get('QUERY_BUDGET', 10)
+    app.before_request(_start_request)
+    app.after_request(lambda response: _finish_request(response, query_budget))
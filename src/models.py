@@ -1,6 +1,14 @@
+import json
+from datetime import datetime, timezone
 from flask_sqlalchemy import SQLAlchemy
+from serialization import serialize_instance
+from replicas import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+def utcnow():
+    # naive UTC, the way the DateTime columns store it
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 class User(db.Model):
     __tablename__ = 'user'
@@ -8,92 +16,117 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(80), unique=False, nullable=False)
     is_active = db.Column(db.Boolean(), unique=False, nullable=False)
+    # public field name -> attribute, the serialization schema of the model:
+    # serialize() and the ?fields= projections of the list endpoints use it
+    serialize_fields = {'id': 'id', 'email': 'email', 'is_active': 'is_active'}
 
     def __repr__(self):
         return 'Usuario con email: {}'.format(self.email)
 
     def serialize(self):
-        return {
-            "id": self.id,
-            "email": self.email,
-            'is_active': self.is_active,
-            # do not serialize the password, its a security breach
-        }
+        # do not serialize the password, its a security breach
+        return serialize_instance(self)
 
 class Planets(db.Model):
     __tablename__ = 'planets'
+    # (column, id) indexes serve the filters and the keyset ?sort= of the list endpoint
+    __table_args__ = (db.Index('ix_planets_population', 'population', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False, unique=True)
     population = db.Column(db.Integer, nullable=False)
+    # bumped on every write, feeds the ETag / Last-Modified validators
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow, onupdate=utcnow, server_default=db.func.now())
+    serialize_fields = {'id': 'id', 'name': 'name', 'population': 'population'}
 
     def __repr__(self):
         return f'Planet {self.id} {self.name}'
     
     def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "population": self.population,
-        }
+        return serialize_instance(self)
     
 class Characters(db.Model):
     __tablename__ = "characters"
+    __table_args__ = (
+        db.Index('ix_characters_height', 'height', 'id'),
+        db.Index('ix_characters_mass', 'mass', 'id'),
+        db.Index('ix_characters_gender', 'gender', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(30), nullable=False, unique=True)
     height = db.Column(db.Integer, nullable=False)
     mass = db.Column(db.Integer, nullable=True)
     gender = db.Column(db.String(10), nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow, onupdate=utcnow, server_default=db.func.now())
+    serialize_fields = {'id': 'id', 'name': 'name', 'height': 'height', 'Mass': 'mass', 'gender': 'gender'}
 
     def __repr__(self):
         return f'character_id: {self.id} name: {self.name}'
     
     def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "height": self.height,
-            "Mass": self.mass,
-            "gender": self.gender,
-        }
-    def serialize_id_name(self):
-        return{
-            "id": self.id,
-            "name": self.name,
-        }
+        return serialize_instance(self)
 
 class FavoritePlanets(db.Model):
     __tablename__ = 'favorite_planets'
+    # the unique index leads with user_id, so it also serves "favorites of a user" lookups
+    __table_args__ = (db.UniqueConstraint('user_id', 'planet_id', name='uq_favorite_planets_user_id_planet_id'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id') ,nullable=False)
     user_id_relationship = db.relationship(User)
     planet_id = db.Column(db.Integer, db.ForeignKey('planets.id'), nullable=False)
     planet_id_relationship = db.relationship(Planets)
+    serialize_fields = {'id': 'id', 'user_id': 'user_id', 'planet_id': 'planet_id'}
 
     def __repr__(self):
         return f'Al usuario {self.user_id} le gusta el planeta {self.planet_id}'
     
     def serialize(self):
-        return {
-            'id' : self.id ,
-            'user_id': self.user_id,
-            'planet_id' : self.planet_id,
-        }
+        return serialize_instance(self)
 
 class FavoriteCharacters(db.Model):
     __tablename__ = 'favorite_characters'
+    __table_args__ = (db.UniqueConstraint('user_id', 'character_id', name='uq_favorite_characters_user_id_character_id'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     user_id_relationship = db.relationship(User)
     character_id = db.Column(db.Integer, db.ForeignKey('characters.id'), nullable=False)
     character_id_relationship = db.relationship(Characters)
+    serialize_fields = {'id': 'id', 'user_id': 'user_id', 'character_id': 'character_id'}
 
     def __repr__(self):
         return f'Al usuario {self.user_id} le gusta el personaje {self.character_id}'
     
     def serialize(self):
-        return {
-            'id' : self.id,
-            'user_id' : self.user_id,
-            'character_id': self.character_id
-        }
+        return serialize_instance(self)
+
+
+class Job(db.Model):
+    """
+    A write accepted by an ?async=1 request, drained by the workers of jobs.py
+    """
+    __tablename__ = 'jobs'
+    # workers claim the oldest queued jobs, (status, id) serves that scan
+    __table_args__ = (db.Index('ix_jobs_status_id', 'status', 'id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(40), nullable=False)
+    # JSON of the request body, plus the user_id of favorite jobs
+    payload = db.Column(db.Text, nullable=False)
+    # queued -> running -> done | failed
+    status = db.Column(db.String(10), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # token of the worker batch that claimed the job
+    claim = db.Column(db.String(32), nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    serialize_fields = {'id': 'id', 'kind': 'kind', 'status': 'status', 'attempts': 'attempts', 'error': 'error',
+                        'created_at': 'created_at', 'started_at': 'started_at', 'finished_at': 'finished_at'}
 
+    def __repr__(self):
+        return f'Job {self.id} {self.kind} {self.status}'
+
+    def serialize(self):
+        data = serialize_instance(self)
+        data['result'] = json.loads(self.result) if self.result is not None else None
+        return data
@@ -0,0 +1,84 @@
+"""
+Hand written statements for endpoints that need more than Model.query
+"""
+from models import db, User, Planets, Characters, FavoritePlanets, FavoriteCharacters
+
+NULL_INT = db.cast(db.null(), db.Integer)
+NULL_NAME = db.cast(db.null(), db.String(50))
+
+# every statement below yields rows of (kind, favorite_id, entity_id, name, population)
+
+def user_marker_statement(user_id):
+    return db.select(
+        db.literal('user').label('kind'),
+        NULL_INT.label('favorite_id'),
+        User.id.label('entity_id'),
+        NULL_NAME.label('name'),
+        NULL_INT.label('population'),
+    ).where(User.id == user_id)
+
+def favorite_planets_statement(user_id):
+    return db.select(
+        db.literal('planet'),
+        FavoritePlanets.id,
+        Planets.id,
+        Planets.name,
+        Planets.population,
+    ).join(Planets, FavoritePlanets.planet_id == Planets.id).where(FavoritePlanets.user_id == user_id)
+
+def favorite_characters_statement(user_id):
+    return db.select(
+        db.literal('character'),
+        FavoriteCharacters.id,
+        Characters.id,
+        db.cast(Characters.name, db.String(50)),
+        NULL_INT,
+    ).join(Characters, FavoriteCharacters.character_id == Characters.id).where(FavoriteCharacters.user_id == user_id)
+
+def user_favorites_statement(user_id):
+    """
+    One UNION ALL that answers /user/<id>/favorites in a single round trip.
+    The first branch returns a 'user' marker row when the user exists, the
+    other two return the favorite planets and characters with their details.
+    Every branch filters on user_id, which is the leading column of the
+    (user_id, planet_id) / (user_id, character_id) unique indexes.
+    """
+    return db.union_all(
+        user_marker_statement(user_id),
+        favorite_planets_statement(user_id),
+        favorite_characters_statement(user_id),
+    )
+
+def serialize_user_favorites(rows):
+    """
+    Split the rows of user_favorites_statement into the response lists.
+    Returns None when the user doesn't exist.
+    """
+    user_exists = False
+    favorite_planets = []
+    favorite_characters = []
+    for kind, favorite_id, entity_id, name, population in rows:
+        if kind == 'user':
+            user_exists = True
+        elif kind == 'planet':
+            favorite_planets.append({
+                'favorite_planet_id': favorite_id,
+                'planet_detail': {'id': entity_id, 'name': name, 'population': population},
+            })
+        else:
+            favorite_characters.append({
+                'favorite_character_id': favorite_id,
+                'character_detail': {'id': entity_id, 'name': name},
+            })
+    if not user_exists:
+        return None
+    favorite_planets.sort(key=lambda favorite: favorite['favorite_planet_id'])
+    favorite_characters.sort(key=lambda favorite: favorite['favorite_character_id'])
+    return favorite_planets, favorite_characters
+
+def favorite_exists(favorite_model, user_id, **target):
+    """
+    EXISTS check for one (user_id, target_id) pair, answered from the unique index
+    """
+    statement = db.select(favorite_model.id).filter_by(user_id=user_id, **target).exists()
+    return db.session.scalar(db.select(statement))
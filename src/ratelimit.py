@@ -0,0 +1,233 @@
+"""
+Rate limiting and per-client concurrency quotas.
+
+Every request takes tokens from the bucket of its client IP. Buckets hold
+RATELIMIT_BURST tokens and refill at RATELIMIT_RATE tokens per second.
+A request costs ROUTE_COSTS[endpoint] tokens, 1 by default; list,
+streaming and bulk routes cost more. An empty bucket answers 429 with
+Retry-After set to the seconds until the request would fit.
+
+A client may also have at most RATELIMIT_CONCURRENCY requests in flight,
+so a few slow exports can't hold every worker. The slot is checked before
+tokens are taken, a request turned away for concurrency doesn't pay.
+
+There is no per user bucket: the API has no authentication, and keying a
+bucket on the user_id in the URL would let any client drain another
+user's bucket.
+
+Every sub-request of a /batch call pays its own cost like a direct
+request would, a sub-request over the limit gets its 429 inside the batch
+response. The batch as a whole holds one concurrency slot.
+
+Off unless RATELIMIT_ENABLED=1. Clients are told apart by
+request.remote_addr, so behind a load balancer set TRUSTED_PROXIES to the
+number of proxies in front of the app (X-Forwarded-For is read through
+werkzeug's ProxyFix), otherwise every client shares the proxy's bucket.
+
+RATELIMIT_STORE=memory keeps the buckets in the process, which is right
+for a single worker. With several gunicorn workers use
+RATELIMIT_STORE=redis and RATELIMIT_URL; a Lua script then updates each
+bucket atomically for all of them (`pipenv install redis`).
+"""
+import math
+import threading
+import time
+from flask import request, jsonify, g
+from utils import wants_stream
+
+# token cost per endpoint, everything else costs 1
+ROUTE_COSTS = {
+    'handle_hello': 5,
+    'get_all_characters': 5,
+    'get_all_planets': 5,
+    'search_names': 2,
+    'create_character': 2,
+    'create_new_planet': 2,
+    'bulk_create_characters': 50,
+    'bulk_create_planets': 50,
+    'bulk_add_favorites': 50,
+}
+# streamed exports read whole tables
+STREAM_COST = 50
+EXEMPT_ENDPOINTS = {'get_metrics', 'static'}
+
+class MemoryStore:
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = {}      # key -> (tokens, updated_at)
+        self._in_flight = {}    # key -> requests
+
+    def take(self, key, cost, rate, burst):
+        """
+        (allowed, seconds to wait) after trying to take cost tokens
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                if len(self._buckets) > self.max_keys:
+                    self._prune(now, rate, burst)
+                return True, 0.0
+            self._buckets[key] = (tokens, now)
+            return False, (cost - tokens) / rate
+
+    def _prune(self, now, rate, burst):
+        # a bucket that refilled completely is the same as no bucket
+        full_after = burst / rate
+        for key in [key for key, (_, updated_at) in self._buckets.items() if now - updated_at > full_after]:
+            del self._buckets[key]
+
+    def acquire(self, key, limit):
+        with self._lock:
+            if self._in_flight.get(key, 0) >= limit:
+                return False
+            self._in_flight[key] = self._in_flight.get(key, 0) + 1
+            return True
+
+    def release(self, key):
+        with self._lock:
+            remaining = self._in_flight.get(key, 0) - 1
+            if remaining > 0:
+                self._in_flight[key] = remaining
+            else:
+                self._in_flight.pop(key, None)
+
+# KEYS[1] bucket, ARGV: now, cost, rate, burst -> {allowed, milliseconds to wait}
+TAKE_SCRIPT = """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local now, cost, rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    wait = math.ceil((cost - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, wait}
+"""
+
+class RedisStore:
+    """
+    Buckets shared by every worker, one hash per key updated by a Lua
+    script. In-flight counters are INCR/DECR keys that expire, so a worker
+    killed mid-request can't leak a slot forever.
+    """
+    def __init__(self, url, prefix='starwars:ratelimit:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RATELIMIT_STORE=redis needs the redis package, run: pipenv install redis')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._take = self.client.register_script(TAKE_SCRIPT)
+
+    def take(self, key, cost, rate, burst):
+        allowed, wait = self._take(keys=[self.prefix + 'bucket:' + key], args=[time.time(), cost, rate, burst])
+        return bool(allowed), wait / 1000
+
+    def acquire(self, key, limit):
+        name = self.prefix + 'in_flight:' + key
+        pipe = self.client.pipeline()
+        pipe.incr(name)
+        pipe.expire(name, 300)
+        count, _ = pipe.execute()
+        if count > limit:
+            self.client.decr(name)
+            return False
+        return True
+
+    def release(self, key):
+        self.client.decr(self.prefix + 'in_flight:' + key)
+
+store = None
+rate = 20.0
+burst = 100
+concurrency = 8
+
+def init_ratelimit(app):
+    global store, rate, burst, concurrency
+    if not app.config.get('RATELIMIT_ENABLED', True):
+        return
+    backend = app.config.get('RATELIMIT_STORE', 'memory')
+    if backend == 'redis':
+        store = RedisStore(app.config['RATELIMIT_URL'])
+    elif backend == 'memory':
+        store = MemoryStore()
+    else:
+        raise RuntimeError(f'Unknown RATELIMIT_STORE {backend}, use memory or redis')
+    rate = app.config.get('RATELIMIT_RATE', rate)
+    burst = app.config.get('RATELIMIT_BURST', burst)
+    concurrency = app.config.get('RATELIMIT_CONCURRENCY', concurrency)
+    app.before_request(limit_request)
+    app.teardown_request(release_request)
+
+def charge(client, cost):
+    """
+    Take cost tokens from the bucket of client. Returns None or the
+    (message, retry_after) of the 429 to answer.
+    """
+    allowed, retry_after = store.take(client, min(cost, burst), rate, burst)
+    if not allowed:
+        return 'Rate limit exceeded', retry_after
+    return None
+
+def admit(client, cost):
+    """
+    A concurrency slot of client plus charge(). Returns None when the
+    request may run, the caller then has to release(client) once it is
+    done, or the (message, retry_after) of the 429 to answer. The slot is
+    taken first and given back when the bucket is empty, so a rejected
+    request costs no tokens.
+    """
+    if not store.acquire(client, concurrency):
+        return 'Too many concurrent requests', 1
+    rejected = charge(client, cost)
+    if rejected is not None:
+        store.release(client)
+    return rejected
+
+def release(client):
+    store.release(client)
+
+def request_cost():
+    if wants_stream(request):
+        return STREAM_COST
+    return ROUTE_COSTS.get(request.endpoint, 1)
+
+def too_many_requests(message, retry_after):
+    response = jsonify({'message': message})
+    response.status_code = 429
+    response.headers['Retry-After'] = retry_after_header(retry_after)
+    return response
+
+def retry_after_header(retry_after):
+    return str(max(1, math.ceil(retry_after)))
+
+def limit_request():
+    # CORS preflights are free
+    if request.method == 'OPTIONS' or request.endpoint in EXEMPT_ENDPOINTS:
+        return None
+    client = 'ip:' + (request.remote_addr or 'unknown')
+    if request.environ.get('starwars.batch'):
+        # the batch already holds the concurrency slot, its sub-requests only pay tokens
+        rejected = charge(client, request_cost())
+        return too_many_requests(*rejected) if rejected is not None else None
+    rejected = admit(client, request_cost())
+    if rejected is not None:
+        return too_many_requests(*rejected)
+    g.ratelimit_client = client
+    return None
+
+def release_request(error=None):
+    client = g.pop('ratelimit_client', None)
+    if client is not None:
+        release(client)
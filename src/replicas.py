@@ -0,0 +1,204 @@
+"""
+Read replica routing.
+
+Set DATABASE_REPLICA_URLS to a comma separated list of replica URLs and
+db.session sends the reads of GET/HEAD requests to them round robin, one
+replica per transaction. Everything else stays on the primary:
+
+- non GET requests and anything flushed inside the request
+- GETs from a client that wrote less than REPLICA_STICKY_SECONDS ago, so
+  clients read their own writes. The client is remembered in this process
+  (by X-Client-Id or remote address) and through a cookie for the other
+  workers.
+
+Replicas are pinged every REPLICA_CHECK_INTERVAL seconds by a background
+thread of each worker, never on the request path. One that fails a ping
+or a query is taken out of rotation until a later ping succeeds. A read
+that fails on a replica is retried once on the primary, which serves the
+rest of the request. When no replica is healthy the primary serves the
+reads.
+
+Loads that fill the shared cache within REPLICA_STICKY_SECONDS of an
+invalidation of their namespace read from the primary (cache.py), so a
+lagging replica can't put a row the commit replaced back in the cache for
+every client. Other cached entries can be as old as the replication lag,
+like any replica read. REPLICA_STICKY_SECONDS should cover the lag.
+"""
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from flask import request, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, exc, text
+from engine_config import engine_options, configure_engine
+
+STICKY_COOKIE = 'read_primary_until'
+
+class Replica:
+    def __init__(self, url):
+        self.url = url
+        self.engine = create_engine(url, **engine_options(url))
+        configure_engine(self.engine)
+        # until the checker's first ping, a failed read falls back to the primary
+        self.healthy = True
+        self.checked_at = float('-inf')
+        event.listen(self.engine, 'handle_error', self._on_error)
+
+    def _on_error(self, context):
+        if context.is_disconnect or isinstance(context.original_exception, exc.OperationalError):
+            self.healthy = False
+
+    def ping(self):
+        self.checked_at = time.monotonic()
+        try:
+            with self.engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+            self.healthy = True
+        except exc.DBAPIError:
+            self.healthy = False
+        return self.healthy
+
+class ReplicaSet:
+    def __init__(self, urls, check_interval=30, sticky_seconds=5):
+        self.replicas = [Replica(url) for url in urls]
+        self.check_interval = check_interval
+        self.sticky_seconds = sticky_seconds
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._recent_writers = {}
+        self._checker = None
+
+    def _ensure_checker(self):
+        # started on first use so that every forked worker runs its own
+        if self._checker is not None and self._checker.is_alive():
+            return
+        with self._lock:
+            if self._checker is None or not self._checker.is_alive():
+                self._checker = threading.Thread(target=self._check_forever, name='replica-checker', daemon=True)
+                self._checker.start()
+
+    def _check_forever(self):
+        while True:
+            for replica in self.replicas:
+                replica.ping()
+            time.sleep(self.check_interval)
+
+    def choose(self):
+        self._ensure_checker()
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._next) % len(healthy)].engine
+
+    def wrote(self, client):
+        with self._lock:
+            now = time.monotonic()
+            self._recent_writers[client] = now + self.sticky_seconds
+            if len(self._recent_writers) > 10000:
+                self._recent_writers = {key: until for key, until in self._recent_writers.items() if until > now}
+
+    def is_sticky(self, client):
+        until = self._recent_writers.get(client)
+        return until is not None and until > time.monotonic()
+
+    def dispose(self, close=True):
+        # close=False after a fork: drop the inherited pool without closing the parent's connections
+        for replica in self.replicas:
+            replica.engine.dispose(close=close)
+
+    def stats(self):
+        return [{'url': replica.engine.url.render_as_string(hide_password=True), 'healthy': replica.healthy}
+                for replica in self.replicas]
+
+replica_set = None
+
+def init_replicas(app):
+    global replica_set
+    urls = [url.strip() for url in app.config.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    if urls:
+        replica_set = ReplicaSet(urls, check_interval=app.config.get('REPLICA_CHECK_INTERVAL', 30),
+                                 sticky_seconds=app.config.get('REPLICA_STICKY_SECONDS', 5))
+        app.after_request(_remember_writer)
+
+def client_key():
+    return request.headers.get('X-Client-Id') or request.remote_addr
+
+def _reads_from_replica(session):
+    if replica_set is None or session._flushing or session.info.get('wrote') or session.info.get('primary_only'):
+        return False
+    if not has_request_context() or request.method not in ('GET', 'HEAD'):
+        return False
+    if replica_set.is_sticky(client_key()):
+        return False
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) < time.time()
+    except ValueError:
+        return True
+
+def _remember_writer(response):
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+        replica_set.wrote(client_key())
+        response.set_cookie(STICKY_COOKIE, str(time.time() + replica_set.sticky_seconds),
+                            max_age=replica_set.sticky_seconds, httponly=True, samesite='Lax')
+    return response
+
+@contextmanager
+def reads_from_primary(session):
+    """
+    Send the reads of session inside the block to the primary
+    """
+    already = session.info.get('primary_only')
+    session.info['primary_only'] = True
+    try:
+        yield
+    finally:
+        if not already:
+            session.info.pop('primary_only', None)
+
+class RoutingSession(Session):
+    """
+    db.session class that sends GET request reads to a replica, see the
+    module docstring for the rules
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _reads_from_replica(self):
+            engine = self.info.get('replica')
+            if engine is None:
+                engine = replica_set.choose()
+                self.info['replica'] = engine
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_written(session, flush_context):
+    session.info['wrote'] = True
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _mark_bulk_written(orm_execute_state):
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info['wrote'] = True
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _retry_read_on_primary(orm_execute_state):
+    session = orm_execute_state.session
+    if not orm_execute_state.is_select or not _reads_from_replica(session):
+        return None
+    try:
+        return orm_execute_state.invoke_statement()
+    except exc.OperationalError:
+        # Replica._on_error took the replica out of rotation. The rollback
+        # ends the failed replica transaction (a GET has nothing to lose
+        # there), primary_only sends the retry and every later read of this
+        # session to the primary. Flask-SQLAlchemy drops the session, and
+        # its info, at the end of the request.
+        session.rollback()
+        session.info['primary_only'] = True
+        return orm_execute_state.invoke_statement()
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _release_replica(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('replica', None)
+        session.info.pop('wrote', None)
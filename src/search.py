@@ -0,0 +1,198 @@
+"""
+Name search over characters and planets.
+
+An in-process index keeps every name in a sorted list (prefix lookups are
+a bisect, well under a millisecond for typeahead) and an inverted index of
+name tokens for ranked search. It is built from the database on first use
+and then kept up to date from the committed changes (changes.py):
+inserts, renames and deletes are applied when their transaction commits,
+bulk insert() statements included when they return the new ids (the bulk
+endpoints do on Postgres and SQLite). Other bulk statements mark the
+index stale and it is rebuilt on the next lookup. Every process rebuilds
+its index at least every SEARCH_INDEX_TTL seconds to pick up writes served
+by other workers.
+"""
+import bisect
+import re
+import threading
+import time
+import unicodedata
+from models import db, Planets, Characters
+from serialization import columns_for, rows_to_dicts
+from utils import APIException, parse_page_args, parse_fields, parse_filters
+from changes import subscribe
+
+KINDS = {'characters': Characters, 'planets': Planets}
+MODEL_KINDS = {model: kind for kind, model in KINDS.items()}
+TOKEN = re.compile(r'\w+')
+
+def normalize(text):
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+def tokenize(text):
+    return TOKEN.findall(normalize(text))
+
+def prefix_range(ordered, prefix):
+    start = bisect.bisect_left(ordered, (prefix,))
+    end = bisect.bisect_left(ordered, (prefix + '\U0010ffff',))
+    return start, end
+
+class NameIndex:
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._built_at = None
+        self._names = {}        # (kind, id) -> name
+        self._sorted = []       # (normalized name, kind, id)
+        self._postings = {}     # token -> {(kind, id)}
+        self._tokens = []       # sorted distinct tokens, for token prefix matches
+
+    def mark_stale(self):
+        self._built_at = None
+
+    def _ensure_built(self):
+        if self._built_at is None or time.monotonic() - self._built_at > self.ttl:
+            self.rebuild()
+
+    def rebuild(self):
+        rows = []
+        for kind, model in KINDS.items():
+            rows.extend((kind, id, name) for id, name in db.session.execute(db.select(model.id, model.name)))
+        with self._lock:
+            self._names = {}
+            self._sorted = []
+            self._postings = {}
+            self._tokens = []
+            for kind, id, name in rows:
+                self._names[(kind, id)] = name
+                self._sorted.append((normalize(name), kind, id))
+                for token in tokenize(name):
+                    self._postings.setdefault(token, set()).add((kind, id))
+            self._sorted.sort()
+            self._tokens = sorted(self._postings)
+            self._built_at = time.monotonic()
+
+    def add(self, kind, id, name):
+        with self._lock:
+            if self._built_at is None:
+                return
+            self.remove(kind, id)
+            self._names[(kind, id)] = name
+            bisect.insort(self._sorted, (normalize(name), kind, id))
+            for token in tokenize(name):
+                if token not in self._postings:
+                    self._postings[token] = set()
+                    bisect.insort(self._tokens, token)
+                self._postings[token].add((kind, id))
+
+    def remove(self, kind, id):
+        with self._lock:
+            name = self._names.pop((kind, id), None)
+            if name is None:
+                return
+            entry = (normalize(name), kind, id)
+            position = bisect.bisect_left(self._sorted, entry)
+            if position < len(self._sorted) and self._sorted[position] == entry:
+                del self._sorted[position]
+            for token in tokenize(name):
+                postings = self._postings.get(token)
+                if postings is None:
+                    continue
+                postings.discard((kind, id))
+                if not postings:
+                    del self._postings[token]
+                    del self._tokens[bisect.bisect_left(self._tokens, token)]
+
+    def prefix_ids(self, kind, prefix):
+        """
+        Ids of the kind whose whole name starts with prefix, sorted by id
+        """
+        self._ensure_built()
+        with self._lock:
+            start, end = prefix_range(self._sorted, normalize(prefix))
+            return sorted(id for _, entry_kind, id in self._sorted[start:end] if entry_kind == kind)
+
+    def search(self, query, kind=None):
+        """
+        Ranked (score, kind, id, name) matches. Every query token has to
+        match a name token exactly or as a prefix (10 and 5 points), a whole
+        name equal to the query or starting with it adds 100 or 50.
+        """
+        self._ensure_built()
+        normalized = normalize(query).strip()
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with self._lock:
+            matching = []
+            for token in tokens:
+                start = bisect.bisect_left(self._tokens, token)
+                end = bisect.bisect_left(self._tokens, token + '\U0010ffff')
+                matching.append((sum(len(self._postings[name_token]) for name_token in self._tokens[start:end]), token, start, end))
+            # candidates come from the most selective token, the others only filter them
+            matching.sort()
+            _, _, start, end = matching[0]
+            candidates = set()
+            for name_token in self._tokens[start:end]:
+                candidates.update(self._postings[name_token])
+            matches = []
+            for key in candidates:
+                if kind is not None and key[0] != kind:
+                    continue
+                name = self._names[key]
+                name_tokens = tokenize(name)
+                score = 0
+                for token in tokens:
+                    if token in name_tokens:
+                        score += 10
+                    elif any(name_token.startswith(token) for name_token in name_tokens):
+                        score += 5
+                    else:
+                        break
+                else:
+                    normalized_name = normalize(name)
+                    if normalized_name == normalized:
+                        score += 100
+                    elif normalized_name.startswith(normalized):
+                        score += 50
+                    matches.append((score, key[0], key[1], name))
+        matches.sort(key=lambda match: (-match[0], match[3], match[2]))
+        return matches
+
+name_index = NameIndex()
+
+def init_search(app):
+    name_index.ttl = app.config.get('SEARCH_INDEX_TTL', 300)
+
+def prefix_page(model, args, default_fields):
+    """
+    A keyset page (same shape as utils.paginate) of the rows whose name
+    starts with ?name_prefix=, ids come from the index and the rows from
+    one IN query
+    """
+    if args.get('sort') or parse_filters(model, args):
+        raise APIException('name_prefix can not be combined with filters or sort', status_code=400)
+    after, limit = parse_page_args(args)
+    keys = parse_fields(args, model, default_fields)
+    ids = name_index.prefix_ids(MODEL_KINDS[model], args['name_prefix'])
+    ids = ids[bisect.bisect_right(ids, after):][:limit + 1]
+    next_cursor = ids[limit - 1] if len(ids) > limit else None
+    ids = ids[:limit]
+    rows = db.session.execute(db.select(*columns_for(model, keys)).where(model.id.in_(ids)).order_by(model.id)).all()
+    return rows_to_dicts(keys, rows), next_cursor
+
+def _apply_committed(changes):
+    for change in changes:
+        kind = MODEL_KINDS[change.model]
+        if change.operation == 'insert' and 'id' in change.values:
+            name_index.add(kind, change.values['id'], change.values['name'])
+        elif change.operation == 'update':
+            if 'name' in change.changed:
+                name_index.add(kind, change.values['id'], change.values['name'])
+        elif change.operation == 'delete':
+            name_index.remove(kind, change.before['id'])
+        else:
+            name_index.mark_stale()
+
+subscribe({model: ('id', 'name') for model in MODEL_KINDS}, _apply_committed)
@@ -0,0 +1,98 @@
+"""
+JSON encoding for the API.
+
+The encoder is picked once at startup with JSON_ENCODER: auto (default)
+uses orjson, then ujson, then the standard library, whichever is installed
+first. FastJSONProvider plugs it into Flask so jsonify() and dict return
+values use it too. Whatever the encoder, datetimes come out in ISO 8601
+(the way orjson writes them) and a value the fast encoders refuse, like an
+integer past 64 bits, is encoded by the standard library instead.
+
+Models declare their public fields once in `serialize_fields`
+(public key -> attribute), both serialize() and the column-tuple queries
+of the list endpoints are built from it.
+"""
+import datetime
+import json
+from flask.json.provider import DefaultJSONProvider
+
+def _default(obj):
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    return str(obj)
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, separators=(',', ':'), default=_default).encode()
+
+def _with_fallback(fast_dumps, errors):
+    def encode(obj):
+        try:
+            return fast_dumps(obj)
+        except errors:
+            return _stdlib_dumps(obj)
+    return encode
+
+def _load_encoder(name):
+    if name in ('auto', 'orjson'):
+        try:
+            import orjson
+            # orjson raises TypeError for integers outside 64 bits
+            return 'orjson', _with_fallback(
+                lambda obj: orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS), TypeError)
+        except ImportError:
+            if name == 'orjson':
+                raise RuntimeError('JSON_ENCODER=orjson needs the orjson package, run: pipenv install orjson')
+    if name in ('auto', 'ujson'):
+        try:
+            import ujson
+            # and ujson OverflowError
+            return 'ujson', _with_fallback(
+                lambda obj: ujson.dumps(obj, ensure_ascii=False, default=_default).encode(), (OverflowError, TypeError))
+        except ImportError:
+            if name == 'ujson':
+                raise RuntimeError('JSON_ENCODER=ujson needs the ujson package, run: pipenv install ujson')
+    if name in ('auto', 'stdlib'):
+        return 'stdlib', _stdlib_dumps
+    raise RuntimeError(f'Unknown JSON_ENCODER {name}, use auto, orjson, ujson or stdlib')
+
+encoder_name, dumps_bytes = _load_encoder('auto')
+
+def set_encoder(name):
+    global encoder_name, dumps_bytes
+    encoder_name, dumps_bytes = _load_encoder(name)
+
+def dumps(obj):
+    return dumps_bytes(obj).decode()
+
+def serialize_instance(instance):
+    return {key: getattr(instance, attribute) for key, attribute in instance.serialize_fields.items()}
+
+def columns_for(model, keys):
+    return [getattr(model, model.serialize_fields[key]) for key in keys]
+
+def rows_to_dicts(keys, rows):
+    """
+    Column tuples from db.select(*columns_for(...)) to response dicts,
+    no ORM object is built on the way
+    """
+    return [dict(zip(keys, row)) for row in rows]
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by the selected encoder. Pretty printing in
+    debug mode is kept on the standard library path.
+    """
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(obj)
+        return self._app.response_class(dumps_bytes(obj) + b'\n', mimetype=self.mimetype)
+
+def init_serialization(app):
+    set_encoder(app.config.get('JSON_ENCODER', 'auto'))
+    app.json = FastJSONProvider(app)
@@ -0,0 +1,51 @@
+"""
+Single-flight call coalescing: while a call for a key is running in this
+process, other callers of the same key wait for it and share its result
+instead of running it again.
+"""
+import threading
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.shared = False
+
+class Group:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """
+        (value, shared) of fn() for key. The first caller runs fn, callers
+        arriving while it runs get its value (or its exception) with
+        shared=True. Once fn returns the next caller runs it again.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.shared = True
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+        try:
+            call.value = fn()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value, call.shared
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,210 @@
+"""
+Aggregates for the /stats endpoints: planet count and total population,
+character count by gender, and favorites per planet / per character with
+their top-N rankings.
+
+The numbers live in memory and are kept up to date incrementally from
+the committed changes (changes.py). Creates, deletes, updates, bulk insert()
+parameters and the rows of bulk delete() statements are applied as deltas
+when their transaction commits, so a read never runs a GROUP BY. Bulk
+update() statements don't say how they changed the rows, so they mark
+the aggregates stale.
+
+Every process keeps its own aggregates, tied together by the 'stats'
+generation of the cache backend (cache.py). Each commit that changes
+tracked rows bumps it, and the process only applies its deltas when the
+bump was the next generation after the state it holds. Otherwise another
+worker committed in between and the aggregates are marked stale. Reads
+compare the held generation with the current one, so a process
+reconciles, one GROUP BY per aggregate, on its first read after another
+worker's write. With CACHE_BACKEND=redis that holds across all the
+workers. With the memory backend the generation is per process, and other
+workers' writes are picked up by the reconcile every
+STATS_RECONCILE_INTERVAL seconds, like the memory cache entries age out.
+Reconciliation runs inline on the read; no background thread is
+started.
+"""
+import bisect
+import threading
+import time
+from collections import Counter
+from models import db, Planets, Characters, FavoritePlanets, FavoriteCharacters
+from changes import subscribe
+import cache
+
+# cache generation bumped by every commit that changes the aggregates
+GENERATION = 'stats'
+
+class Ranking:
+    """
+    Counts per id plus a list of (-count, id) kept sorted with bisect:
+    a change finds its place in O(log n) but moving it shifts the list,
+    O(n) (a memmove, cheap for the thousands of ids of the catalog), and
+    top(n) is a slice
+    """
+    def __init__(self):
+        self.counts = {}
+        self._ordered = []
+
+    def reset(self, counts):
+        self.counts = {id: count for id, count in counts.items() if count > 0}
+        self._ordered = sorted((-count, id) for id, count in self.counts.items())
+
+    def add(self, id, delta):
+        count = self.counts.get(id, 0)
+        if count:
+            del self._ordered[bisect.bisect_left(self._ordered, (-count, id))]
+        count += delta
+        if count > 0:
+            self.counts[id] = count
+            bisect.insort(self._ordered, (-count, id))
+        else:
+            self.counts.pop(id, None)
+
+    def discard(self, id):
+        self.add(id, -self.counts.get(id, 0))
+
+    def top(self, n):
+        return [(id, -count) for count, id in self._ordered[:n]]
+
+class Stats:
+    def __init__(self, reconcile_interval=300):
+        self.reconcile_interval = reconcile_interval
+        self._lock = threading.RLock()
+        self._built_at = None
+        self._generation = None
+        self.planets = 0
+        self.total_population = 0
+        self.characters = 0
+        self.genders = Counter()
+        self.favorite_planets = Ranking()
+        self.favorite_characters = Ranking()
+
+    def mark_stale(self):
+        self._built_at = None
+
+    def _ensure_built(self):
+        if (self._built_at is None or time.monotonic() - self._built_at > self.reconcile_interval
+                or cache.cache.generation(GENERATION) != self._generation):
+            self.reconcile()
+
+    def reconcile(self):
+        # read first: a commit the GROUP BYs miss bumps it past this one
+        generation = cache.cache.generation(GENERATION)
+        planets, total_population = db.session.execute(
+            db.select(db.func.count(Planets.id), db.func.coalesce(db.func.sum(Planets.population), 0))).one()
+        genders = db.session.execute(db.select(Characters.gender, db.func.count()).group_by(Characters.gender)).all()
+        # the joins leave out favorites pointing at rows that no longer exist
+        favorite_planets = db.session.execute(
+            db.select(FavoritePlanets.planet_id, db.func.count())
+            .join(Planets, Planets.id == FavoritePlanets.planet_id).group_by(FavoritePlanets.planet_id)).all()
+        favorite_characters = db.session.execute(
+            db.select(FavoriteCharacters.character_id, db.func.count())
+            .join(Characters, Characters.id == FavoriteCharacters.character_id).group_by(FavoriteCharacters.character_id)).all()
+        with self._lock:
+            self.planets = planets
+            self.total_population = int(total_population)
+            self.genders = Counter(dict(genders))
+            self.characters = sum(self.genders.values())
+            self.favorite_planets.reset(dict(favorite_planets))
+            self.favorite_characters.reset(dict(favorite_characters))
+            self._built_at = time.monotonic()
+            self._generation = generation
+
+    def advance(self, generation):
+        """
+        Whether the deltas of a commit that bumped the generation to
+        generation can be applied: it has to follow the generation held,
+        otherwise the aggregates are marked stale
+        """
+        with self._lock:
+            if self._built_at is not None and generation == self._generation + 1:
+                self._generation = generation
+                return True
+            self.mark_stale()
+            return False
+
+    def apply(self, model, values, sign, deleted=False):
+        """
+        Count one row of model in (sign=1) or out (sign=-1), values holds
+        the tracked columns of the row. A deleted planet or character also
+        leaves the favorites ranking.
+        """
+        with self._lock:
+            if self._built_at is None:
+                return
+            if model is Planets:
+                self.planets += sign
+                self.total_population += sign * (values.get('population') or 0)
+                if deleted:
+                    self.favorite_planets.discard(values['id'])
+            elif model is Characters:
+                self.characters += sign
+                self.genders[values.get('gender')] += sign
+                if deleted:
+                    self.favorite_characters.discard(values['id'])
+            elif model is FavoritePlanets:
+                self.favorite_planets.add(values['planet_id'], sign)
+            elif model is FavoriteCharacters:
+                self.favorite_characters.add(values['character_id'], sign)
+
+    def summary(self):
+        self._ensure_built()
+        with self._lock:
+            return {
+                'planets': {'count': self.planets, 'total_population': self.total_population},
+                'characters': {'count': self.characters, 'genders': self._gender_breakdown()},
+                'favorites': {'planets': sum(self.favorite_planets.counts.values()),
+                              'characters': sum(self.favorite_characters.counts.values())},
+            }
+
+    def gender_breakdown(self):
+        self._ensure_built()
+        with self._lock:
+            return self._gender_breakdown()
+
+    def _gender_breakdown(self):
+        # null genders are reported as "unknown"
+        return {gender if gender is not None else 'unknown': count
+                for gender, count in sorted(self.genders.items(), key=lambda item: (item[0] is None, item[0] or ''))
+                if count > 0}
+
+    def top_favorites(self, kind, n):
+        """
+        The n most favorited planets or characters as (id, favorites)
+        """
+        self._ensure_built()
+        ranking = self.favorite_planets if kind == 'planets' else self.favorite_characters
+        with self._lock:
+            return ranking.top(n)
+
+# columns each model contributes to the aggregates
+TRACKED = {
+    Planets: ('id', 'population'),
+    Characters: ('id', 'gender'),
+    FavoritePlanets: ('planet_id',),
+    FavoriteCharacters: ('character_id',),
+}
+
+stats = Stats()
+
+def init_stats(app):
+    stats.reconcile_interval = app.config.get('STATS_RECONCILE_INTERVAL', 300)
+
+def _apply_committed(changes):
+    if not stats.advance(cache.cache.bump_generation(GENERATION)):
+        return
+    for change in changes:
+        tracked = TRACKED[change.model]
+        if change.operation == 'insert' and all(attribute in change.values for attribute in tracked if attribute != 'id'):
+            stats.apply(change.model, change.values, 1)
+        elif change.operation == 'update':
+            if change.changed.intersection(tracked):
+                stats.apply(change.model, change.before, -1)
+                stats.apply(change.model, change.values, 1)
+        elif change.operation == 'delete':
+            stats.apply(change.model, change.before, -1, deleted=True)
+        else:
+            stats.mark_stale()
+
+subscribe(TRACKED, _apply_committed)
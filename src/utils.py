@@ -1,4 +1,11 @@
-from flask import jsonify, url_for
+import base64
+import json
+import operator
+import random
+from flask import jsonify, url_for, current_app, Response, stream_with_context
+from werkzeug.routing import IntegerConverter
+from models import db
+from serialization import dumps, columns_for, rows_to_dicts
 
 class APIException(Exception):
     status_code = 400
@@ -15,13 +22,334 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+# range of the Integer columns (32 bits on Postgres and MySQL), a bigger
+# value fails in the driver instead of matching no row
+INT_MIN, INT_MAX = -2**31, 2**31 - 1
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool) and INT_MIN <= value <= INT_MAX
+
+class IdConverter(IntegerConverter):
+    """
+    <int:id> bounded to INT_MAX, a bigger id doesn't match the route (404)
+    """
+    def __init__(self, map, *args, **kwargs):
+        kwargs.setdefault('max', INT_MAX)
+        super().__init__(map, *args, **kwargs)
+
+def parse_limit(args):
+    default_limit = current_app.config.get('DEFAULT_PAGE_SIZE', 100)
+    max_limit = current_app.config.get('MAX_PAGE_SIZE', 1000)
+    try:
+        limit = int(args.get('limit', default_limit))
+    except ValueError:
+        raise APIException('limit must be an integer', status_code=400)
+    if limit < 1:
+        raise APIException('limit must be >= 1', status_code=400)
+    return min(limit, max_limit)
+
+def parse_after_id(args):
+    try:
+        after = int(args.get('after', 0))
+    except ValueError:
+        raise APIException('after must be an integer', status_code=400)
+    if after < 0:
+        raise APIException('after must be >= 0', status_code=400)
+    if not is_int(after):
+        raise APIException(f'after must be <= {INT_MAX}', status_code=400)
+    return after
+
+def parse_page_args(args):
+    return parse_after_id(args), parse_limit(args)
+
+def parse_fields(args, model, default_fields):
+    fields = args.get('fields')
+    if not fields:
+        return list(default_fields)
+    keys = [key.strip() for key in fields.split(',') if key.strip()]
+    unknown = [key for key in keys if key not in model.serialize_fields]
+    if unknown:
+        raise APIException('Unknown fields: ' + ', '.join(unknown), status_code=400,
+                           payload={'allowed': list(model.serialize_fields)})
+    return keys
+
+def parse_ids(args):
+    """
+    ?ids=1,2,3 as a list of distinct ids in the order given, at most
+    MAX_PAGE_SIZE of them
+    """
+    try:
+        ids = list(dict.fromkeys(int(id) for id in args['ids'].split(',') if id.strip()))
+    except ValueError:
+        raise APIException('ids must be a comma separated list of integers', status_code=400)
+    if not ids:
+        raise APIException('ids must not be empty', status_code=400)
+    if not all(is_int(id) for id in ids):
+        raise APIException(f'ids must be between {INT_MIN} and {INT_MAX}', status_code=400)
+    if len(ids) > current_app.config.get('MAX_PAGE_SIZE', 1000):
+        raise APIException(f"At most {current_app.config.get('MAX_PAGE_SIZE', 1000)} ids per request", status_code=400)
+    return ids
+
+# query string arguments of the list endpoints that are not filters
+RESERVED_ARGS = {'after', 'limit', 'fields', 'sort', 'stream', 'name_prefix', 'ids'}
+
+FILTER_OPERATORS = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'in': lambda column, values: column.in_(values),
+}
+
+def query_fields(model):
+    # filters and sort accept the public field names and the attribute names
+    fields = {attribute: attribute for attribute in model.serialize_fields.values()}
+    fields.update(model.serialize_fields)
+    return fields
+
+def coerce_value(column, value):
+    """
+    Query string value to the python type of column, raises ValueError.
+    Integers accept float notation as long as it is integral (1e9) and
+    within the range of the column.
+    """
+    python_type = column.type.python_type
+    if python_type is int:
+        number = float(value)
+        if not number.is_integer() or not is_int(int(number)):
+            raise ValueError(value)
+        return int(number)
+    if python_type is bool:
+        if value.lower() in ('1', 'true'):
+            return True
+        if value.lower() in ('0', 'false'):
+            return False
+        raise ValueError(value)
+    return value
+
+def parse_filters(model, args):
+    """
+    ?field=value and ?field__<op>=value (ne, gt, gte, lt, lte, in with a
+    comma separated list) as SQL conditions, ANDed together
+    """
+    fields = query_fields(model)
+    conditions = []
+    for name in args:
+        if name in RESERVED_ARGS:
+            continue
+        field, _, op = name.partition('__')
+        op = op or 'eq'
+        if field not in fields or op not in FILTER_OPERATORS:
+            raise APIException(f'Unknown filter: {name}', status_code=400,
+                               payload={'fields': list(model.serialize_fields), 'operators': list(FILTER_OPERATORS)})
+        column = getattr(model, fields[field])
+        try:
+            for value in args.getlist(name):
+                if op == 'in':
+                    value = [coerce_value(column, item) for item in value.split(',') if item]
+                else:
+                    value = coerce_value(column, value)
+                conditions.append(FILTER_OPERATORS[op](column, value))
+        except ValueError:
+            raise APIException(f'Invalid value for {name}', status_code=400)
+    return conditions
+
+def is_indexed(attribute):
+    # an index can serve the sort only when it leads with the column
+    column = attribute.property.columns[0]
+    if column.primary_key or column.unique:
+        return True
+    return any(next(iter(index.columns)) is column for index in column.table.indexes)
+
+def table_is_large(model):
+    # counts at most SORT_SCAN_LIMIT + 1 ids, so the check itself stays cheap
+    scan_limit = current_app.config.get('SORT_SCAN_LIMIT', 10000)
+    ids = db.select(model.id).limit(scan_limit + 1).subquery()
+    return db.session.scalar(db.select(db.func.count()).select_from(ids)) > scan_limit
+
+def parse_sort(model, args):
+    """
+    ?sort=field or ?sort=-field (descending) as (column, descending), None
+    for the default id order. Sorting by a column without an index is only
+    allowed while the table is smaller than SORT_SCAN_LIMIT rows.
+    """
+    sort = args.get('sort')
+    if not sort:
+        return None
+    descending = sort.startswith('-')
+    field = sort[1:] if descending else sort
+    fields = query_fields(model)
+    if field not in fields:
+        raise APIException(f'Unknown sort field: {field}', status_code=400, payload={'allowed': list(model.serialize_fields)})
+    column = getattr(model, fields[field])
+    if column is model.id and not descending:
+        return None
+    if not is_indexed(column) and table_is_large(model):
+        raise APIException(f'Sorting by {field} is not supported, the column has no index', status_code=400)
+    return column, descending
+
+# no ?after= cursor, the sorted rows are read from the start
+MISSING_CURSOR = object()
+
+def encode_cursor(value, id):
+    return base64.urlsafe_b64encode(dumps([value, id]).encode()).decode()
+
+def decode_cursor(column, cursor):
+    try:
+        value, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not is_int(id):
+            raise ValueError(id)
+        if value is None:
+            # a position among the NULL rows at the end
+            return None, id
+        return coerce_value(column, str(value)), id
+    except (ValueError, TypeError):
+        raise APIException('Invalid after cursor', status_code=400)
+
+def list_statements(model, args, columns):
+    """
+    select(id, sort value, *columns) statements of the rows matching the
+    ?filters, in ?sort= order (id breaks ties) and after the ?after= cursor,
+    to be read one after the other. The cursor is the last id for the
+    default order and an opaque token otherwise.
+
+    Rows with a NULL sort value come last in both directions, ordered by
+    id: a nullable sort column gives one statement for the non NULL values
+    and one for the NULL rows, each a range scan of the (column, id) index.
+    Returns the statements and the parsed sort.
+    """
+    sort = parse_sort(model, args)
+    statement = db.select(model.id, sort[0] if sort else model.id, *columns).where(*parse_filters(model, args))
+    if sort is None:
+        return [statement.where(model.id > parse_after_id(args)).order_by(model.id)], sort
+    column, descending = sort
+    value, after_id = decode_cursor(column, args['after']) if args.get('after') else (MISSING_CURSOR, None)
+    statements = []
+    if value is not None:
+        values = statement.where(column.is_not(None)) if column.nullable else statement
+        if value is not MISSING_CURSOR:
+            key, after = db.tuple_(column, model.id), db.tuple_(value, after_id)
+            values = values.where(key < after if descending else key > after)
+        statements.append(values.order_by(column.desc(), model.id.desc()) if descending else values.order_by(column, model.id))
+    # a filter on the column, whatever its operator, never matches NULL
+    filtered = any(query_fields(model).get(name.partition('__')[0]) == column.key for name in args if name not in RESERVED_ARGS)
+    if column.nullable and not filtered:
+        nulls = statement.where(column.is_(None))
+        if value is None:
+            nulls = nulls.where(model.id < after_id if descending else model.id > after_id)
+        statements.append(nulls.order_by(model.id.desc() if descending else model.id))
+    return statements, sort
+
+def page_statements(model, args, default_fields):
+    """
+    Keyset pagination, see list_statements(). Only the projected columns are
+    selected, so rows come back as tuples and no ORM objects are built.
+    Returns the statements plus what page_rows() and page_from_rows() need
+    to read them.
+    """
+    limit = parse_limit(args)
+    keys = parse_fields(args, model, default_fields)
+    statements, sort = list_statements(model, args, columns_for(model, keys))
+    return statements, keys, limit, sort
+
+def page_rows(statements, limit):
+    """
+    Up to limit + 1 rows (one extra row tells if there is a next page
+    without a COUNT(*)), the next statement only runs when the previous
+    ones came up short
+    """
+    rows = []
+    for statement in statements:
+        rows.extend(db.session.execute(statement.limit(limit + 1 - len(rows))).all())
+        if len(rows) > limit:
+            break
+    return rows
+
+def page_from_rows(rows, keys, limit, sort=None):
+    """
+    Returns the page as a list of dicts and the cursor for the next page
+    (None on the last page).
+    """
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = last[0] if sort is None else encode_cursor(last[1], last[0])
+    data = rows_to_dicts(keys, (row[2:] for row in rows[:limit]))
+    return data, next_cursor
+
+def paginate(model, args, default_fields):
+    statements, keys, limit, sort = page_statements(model, args, default_fields)
+    return page_from_rows(page_rows(statements, limit), keys, limit, sort)
+
+def negotiated_mimetype(request):
+    """
+    The representation Accept asks for on the list endpoints, JSON pages
+    or an NDJSON export
+    """
+    return request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+
+def wants_stream(request):
+    if request.args.get('stream') in ('1', 'true', 'ndjson', 'json'):
+        return True
+    return negotiated_mimetype(request) == 'application/x-ndjson'
+
+def stream_rows(model, request, default_fields):
+    """
+    Export every matching row (same filters, sort and ?after= as the pages)
+    as NDJSON, or a chunked JSON array with ?stream=json. Rows are read with
+    a server-side cursor in batches of STREAM_BATCH_SIZE and written out as
+    they arrive, so memory stays flat no matter how big the table is.
+    """
+    keys = parse_fields(request.args, model, default_fields)
+    batch_size = current_app.config.get('STREAM_BATCH_SIZE', 1000)
+    as_array = request.args.get('stream') == 'json'
+    statements, _ = list_statements(model, request.args, columns_for(model, keys))
+
+    def generate():
+        if as_array:
+            yield '['
+        separator = ''
+        for statement in statements:
+            for batch in db.session.execute(statement.execution_options(yield_per=batch_size)).partitions():
+                lines = [dumps(row) for row in rows_to_dicts(keys, (row[2:] for row in batch))]
+                if as_array:
+                    yield separator + ','.join(lines)
+                    separator = ','
+                else:
+                    yield '\n'.join(lines) + '\n'
+        if as_array:
+            yield ']'
+
+    mimetype = 'application/json' if as_array else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+def log_sampled(logger, level, msg, *args):
+    """
+    Log only LOG_SAMPLE_RATE of the calls, for messages on hot paths
+    """
+    if logger.isEnabledFor(level) and random.random() < current_app.config.get('LOG_SAMPLE_RATE', 1.0):
+        logger.log(level, msg, *args)
+
+def serialize_or_none(instance):
+    return instance.serialize() if instance is not None else None
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
     return len(defaults) >= len(arguments)
 
+# url_map doesn't change once the app serves requests, the page is built once per app
+_sitemaps = {}
+
 def generate_sitemap(app):
-    links = ['/admin/']
+    if app not in _sitemaps:
+        _sitemaps[app] = build_sitemap(app)
+    return _sitemaps[app]
+
+def build_sitemap(app):
+    links = ['/admin/'] if app.config.get('ADMIN_MODE', 'lazy') != 'off' else []
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
         # and rules that require parameters
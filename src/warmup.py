@@ -0,0 +1,49 @@
+"""
+Boot helpers for preforked gunicorn workers, see gunicorn.conf.py.
+
+With preload_app the master imports the app once and can warm it before
+forking: mappers configured, the first WARM_ROWS characters and planets in
+the catalog cache (id -> row, the entries of /characters/<id> and
+/planet/<id>) and the name search index. Workers inherit all of it
+copy-on-write instead of each building its own from a cold database. The
+in-memory structures only help with the memory cache backend; with Redis
+the entries are shared anyway.
+
+The /stats aggregates are not warmed: each worker builds its own on its
+first read and keeps it in step with the others (stats.py), a copy of
+the master's would start out behind every write made while the workers
+boot.
+
+Database connections must not cross a fork: the master disposes its pools
+after warming, and every worker drops whatever pool it inherited.
+"""
+import logging
+from sqlalchemy.orm import configure_mappers
+from models import db, Planets, Characters
+from cache import cached_many
+from search import name_index
+import replicas
+
+logger = logging.getLogger(__name__)
+
+# rows per IN query while warming
+WARM_CHUNK = 500
+
+def warm_catalog(app, max_rows):
+    with app.app_context():
+        configure_mappers()
+        for model in (Characters, Planets):
+            ids = db.session.scalars(db.select(model.id).order_by(model.id).limit(max_rows)).all()
+            for start in range(0, len(ids), WARM_CHUNK):
+                cached_many(model, ids[start:start + WARM_CHUNK])
+            logger.info('Warmed %d %s', len(ids), model.__tablename__)
+        name_index.rebuild()
+        db.session.remove()
+        dispose_engines(app)
+
+def dispose_engines(app, close=True):
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=close)
+    if replicas.replica_set is not None:
+        replicas.replica_set.dispose(close=close)
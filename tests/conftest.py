@@ -0,0 +1,99 @@
+"""
+The app is imported once, on a scratch SQLite file, with the job workers
+off (tests drain the queue with jobs.drain_once) and the rate limiter on
+with a bucket no test empties unless it lowers the limits itself.
+"""
+import os
+import sys
+import tempfile
+
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='starwars-tests-'), 'test.db')
+os.environ['API_ONLY'] = '1'
+os.environ['JOBS_WORKERS'] = '0'
+os.environ['RATELIMIT_ENABLED'] = '1'
+os.environ['RATELIMIT_RATE'] = '1000000'
+os.environ['RATELIMIT_BURST'] = '1000000'
+os.environ['RATELIMIT_CONCURRENCY'] = '1000'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import fakeredis
+import pytest
+import redis
+from sqlalchemy import event
+from app import app as flask_app
+from models import db, User, Planets, Characters
+import cache
+import idempotency
+import ratelimit
+import search
+import stats
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+    cache.cache.clear()
+    idempotency.store = idempotency.MemoryStore()
+    ratelimit.store = ratelimit.MemoryStore()
+    search.name_index.mark_stale()
+    stats.stats.mark_stale()
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def make_rows(app):
+    """
+    make_rows(model, [values, ...]) inserts the rows and returns their ids
+    """
+    def make(model, rows):
+        with app.app_context():
+            instances = [model(**values) for values in rows]
+            db.session.add_all(instances)
+            db.session.commit()
+            return [instance.id for instance in instances]
+    return make
+
+@pytest.fixture
+def user(make_rows):
+    return make_rows(User, [{'email': 'luke@rebels.org', 'password': 'x', 'is_active': True}])[0]
+
+@pytest.fixture
+def characters(make_rows):
+    masses = [None, 80, 20, None, 80, 136, None, 49]
+    genders = ['male', 'female', None, 'male', 'n/a', None, 'female', 'male']
+    return make_rows(Characters, [{'name': f'Character {i}', 'height': 150 + i, 'mass': mass, 'gender': gender}
+                                  for i, (mass, gender) in enumerate(zip(masses, genders))])
+
+@pytest.fixture
+def planets(make_rows):
+    return make_rows(Planets, [{'name': f'Planet {i}', 'population': 1000 * i} for i in range(5)])
+
+@pytest.fixture
+def statements(app):
+    """
+    The SQL statements run while the test body executes
+    """
+    executed = []
+    def record(*args):
+        executed.append(args[2])
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', record)
+    yield executed
+    with app.app_context():
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+@pytest.fixture
+def redis_backend(monkeypatch):
+    """
+    redis_backend() returns a cache.RedisBackend on a fakeredis server, the
+    same server for every call of the test, as gunicorn workers share one
+    """
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, 'from_url', lambda url: fakeredis.FakeRedis(server=server))
+    return lambda: cache.RedisBackend('redis://fake')
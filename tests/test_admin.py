@@ -0,0 +1,9 @@
+from models import db
+from admin import LazyAdmin
+
+def test_the_lazy_admin_engine_gets_the_connection_setup(app):
+    admin_app = LazyAdmin(app).admin_app()
+    with admin_app.app_context():
+        # synchronous=NORMAL, engine_config.connection_setup_statements()
+        assert db.session.execute(db.text('PRAGMA synchronous')).scalar() == 1
+        db.session.remove()
@@ -0,0 +1,146 @@
+import asyncio
+import pytest
+from sqlalchemy import event
+import asgi
+import cache
+import ratelimit
+from models import Characters
+from test_favorites import add_favorites
+
+def asgi_request(path, method='GET', headers=None, body=b''):
+    """
+    (status, headers, body) of asgi.application for one request
+    """
+    path, _, query = path.partition('?')
+    headers = dict(headers or {})
+    if body:
+        headers['Content-Length'] = str(len(body))
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http',
+        'path': path, 'root_path': '', 'query_string': query.encode(),
+        'headers': [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+        'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    async def run():
+        try:
+            await asgi.application(scope, receive, send)
+        finally:
+            # the pooled connections belong to this event loop
+            await asgi.engine.dispose()
+    asyncio.run(run())
+    start = messages[0]
+    headers = {name.decode(): value.decode() for name, value in start['headers']}
+    return start['status'], headers, b''.join(message.get('body', b'') for message in messages[1:])
+
+def async_view_for(path, method='GET'):
+    path, _, query = path.partition('?')
+    return asgi.match_async_view(asgi.build_environ({'type': 'http', 'http_version': '1.1', 'method': method,
+                                                     'path': path, 'headers': [], 'query_string': query.encode()}))
+
+def flask_request(client, path, headers=None):
+    response = client.get(path, headers=headers)
+    return response.status_code, {name.lower(): value for name, value in response.headers.items()}, response.data
+
+@pytest.fixture
+def async_engine_statements(app):
+    executed = []
+    def record(*args):
+        executed.append(args[2])
+    event.listen(asgi.engine.sync_engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(asgi.engine.sync_engine, 'before_cursor_execute', record)
+
+PATHS = ['/characters', '/characters?limit=3&fields=id,name,height', '/planets?population__gte=2000',
+         '/characters?sort=-height&limit=2', '/characters/{character}', '/characters/999', '/planet/{planet}',
+         '/planet/999', '/user/{user}/favorites', '/user/999/favorites']
+
+@pytest.mark.parametrize('path', PATHS)
+@pytest.mark.parametrize('headers', [None, {'Accept-Encoding': 'gzip'}])
+def test_async_views_answer_like_the_flask_views(client, user, characters, planets, path, headers):
+    add_favorites(client, user, planets[:2], characters[:1])
+    path = path.format(character=characters[1], planet=planets[1], user=user)
+    assert async_view_for(path) is not None
+    cache.cache.clear()
+    from_asgi = asgi_request(path, headers=headers)
+    cache.cache.clear()
+    assert from_asgi == flask_request(client, path, headers)
+    # and from the entries the other one cached
+    assert asgi_request(path, headers=headers) == flask_request(client, path, headers)
+
+def test_async_views_answer_conditional_requests(client, characters):
+    status, headers, _ = asgi_request(f'/characters/{characters[0]}')
+    assert status == 200
+    status, _, body = asgi_request(f'/characters/{characters[0]}', headers={'If-None-Match': headers['etag']})
+    assert (status, body) == (304, b'')
+    status, _, _ = asgi_request(f'/characters/{characters[0]}', headers={'If-Modified-Since': headers['last-modified']})
+    assert status == 304
+    status, headers, body = asgi_request('/characters', method='HEAD')
+    assert (status, body) == (200, b'')
+    assert int(headers['content-length']) > 0
+
+def test_async_favorites_run_their_queries_separately(client, user, planets, characters, async_engine_statements):
+    add_favorites(client, user, planets[:2], characters[:2])
+    cache.cache.clear()
+    status, _, _ = asgi_request(f'/user/{user}/favorites')
+    assert status == 200
+    assert len(async_engine_statements) == 3
+    assert not any('UNION' in statement for statement in async_engine_statements)
+
+def test_async_reads_see_committed_writes(client, characters):
+    assert b'Character 0' in asgi_request(f'/characters/{characters[0]}')[2]
+    assert client.delete(f'/delete/character/{characters[0]}').status_code == 200
+    assert asgi_request(f'/characters/{characters[0]}')[0] == 404
+
+def test_async_views_are_rate_limited(client, characters, monkeypatch):
+    monkeypatch.setattr(ratelimit, 'rate', 0.001)
+    monkeypatch.setattr(ratelimit, 'burst', 1)
+    assert asgi_request(f'/characters/{characters[0]}')[0] == 200
+    status, headers, _ = asgi_request(f'/characters/{characters[0]}')
+    assert status == 429
+    assert int(headers['retry-after']) >= 1
+    # the slot of the rejected request was given back
+    assert ratelimit.store.acquire('ip:127.0.0.1', 1)
+
+@pytest.mark.parametrize('method, path', [
+    ('GET', '/characters?ids=1,2'),
+    ('GET', '/characters?name_prefix=Char'),
+    ('GET', '/characters?stream=1'),
+    ('GET', '/user'),
+    ('POST', '/create/planet'),
+])
+def test_other_requests_go_to_the_flask_app(app, method, path):
+    assert async_view_for(path, method) is None
+
+def test_sorting_by_a_column_without_index_goes_to_the_flask_app(app, monkeypatch):
+    assert async_view_for('/characters?sort=height') is not None
+    monkeypatch.setattr(asgi, 'is_indexed', lambda column: column.key == 'id')
+    assert async_view_for('/characters?sort=height') is None
+
+def test_flask_fallback_serves_writes(client):
+    status, _, body = asgi_request('/create/planet', method='POST', headers={'Content-Type': 'application/json'},
+                                   body=b'{"name": "Hoth", "population": 0}')
+    assert status == 200
+    assert b'Hoth' in body
+
+def test_concurrent_async_misses_share_one_load(app, characters, async_engine_statements):
+    key = ('characters', characters[0])
+    coalesced = cache.counters['coalesced']
+
+    async def run():
+        try:
+            return await asyncio.gather(*(asgi.cached(key, lambda: asgi.fetch_serialized(Characters, characters[0]))
+                                          for _ in range(5)))
+        finally:
+            await asgi.engine.dispose()
+    values = asyncio.run(run())
+    assert values == [values[0]] * 5 and values[0]['name'] == 'Character 0'
+    assert len(async_engine_statements) == 1
+    assert cache.counters['coalesced'] == coalesced + 4
@@ -0,0 +1,77 @@
+import json
+from sqlalchemy import event
+from models import db
+import ratelimit
+
+def batch(client, *paths, **kwargs):
+    return client.post('/batch', json={'requests': [{'path': path} for path in paths]}, **kwargs)
+
+def test_responses_come_back_in_request_order(client, characters, planets):
+    response = batch(client, f'/planet/{planets[1]}', f'/characters/{characters[0]}', '/characters/9999')
+    assert response.status_code == 200
+    responses = response.get_json()['responses']
+    assert [item['status'] for item in responses] == [200, 200, 404]
+    assert responses[0]['body']['Data']['name'] == 'Planet 1'
+    assert responses[1]['body']['data']['id'] == characters[0]
+    assert responses[2]['path'] == '/characters/9999'
+
+def test_single_row_lookups_are_prefetched(app, client, characters):
+    paths = [f'/characters/{id}' for id in characters]
+    statements = []
+    def count(*args):
+        statements.append(args[2])
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        assert batch(client, *paths).status_code == 200
+    finally:
+        with app.app_context():
+            event.remove(db.engine, 'before_cursor_execute', count)
+    # one IN query for all the rows, the views and their validators then read the cache
+    assert len([sql for sql in statements if 'FROM characters' in sql]) == 1
+    assert ' IN (' in statements[0]
+
+def test_sub_request_headers_are_passed_on(client, characters):
+    response = client.post('/batch', json={'requests': [{'path': '/characters',
+                                                         'headers': {'Accept': 'application/x-ndjson'}}]})
+    body = response.get_json()['responses'][0]['body']
+    assert [json.loads(line)['id'] for line in body.splitlines()] == characters
+
+def test_only_get_requests_can_be_batched(client):
+    response = client.post('/batch', json={'requests': [{'path': '/create/planet', 'method': 'POST'}]})
+    assert response.status_code == 400
+
+def test_invalid_bodies_are_rejected(client):
+    assert client.post('/batch', json={'requests': []}).status_code == 400
+    assert client.post('/batch', json={'requests': [{'path': 'characters'}]}).status_code == 400
+    assert client.post('/batch', data='not json').status_code == 400
+
+def test_batch_size_is_limited(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'BATCH_MAX_REQUESTS', 2)
+    assert batch(client, '/characters/1', '/characters/2', '/characters/3').status_code == 413
+
+def test_out_of_range_ids_are_a_400(client, characters, planets):
+    for path in ('/characters', '/planets'):
+        response = client.get(f'{path}?ids=1,99999999999999999999')
+        assert response.status_code == 400
+        assert 'ids' in response.get_json()['message']
+
+def test_out_of_range_path_ids_are_a_404(client, characters):
+    response = batch(client, '/characters/99999999999999999999', f'/characters?ids={2**31}',
+                     f'/characters/{characters[0]}')
+    assert response.status_code == 200
+    assert [item['status'] for item in response.get_json()['responses']] == [404, 400, 200]
+    assert client.get('/planet/99999999999999999999').status_code == 404
+
+def test_sub_requests_pay_their_own_cost(client, characters, monkeypatch):
+    monkeypatch.setattr(ratelimit, 'rate', 0.001)
+    monkeypatch.setattr(ratelimit, 'burst', 10)
+    # the batch costs 1 and every list page 5
+    response = batch(client, '/characters', '/characters', '/characters')
+    assert response.status_code == 200
+    assert [item['status'] for item in response.get_json()['responses']] == [200, 429, 429]
+
+def test_sub_requests_dont_take_concurrency_slots(client, characters, monkeypatch):
+    monkeypatch.setattr(ratelimit, 'concurrency', 1)
+    response = batch(client, *[f'/characters/{id}' for id in characters])
+    assert [item['status'] for item in response.get_json()['responses']] == [200] * len(characters)
@@ -0,0 +1,61 @@
+import json
+from sqlalchemy.exc import IntegrityError
+from models import db, Planets, FavoritePlanets
+import bulk
+
+def test_every_row_is_created_with_its_id(app, client):
+    response = client.post('/bulk/planets?batch_size=2', json=[{'name': f'Planet {i}', 'population': i} for i in range(5)])
+    assert response.status_code == 201
+    results = response.get_json()['results']
+    assert [result['index'] for result in results] == list(range(5))
+    with app.app_context():
+        names = {planet.id: planet.name for planet in db.session.scalars(db.select(Planets))}
+    assert [names[result['id']] for result in results] == [f'Planet {i}' for i in range(5)]
+
+def test_ndjson_body(client):
+    body = '\n'.join(json.dumps({'name': f'Character {i}', 'height': 170}) for i in range(3))
+    response = client.post('/bulk/characters', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 201
+    assert len(response.get_json()['results']) == 3
+
+def test_nothing_is_created_when_an_item_is_invalid(app, client, planets):
+    response = client.post('/bulk/planets', json=[{'name': 'Hoth', 'population': 1},
+                                                  {'name': 'Planet 1', 'population': 1},
+                                                  {'name': 'Hoth', 'population': 2},
+                                                  {'name': 'Scarif', 'population': 2 ** 40}])
+    assert response.status_code == 400
+    assert [(result['index'], result['status']) for result in response.get_json()['results']] == [
+        (1, 'duplicate'), (2, 'duplicate'), (3, 'invalid')]
+    with app.app_context():
+        assert db.session.scalar(db.select(db.func.count()).select_from(Planets)) == len(planets)
+
+def test_name_taken_after_the_check_is_a_409(app, client, planets, monkeypatch):
+    # a concurrent request inserts the name between the check and the insert
+    monkeypatch.setattr(bulk, 'reject_duplicate_names', lambda model, rows, errors: rows)
+    response = client.post('/bulk/planets', json=[{'name': 'Hoth', 'population': 1},
+                                                  {'name': 'Planet 1', 'population': 1}])
+    assert response.status_code == 409
+    with app.app_context():
+        assert db.session.scalar(db.select(Planets).filter_by(name='Hoth')) is None
+    assert client.post('/bulk/planets', json=[{'name': 'Hoth', 'population': 1}]).status_code == 201
+
+def test_favorites_are_added_and_checked(app, client, user, planets, characters):
+    response = client.post(f'/user/{user}/favorites/bulk', json=[{'planet_id': planets[0]},
+                                                                 {'character_id': characters[0]}])
+    assert response.status_code == 201
+    assert [result.get('planet_id', result.get('character_id')) for result in response.get_json()['results']] == [
+        planets[0], characters[0]]
+    again = client.post(f'/user/{user}/favorites/bulk', json=[{'planet_id': planets[0]}, {'planet_id': 9999}])
+    assert again.status_code == 400
+    assert client.post('/user/9999/favorites/bulk', json=[{'planet_id': planets[0]}]).status_code == 404
+
+def test_favorite_added_after_the_check_is_a_409(app, client, user, planets, monkeypatch):
+    def commit():
+        # a concurrent request added the same favorite first
+        raise IntegrityError('INSERT', {}, Exception('UNIQUE constraint failed'))
+    monkeypatch.setattr(db.session, 'commit', commit)
+    response = client.post(f'/user/{user}/favorites/bulk', json=[{'planet_id': planets[0]}])
+    assert response.status_code == 409
+    monkeypatch.undo()
+    with app.app_context():
+        assert db.session.scalar(db.select(FavoritePlanets)) is None
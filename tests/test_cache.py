@@ -0,0 +1,116 @@
+import pytest
+from models import db, Characters, Planets
+import cache
+
+@pytest.fixture(autouse=True, params=['memory', 'redis'])
+def backend(request, monkeypatch, redis_backend):
+    """
+    Every test runs against both backends
+    """
+    if request.param == 'redis':
+        monkeypatch.setattr(cache, 'cache', redis_backend())
+    return request.param
+
+def reads(statements, table):
+    return [sql for sql in statements if sql.lstrip().upper().startswith('SELECT') and f'FROM {table}' in sql]
+
+def test_rows_and_pages_are_served_from_the_cache(client, characters, statements):
+    for path in (f'/characters/{characters[0]}', '/characters?limit=3'):
+        first = client.get(path).get_json()
+        statements.clear()
+        assert client.get(path).get_json() == first
+        assert reads(statements, 'characters') == []
+
+def test_create_invalidates_the_pages(client, characters):
+    assert len(client.get('/characters?limit=100').get_json()['data']) == len(characters)
+    response = client.post('/create/character', json={'name': 'Yoda', 'height': 66, 'mass': 17, 'gender': 'male'})
+    assert response.status_code == 200
+    names = [row['name'] for row in client.get('/characters?limit=100').get_json()['data']]
+    assert names[-1] == 'Yoda'
+
+def test_delete_invalidates_the_row_and_the_favorites(client, user, planets):
+    assert client.post(f'/user/{user}/favorites/add/planet', json={'planet_id': planets[1]}).status_code == 200
+    assert client.get(f'/planet/{planets[0]}').status_code == 200
+    assert len(client.get(f'/user/{user}/favorites').get_json()['favorite_planets']) == 1
+    assert client.delete(f'/delete/planet/{planets[0]}').status_code == 200
+    assert client.get(f'/planet/{planets[0]}').status_code == 404
+    client.post(f'/user/{user}/favorites/add/planet', json={'planet_id': planets[2]})
+    assert len(client.get(f'/user/{user}/favorites').get_json()['favorite_planets']) == 2
+
+def test_bulk_inserts_invalidate_the_pages(client, planets):
+    assert len(client.get('/planets?limit=100').get_json()['data']) == len(planets)
+    assert client.post('/bulk/planets', json=[{'name': 'Hoth', 'population': 1}]).status_code == 201
+    assert len(client.get('/planets?limit=100').get_json()['data']) == len(planets) + 1
+
+def test_writes_outside_the_api_invalidate(app, client, characters):
+    assert client.get(f'/characters/{characters[1]}').get_json()['data']['name'] == 'Character 1'
+    with app.app_context():
+        # what an admin edit does
+        db.session.get(Characters, characters[1]).name = 'Renamed'
+        db.session.commit()
+    assert client.get(f'/characters/{characters[1]}').get_json()['data']['name'] == 'Renamed'
+
+def test_rolled_back_writes_dont_invalidate(app, client, characters, statements):
+    client.get(f'/characters/{characters[1]}')
+    with app.app_context():
+        db.session.get(Characters, characters[1]).name = 'Renamed'
+        db.session.flush()
+        db.session.rollback()
+    statements.clear()
+    assert client.get(f'/characters/{characters[1]}').get_json()['data']['name'] == 'Character 1'
+    assert reads(statements, 'characters') == []
+
+def test_ids_lookups_share_the_row_entries(client, characters, statements):
+    client.get(f'/characters?ids={characters[0]},{characters[1]}')
+    statements.clear()
+    assert client.get(f'/characters/{characters[1]}').status_code == 200
+    assert reads(statements, 'characters') == []
+
+def test_a_load_that_overlaps_an_invalidation_is_not_stored(app, planets):
+    with app.app_context():
+        def loader():
+            value = db.session.get(Planets, planets[0]).serialize()
+            # another request commits while this load runs
+            db.session.get(Planets, planets[0]).name = 'Renamed'
+            db.session.commit()
+            return value
+        assert cache.cached(('planets', planets[0]), loader)['name'] == 'Planet 0'
+        assert cache.cache.get(('planets', planets[0])) is cache.MISSING
+
+def test_the_compressed_bodies_are_plain_keys_with_their_own_expiry(backend):
+    key = ('compressed', '/characters?', 'application/json', '"etag"', 'gzip')
+    cache.cache.set(key, (b'body', 'application/json'))
+    assert cache.cache.get(key) == (b'body', 'application/json')
+    if backend == 'redis':
+        name, field = cache.cache._split(key)
+        assert field is None
+        assert 0 < cache.cache.client.ttl(name) <= cache.cache.ttl
+
+@pytest.fixture
+def workers(redis_backend):
+    """
+    Two RedisBackends sharing one server, as two gunicorn workers would
+    """
+    return redis_backend(), redis_backend()
+
+def test_an_invalidation_reaches_every_worker(workers):
+    first, second = workers
+    first.set_many([(('characters', 1), 'luke'), (('planets', 1), 'tatooine')])
+    second.invalidate_namespace('characters')
+    assert first.get(('characters', 1)) is cache.MISSING
+    assert first.get(('planets', 1)) == 'tatooine'
+    assert first.generation('characters') == second.generation('characters') == 1
+    assert first.invalidated_at('characters') == second.invalidated_at('characters') > 0
+    assert first.invalidated_at('planets') == 0
+
+def test_a_value_loaded_before_another_workers_invalidation_is_not_stored(workers):
+    first, second = workers
+    generation = first.generation('characters')
+    # the second worker commits a change while the first one is loading
+    second.invalidate_namespace('characters')
+    first.set(('characters', 1), 'old luke', generation)
+    first.set_many([(('characters', 2), 'old leia'), (('characters', 'validator', 2), 'old')], generation)
+    assert second.get(('characters', 1)) is cache.MISSING
+    assert second.get_many([('characters', 2), ('characters', 'validator', 2)]) == [cache.MISSING, cache.MISSING]
+    first.set(('characters', 1), 'new luke', first.generation('characters'))
+    assert second.get(('characters', 1)) == 'new luke'
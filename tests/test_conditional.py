@@ -0,0 +1,51 @@
+from email.utils import format_datetime
+from datetime import datetime, timezone
+
+def test_list_etag_and_304(client, characters):
+    response = client.get('/characters')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert response.headers['Cache-Control'].startswith('public')
+    assert 'Accept' in response.headers['Vary']
+
+    not_modified = client.get('/characters', headers={'If-None-Match': etag})
+    assert not_modified.status_code == 304
+    assert not_modified.headers['ETag'] == etag
+    assert not_modified.data == b''
+
+def test_list_etag_depends_on_the_query_string(client, characters):
+    first = client.get('/characters?limit=2').headers['ETag']
+    assert client.get('/characters?limit=3', headers={'If-None-Match': first}).status_code == 200
+
+def test_json_etag_does_not_validate_the_ndjson_export(client, characters):
+    etag = client.get('/characters').headers['ETag']
+    response = client.get('/characters', headers={'If-None-Match': etag, 'Accept': 'application/x-ndjson'})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['ETag'] != etag
+
+def test_delete_changes_the_list_etag(client, characters):
+    etag = client.get('/characters').headers['ETag']
+    assert client.delete(f'/delete/character/{characters[-1]}').status_code == 200
+    response = client.get('/characters', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert characters[-1] not in [row['id'] for row in response.get_json()['data']]
+
+def test_list_ignores_if_modified_since(client, characters):
+    response = client.get('/characters')
+    assert 'Last-Modified' not in response.headers
+    future = format_datetime(datetime(2100, 1, 1, tzinfo=timezone.utc), usegmt=True)
+    assert client.get('/characters', headers={'If-Modified-Since': future}).status_code == 200
+
+def test_row_validators(client, characters):
+    response = client.get(f'/characters/{characters[0]}')
+    assert response.status_code == 200
+    assert 'Last-Modified' in response.headers
+    etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+    assert client.get(f'/characters/{characters[0]}', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get(f'/characters/{characters[0]}', headers={'If-Modified-Since': last_modified}).status_code == 304
+
+def test_missing_row_is_a_404_without_validators(client, characters):
+    response = client.get('/characters/9999')
+    assert response.status_code == 404
+    assert 'ETag' not in response.headers
@@ -0,0 +1,38 @@
+import cache
+
+def add_favorites(client, user, planets, characters):
+    for planet in planets:
+        assert client.post(f'/user/{user}/favorites/add/planet', json={'planet_id': planet}).status_code == 200
+    for character in characters:
+        assert client.post(f'/user/{user}/favorite/add/character', json={'character_id': character}).status_code == 201
+
+def test_favorites_come_with_their_details(client, user, planets, characters):
+    add_favorites(client, user, [planets[2], planets[1]], [characters[0]])
+    body = client.get(f'/user/{user}/favorites').get_json()
+    assert [favorite['planet_detail'] for favorite in body['favorite_planets']] == [
+        {'id': planets[2], 'name': 'Planet 2', 'population': 2000},
+        {'id': planets[1], 'name': 'Planet 1', 'population': 1000},
+    ]
+    assert [favorite['character_detail'] for favorite in body['favorite_characters']] == [
+        {'id': characters[0], 'name': 'Character 0'}]
+
+def test_favorites_are_read_in_one_statement(client, user, planets, characters, statements):
+    add_favorites(client, user, planets[:3], characters[:3])
+    cache.cache.clear()
+    statements.clear()
+    assert client.get(f'/user/{user}/favorites').status_code == 200
+    assert len(statements) == 1
+    assert 'UNION ALL' in statements[0]
+
+def test_missing_user_and_user_without_favorites(client, user, statements):
+    response = client.get('/user/9999/favorites')
+    assert response.status_code == 404
+    assert len(statements) == 1
+    response = client.get(f'/user/{user}/favorites')
+    assert response.status_code == 200
+    assert 'doesnt have favorites' in response.get_json()['Msg']
+
+def test_a_favorite_is_added_once(client, user, planets, characters):
+    add_favorites(client, user, [planets[0]], [characters[0]])
+    assert client.post(f'/user/{user}/favorites/add/planet', json={'planet_id': planets[0]}).status_code == 409
+    assert client.post(f'/user/{user}/favorite/add/character', json={'character_id': characters[0]}).status_code == 409
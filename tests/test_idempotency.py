@@ -0,0 +1,47 @@
+from models import db, Planets
+
+def count_planets(app, name):
+    with app.app_context():
+        return db.session.scalar(db.select(db.func.count()).where(Planets.name == name))
+
+def test_retry_replays_the_stored_response(app, client):
+    headers = {'Idempotency-Key': 'create-tatooine'}
+    first = client.post('/create/planet', json={'name': 'Tatooine', 'population': 200000}, headers=headers)
+    retry = client.post('/create/planet', json={'name': 'Tatooine', 'population': 200000}, headers=headers)
+    assert first.status_code == retry.status_code
+    assert first.status_code < 300
+    assert retry.get_json() == first.get_json()
+    assert 'Idempotent-Replayed' not in first.headers
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert count_planets(app, 'Tatooine') == 1
+
+def test_key_reused_with_another_body_is_a_422(app, client):
+    headers = {'Idempotency-Key': 'create-hoth'}
+    assert client.post('/create/planet', json={'name': 'Hoth', 'population': 1}, headers=headers).status_code < 300
+    response = client.post('/create/planet', json={'name': 'Dagobah', 'population': 1}, headers=headers)
+    assert response.status_code == 422
+    assert count_planets(app, 'Dagobah') == 0
+
+def test_key_reused_with_another_query_string_is_a_422(client):
+    headers = {'Idempotency-Key': 'create-endor'}
+    assert client.post('/create/planet', json={'name': 'Endor', 'population': 1}, headers=headers).status_code < 300
+    response = client.post('/create/planet?async=1', json={'name': 'Endor', 'population': 1}, headers=headers)
+    assert response.status_code == 422
+
+def test_keys_are_scoped_to_the_route(client):
+    headers = {'Idempotency-Key': 'same-key'}
+    planet = client.post('/create/planet', json={'name': 'Naboo', 'population': 1}, headers=headers)
+    character = client.post('/create/character', json={'name': 'Padme', 'height': 165, 'mass': 45, 'gender': 'female'},
+                            headers=headers)
+    assert planet.status_code < 300 and character.status_code < 300
+    assert 'Idempotent-Replayed' not in character.headers
+
+def test_requests_without_a_key_are_not_deduplicated(app, client):
+    client.post('/create/planet', json={'name': 'Kamino', 'population': 1})
+    response = client.post('/create/planet', json={'name': 'Kamino', 'population': 1})
+    assert response.status_code == 409
+    assert 'Idempotent-Replayed' not in response.headers
+
+def test_invalid_key_is_a_400(client):
+    response = client.post('/create/planet', json={'name': 'Bespin', 'population': 1}, headers={'Idempotency-Key': 'k' * 256})
+    assert response.status_code == 400
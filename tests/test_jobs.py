@@ -0,0 +1,131 @@
+from datetime import timedelta
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+from models import db, utcnow, Job, Planets
+import jobs
+
+def enqueue_planet(client, name, population=1):
+    response = client.post('/create/planet?async=1', json={'name': name, 'population': population})
+    assert response.status_code == 202
+    assert response.headers['Location'].endswith(f"/jobs/{response.get_json()['data']['id']}")
+    return response.headers['Location']
+
+def job(client, location):
+    return client.get(location).get_json()['data']
+
+def failing_on(name, error):
+    """
+    The create_planet handler, raising error at write time when the batch
+    holds a planet called name
+    """
+    handler = jobs.HANDLERS['create_planet']
+    def handle(items, batch_size):
+        if any(item.get('name') == name for item in items):
+            raise error
+        return handler(items, batch_size)
+    return handle
+
+def test_accepted_job_is_done_after_a_drain(app, client):
+    location = enqueue_planet(client, 'Alderaan', 2000000000)
+    assert job(client, location)['status'] == 'queued'
+    assert jobs.drain_once(app) == 1
+    done = job(client, location)
+    assert done['status'] == 'done'
+    assert done['attempts'] == 1
+    planet = client.get(f"/planet/{done['result']['id']}").get_json()
+    assert planet['Data']['name'] == 'Alderaan'
+
+def test_invalid_jobs_fail_without_failing_the_batch(app, client):
+    valid = enqueue_planet(client, 'Yavin')
+    invalid = enqueue_planet(client, 'Scarif', population='many')
+    repeated = enqueue_planet(client, 'Yavin')
+    jobs.drain_once(app)
+    assert job(client, valid)['status'] == 'done'
+    assert job(client, invalid)['status'] == 'failed'
+    assert 'population' in job(client, invalid)['error']
+    assert job(client, repeated)['status'] == 'failed'
+    assert job(client, repeated)['error'] == 'name repeated in the request'
+
+def test_integer_out_of_range_fails_the_job_not_the_request(app, client):
+    response = client.post('/create/character?async=1', json={'name': 'Jabba', 'height': 175, 'mass': 2 ** 70})
+    assert response.status_code == 202
+    jobs.drain_once(app)
+    failed = job(client, response.headers['Location'])
+    assert failed['status'] == 'failed'
+    assert failed['error'] == 'mass must be a positive integer'
+
+@pytest.mark.parametrize('error, message', [
+    (IntegrityError('INSERT', {}, Exception('UNIQUE constraint failed')), 'Conflicts with an existing row'),
+    (ValueError('unwritable'), 'Could not be written: ValueError'),
+])
+def test_write_failure_is_isolated_to_its_job(app, client, monkeypatch, error, message):
+    monkeypatch.setitem(jobs.HANDLERS, 'create_planet', failing_on('Mustafar', error))
+    before = enqueue_planet(client, 'Jakku')
+    failing = enqueue_planet(client, 'Mustafar')
+    after = enqueue_planet(client, 'Crait')
+    jobs.drain_once(app)
+    assert job(client, before)['status'] == 'done'
+    assert job(client, after)['status'] == 'done'
+    assert job(client, failing)['status'] == 'failed'
+    assert job(client, failing)['error'] == message
+
+def test_database_errors_leave_the_jobs_claimed(app, client, monkeypatch):
+    monkeypatch.setitem(jobs.HANDLERS, 'create_planet', failing_on('Kessel', OperationalError('INSERT', {}, Exception('locked'))))
+    location = enqueue_planet(client, 'Kessel')
+    with pytest.raises(OperationalError):
+        jobs.drain_once(app)
+    assert job(client, location)['status'] == 'running'
+    with app.app_context():
+        assert db.session.scalar(db.select(db.func.count()).select_from(Planets)) == 0
+
+def test_unknown_kind_fails(app, client):
+    with app.app_context():
+        unknown = Job(kind='destroy_planet', payload='{}', status='queued', attempts=0)
+        db.session.add(unknown)
+        db.session.commit()
+        id = unknown.id
+    jobs.drain_once(app)
+    failed = job(client, f'/jobs/{id}')
+    assert failed['status'] == 'failed'
+    assert failed['error'] == 'Unknown job kind destroy_planet'
+
+def test_stale_running_jobs_are_requeued_then_given_up(app, client):
+    location = enqueue_planet(client, 'Dantooine')
+    id = int(location.rsplit('/', 1)[1])
+    with app.app_context():
+        db.session.execute(db.update(Job).where(Job.id == id)
+                           .values(status='running', attempts=1, started_at=utcnow() - timedelta(hours=1)))
+        db.session.commit()
+        jobs.requeue_stale(timeout=60, max_attempts=2)
+    assert job(client, location)['status'] == 'queued'
+    with app.app_context():
+        db.session.execute(db.update(Job).where(Job.id == id)
+                           .values(status='running', attempts=2, started_at=utcnow() - timedelta(hours=1)))
+        db.session.commit()
+        jobs.requeue_stale(timeout=60, max_attempts=2)
+    given_up = job(client, location)
+    assert given_up['status'] == 'failed'
+    assert given_up['error'] == 'Gave up after 2 attempts'
+
+def test_missing_job_is_a_404(client):
+    assert client.get('/jobs/12345').status_code == 404
+
+def test_web_requests_start_no_workers_by_default(app, client, characters):
+    assert app.config['JOBS_WORKERS'] == 0
+    client.get('/characters')
+    enqueue_planet(client, 'Hoth')
+    assert jobs.pool is None
+
+def test_workers_start_on_the_first_enqueue(app, client, monkeypatch):
+    class Pool(jobs.WorkerPool):
+        def start(self):
+            started.append(self.size)
+    started = []
+    monkeypatch.setitem(app.config, 'JOBS_WORKERS', 2)
+    monkeypatch.setattr(jobs, 'WorkerPool', Pool)
+    monkeypatch.setattr(jobs, 'pool', None)
+    client.get('/planets')
+    assert started == []
+    enqueue_planet(client, 'Hoth')
+    enqueue_planet(client, 'Dagobah')
+    assert started == [2]
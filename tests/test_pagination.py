@@ -0,0 +1,80 @@
+from utils import encode_cursor
+
+def walk(client, query):
+    ids = []
+    after = None
+    while True:
+        response = client.get(f'/characters?{query}&fields=id,Mass,gender&limit=3' + (f'&after={after}' if after else ''))
+        assert response.status_code == 200, response.get_json()
+        body = response.get_json()
+        assert len(body['data']) <= 3
+        ids.extend(row['id'] for row in body['data'])
+        after = body['next']
+        if after is None:
+            return ids
+
+def test_id_cursor_walks_every_row_once(client, characters):
+    assert walk(client, 'sort=') == characters
+
+def test_id_cursor_resumes_after_the_last_id(client, characters):
+    body = client.get(f'/characters?limit=2&after={characters[3]}').get_json()
+    assert [row['id'] for row in body['data']] == characters[4:6]
+    assert body['next'] == characters[5]
+
+def test_last_page_has_no_cursor(client, characters):
+    body = client.get(f'/characters?limit={len(characters)}').get_json()
+    assert len(body['data']) == len(characters)
+    assert body['next'] is None
+
+def test_id_cursor_out_of_range_is_a_400(client, characters):
+    for path in ('/characters', '/planets'):
+        response = client.get(f'{path}?after=99999999999999999999')
+        assert response.status_code == 400
+        assert 'after' in response.get_json()['message']
+    assert client.get('/characters?after=-1').status_code == 400
+
+def test_sort_by_nullable_column_keeps_null_rows_last(client, characters):
+    body = client.get(f'/characters?sort=Mass&fields=id,Mass&limit={len(characters)}').get_json()
+    masses = [row['Mass'] for row in body['data']]
+    assert len(masses) == len(characters)
+    values = [mass for mass in masses if mass is not None]
+    assert masses == values + [None] * (len(masses) - len(values))
+    assert values == sorted(values)
+
+def test_sort_cursor_walks_into_the_null_rows(client, characters):
+    rows = client.get(f'/characters?sort=-Mass&fields=id,Mass&limit={len(characters)}').get_json()['data']
+    assert walk(client, 'sort=-Mass') == [row['id'] for row in rows]
+    assert sorted(walk(client, 'sort=gender')) == characters
+
+def test_null_rows_are_ordered_by_id_in_the_sort_direction(client, characters):
+    ascending = [row['id'] for row in client.get('/characters?sort=Mass&fields=id,Mass&limit=100').get_json()['data']
+                 if row['Mass'] is None]
+    descending = [row['id'] for row in client.get('/characters?sort=-Mass&fields=id,Mass&limit=100').get_json()['data']
+                  if row['Mass'] is None]
+    assert ascending == sorted(ascending)
+    assert descending == sorted(ascending, reverse=True)
+
+def test_filter_on_the_sort_column_leaves_out_null_rows(client, characters):
+    body = client.get('/characters?sort=Mass&Mass__gte=50&fields=id,Mass&limit=100').get_json()
+    assert [row['Mass'] for row in body['data']] == [80, 80, 136]
+
+def test_invalid_cursor_is_a_400(client, characters):
+    assert client.get('/characters?sort=Mass&after=not-a-cursor').status_code == 400
+    assert client.get('/characters?sort=Mass&after=' + encode_cursor('heavy', 1)).status_code == 400
+
+def test_unknown_sort_field_is_a_400(client, characters):
+    response = client.get('/characters?sort=weight')
+    assert response.status_code == 400
+    assert 'Mass' in response.get_json()['allowed']
+
+def test_out_of_range_filter_values_are_a_400(client, planets):
+    for value in ('99999999999999999999999', '1e20', '-1e20', '1e400'):
+        response = client.get(f'/planets?population__gt={value}')
+        assert response.status_code == 400
+        assert 'population__gt' in response.get_json()['message']
+    assert client.get('/planets?population__in=1000,1e20').status_code == 400
+    assert client.get(f'/planets?population__lte={2**31 - 1}').status_code == 200
+
+def test_out_of_range_sort_cursor_is_a_400(client, characters):
+    for cursor in (encode_cursor(10**30, 1), encode_cursor(80, 10**30), encode_cursor(None, 10**30)):
+        assert client.get('/characters?sort=Mass&after=' + cursor).status_code == 400
@@ -0,0 +1,67 @@
+import pytest
+import ratelimit
+
+@pytest.fixture
+def limits(monkeypatch):
+    """
+    limits(burst, concurrency=8) with a bucket that doesn't refill during
+    the test
+    """
+    def set_limits(burst, concurrency=8):
+        monkeypatch.setattr(ratelimit, 'rate', 0.001)
+        monkeypatch.setattr(ratelimit, 'burst', burst)
+        monkeypatch.setattr(ratelimit, 'concurrency', concurrency)
+    return set_limits
+
+def from_ip(address):
+    return {'REMOTE_ADDR': address}
+
+def test_empty_bucket_answers_429_with_retry_after(client, characters, limits):
+    limits(burst=10)
+    # a list page costs 5 tokens
+    assert client.get('/characters').status_code == 200
+    assert client.get('/characters').status_code == 200
+    response = client.get('/characters')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert response.get_json()['message'] == 'Rate limit exceeded'
+
+def test_clients_have_their_own_buckets(client, characters, limits):
+    limits(burst=5)
+    assert client.get('/characters', environ_base=from_ip('10.0.0.1')).status_code == 200
+    assert client.get('/characters', environ_base=from_ip('10.0.0.1')).status_code == 429
+    assert client.get('/characters', environ_base=from_ip('10.0.0.2')).status_code == 200
+
+def test_clients_cant_drain_each_others_user_routes(client, user, limits):
+    limits(burst=2)
+    for _ in range(2):
+        assert client.get(f'/user/{user}/favorites', environ_base=from_ip('10.0.0.1')).status_code == 200
+    assert client.get(f'/user/{user}/favorites', environ_base=from_ip('10.0.0.1')).status_code == 429
+    # the user id in the URL doesn't pick a bucket, the victim's own requests still pass
+    assert client.get(f'/user/{user}/favorites', environ_base=from_ip('10.0.0.2')).status_code == 200
+
+def test_concurrency_quota(client, characters, limits):
+    limits(burst=100, concurrency=0)
+    response = client.get('/characters/1')
+    assert response.status_code == 429
+    assert response.get_json()['message'] == 'Too many concurrent requests'
+
+def test_requests_turned_away_for_concurrency_dont_pay(client, characters, limits):
+    limits(burst=5, concurrency=0)
+    for _ in range(3):
+        assert client.get('/characters').status_code == 429
+    limits(burst=5, concurrency=1)
+    assert client.get('/characters').status_code == 200
+
+def test_slots_are_released_after_each_request(client, characters, limits):
+    limits(burst=100, concurrency=1)
+    for _ in range(5):
+        assert client.get(f'/characters/{characters[0]}').status_code == 200
+
+def test_preflight_and_metrics_are_free(client, limits):
+    limits(burst=1)
+    # a cost over the burst takes the whole bucket
+    assert client.get('/characters').status_code == 200
+    assert client.get('/characters').status_code == 429
+    assert client.options('/characters').status_code != 429
+    assert client.get('/metrics').status_code == 200
@@ -0,0 +1,69 @@
+import pytest
+from models import db, Characters
+import replicas
+
+def on_replica(replica_set, **values):
+    with replica_set.replicas[0].engine.begin() as connection:
+        return connection.execute(db.insert(Characters).values(**values).returning(Characters.id)).scalar()
+
+@pytest.fixture
+def replica(app, monkeypatch, tmp_path):
+    """
+    A replica on its own SQLite file with the schema and nothing else, rows
+    written to the primary never reach it: a replica lagging forever
+    """
+    replica_set = replicas.ReplicaSet(['sqlite:///' + str(tmp_path / 'replica.db')], check_interval=3600)
+    db.metadata.create_all(replica_set.replicas[0].engine)
+    monkeypatch.setattr(replicas, 'replica_set', replica_set)
+    monkeypatch.setitem(app.after_request_funcs, None, app.after_request_funcs.get(None, []) + [replicas._remember_writer])
+    yield replica_set
+    replica_set.dispose()
+
+def other_client(app, address='10.0.0.2'):
+    client = app.test_client()
+    client.environ_base['REMOTE_ADDR'] = address
+    return client
+
+def names(client):
+    return [row['name'] for row in client.get('/characters?limit=100').get_json()['data']]
+
+def test_get_requests_read_from_the_replica(client, characters, replica, monkeypatch):
+    # the characters were just written, past the window the page is filled from the replica
+    monkeypatch.setattr(replica, 'sticky_seconds', 0)
+    id = on_replica(replica, name='Only on the replica', height=1)
+    assert names(client) == ['Only on the replica']
+    assert client.get(f'/characters/{id}').get_json()['data']['name'] == 'Only on the replica'
+
+def test_writers_read_their_own_writes(app, client, user, replica):
+    # /user is not cached, its reads show where the client is routed
+    assert client.get('/user').get_json()['data'] == []
+    assert client.post('/create/planet', json={'name': 'Hoth', 'population': 1}).status_code == 200
+    assert client.get_cookie('read_primary_until') is not None
+    assert [row['id'] for row in client.get('/user').get_json()['data']] == [user]
+    # another worker only has the cookie to go by
+    replica._recent_writers.clear()
+    assert [row['id'] for row in client.get('/user').get_json()['data']] == [user]
+    assert other_client(app).get('/user').get_json()['data'] == []
+
+def test_cache_fills_after_a_write_read_the_primary(app, client, replica):
+    on_replica(replica, name='Only on the replica', height=1)
+    assert client.post('/create/character', json={'name': 'Yoda', 'height': 66, 'mass': 17, 'gender': 'male'}).status_code == 200
+    # another client, not sticky, fills the shared page right after the write
+    reader = other_client(app)
+    assert names(reader) == ['Yoda']
+    assert names(other_client(app, '10.0.0.3')) == ['Yoda']
+
+def test_cache_fills_read_the_replica_once_the_window_is_over(app, client, replica, monkeypatch):
+    on_replica(replica, name='Only on the replica', height=1)
+    assert client.post('/create/character', json={'name': 'Yoda', 'height': 66, 'mass': 17, 'gender': 'male'}).status_code == 200
+    monkeypatch.setattr(replica, 'sticky_seconds', 0)
+    assert names(other_client(app)) == ['Only on the replica']
+
+def test_a_failed_replica_read_is_retried_on_the_primary(app, client, characters, monkeypatch, tmp_path):
+    broken = replicas.ReplicaSet(['sqlite:///' + str(tmp_path / 'missing' / 'replica.db')], check_interval=3600,
+                                 sticky_seconds=0)
+    monkeypatch.setattr(replicas, 'replica_set', broken)
+    assert len(names(client)) == len(characters)
+    assert client.get(f'/characters/{characters[0]}').status_code == 200
+    assert not broken.replicas[0].healthy
+    assert broken.choose() is None
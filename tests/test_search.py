@@ -0,0 +1,71 @@
+import pytest
+from models import db, Characters, Planets
+import search
+
+@pytest.fixture
+def rebuilds(monkeypatch):
+    """
+    The number of full index rebuilds so far
+    """
+    calls = []
+    rebuild = search.name_index.rebuild
+    def counting():
+        calls.append(1)
+        rebuild()
+    monkeypatch.setattr(search.name_index, 'rebuild', counting)
+    return calls
+
+def found(client, query):
+    return [row['name'] for row in client.get(f'/search?q={query}').get_json()['data']]
+
+def test_exact_names_rank_before_prefixes_and_tokens(client, make_rows):
+    make_rows(Characters, [{'name': name, 'height': 1} for name in ('Darth Vader', 'Vader', 'Vaderling', 'Anakin')])
+    assert found(client, 'vader') == ['Vader', 'Vaderling', 'Darth Vader']
+    assert found(client, 'dar vad') == ['Darth Vader']
+    assert found(client, 'yoda') == []
+
+def test_api_writes_update_the_index_in_place(client, planets, rebuilds):
+    assert found(client, 'hoth') == []
+    assert client.post('/create/planet', json={'name': 'Hoth', 'population': 1}).status_code == 200
+    assert client.post('/bulk/planets', json=[{'name': 'Hoth Moon', 'population': 1}]).status_code == 201
+    assert found(client, 'hoth') == ['Hoth', 'Hoth Moon']
+    assert client.delete(f'/delete/planet/{planets[1]}').status_code == 200
+    assert found(client, 'planet') == ['Planet 0', 'Planet 2', 'Planet 3', 'Planet 4']
+    assert len(rebuilds) == 1
+
+def test_renames_outside_the_api_are_applied(app, client, characters, rebuilds):
+    assert found(client, 'character 1') == ['Character 1']
+    with app.app_context():
+        db.session.get(Characters, characters[1]).name = 'Chewbacca'
+        db.session.commit()
+    assert found(client, 'chewbacca') == ['Chewbacca']
+    assert found(client, 'character 1') == []
+    assert len(rebuilds) == 1
+
+def test_rolled_back_writes_are_not_indexed(app, client, planets, rebuilds):
+    found(client, 'planet')
+    with app.app_context():
+        db.session.add(Planets(name='Alderaan', population=1))
+        db.session.flush()
+        db.session.rollback()
+    assert found(client, 'alderaan') == []
+    assert len(rebuilds) == 1
+
+def test_bulk_updates_rebuild_the_index(app, client, planets, rebuilds):
+    found(client, 'planet')
+    with app.app_context():
+        db.session.execute(db.update(Planets).where(Planets.id == planets[0]).values(name='Naboo'))
+        db.session.commit()
+    assert found(client, 'naboo') == ['Naboo']
+    assert len(rebuilds) == 2
+
+def test_name_prefix_pages(client, characters):
+    body = client.get('/characters?name_prefix=character&limit=3').get_json()
+    assert [row['id'] for row in body['data']] == characters[:3]
+    body = client.get(f"/characters?name_prefix=character&limit=3&after={body['next']}").get_json()
+    assert [row['id'] for row in body['data']] == characters[3:6]
+
+def test_invalid_searches_are_a_400(client):
+    assert client.get('/search').status_code == 400
+    assert client.get('/search?q=x&type=ships').status_code == 400
+    assert client.get('/search?q=x&limit=many').status_code == 400
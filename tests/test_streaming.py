@@ -0,0 +1,37 @@
+import json
+
+def ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+def test_accept_header_streams_ndjson(client, characters):
+    response = client.get('/characters', headers={'Accept': 'application/x-ndjson'})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.is_streamed
+    assert [row['id'] for row in ndjson(response)] == characters
+
+def test_stream_json_is_one_array(client, planets):
+    response = client.get('/planets?stream=json&fields=id,population')
+    assert response.mimetype == 'application/json'
+    assert response.get_json() == [{'id': id, 'population': 1000 * i} for i, id in enumerate(planets)]
+
+def test_rows_are_read_in_batches(app, client, characters, monkeypatch):
+    monkeypatch.setitem(app.config, 'STREAM_BATCH_SIZE', 3)
+    assert [row['id'] for row in ndjson(client.get('/characters?stream=1'))] == characters
+    assert [row['id'] for row in client.get('/characters?stream=json').get_json()] == characters
+
+def test_export_follows_filters_sort_and_cursor(app, client, characters, monkeypatch):
+    monkeypatch.setitem(app.config, 'STREAM_BATCH_SIZE', 2)
+    page = client.get(f'/characters?sort=-Mass&fields=id,Mass&limit={len(characters)}').get_json()['data']
+    assert ndjson(client.get('/characters?stream=1&sort=-Mass&fields=id,Mass')) == page
+    rows = ndjson(client.get(f'/characters?stream=1&gender=male&after={characters[0]}'))
+    assert [row['id'] for row in rows] == [characters[3], characters[7]]
+
+def test_empty_export(client):
+    assert client.get('/planets?stream=1').get_data() == b''
+    assert client.get('/planets?stream=json').get_json() == []
+
+def test_invalid_arguments_fail_before_streaming(client, characters):
+    response = client.get('/characters?stream=1&fields=weight')
+    assert response.status_code == 400
+    assert response.mimetype == 'application/json'